@@ -23,6 +23,10 @@ argparser.add_argument('-sp', '--statsport', dest='statsport', default=5100,
 argparser.add_argument('-s', '--simulation', action='store_false', dest='simulation', help='Run simulation')
 argparser.add_argument('-d', '--docker', dest='docker', action='store_true', default=False,
                        help='Run framework in docker (default: False)')
+argparser.add_argument('-la', '--launcher', dest='launcher', default="cmd", choices=["cmd", "forkserver", "inprocess"],
+                       help='Launcher of the simulated participants: one process per participant (cmd), one process per participant forked from a server with the modules preloaded (forkserver) or a pool of processes (inprocess) (default: cmd)')
+argparser.add_argument('-wk', '--workers', dest='workers', type=int, default=None,
+                       help='Worker processes of the inprocess launcher (default: up to 4)')
 argparser.add_argument('-c', '--config', dest='config', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config'),
                        help='Config directory path')
 argparser.add_argument('-l', '--logs', dest='logs', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'),
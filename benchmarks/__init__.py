@@ -0,0 +1,4 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
@@ -0,0 +1,67 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Runs the benchmarks, optionally storing the results and comparing them with a baseline.
+
+    python -m benchmarks --group micro --output results.json
+    python -m benchmarks --baseline results.json --fail-on-regression
+"""
+import argparse
+import logging
+import sys
+
+from benchmarks import imports, macro, micro  # noqa: F401 (register the benchmarks)
+from benchmarks.harness import BENCHMARKS, Runner, compare, load_results, print_comparison, save_results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the fedstellar hot paths")
+    parser.add_argument("--group", action="append", choices=["micro", "macro"], help="Groups to run (all if not given)")
+    parser.add_argument("--filter", action="append", help="Run the benchmarks whose name contains the value")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    parser.add_argument("--output", help="Store the results (JSON)")
+    parser.add_argument("--baseline", help="Compare with the results of a previous run (JSON)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change considered a regression (default 0.1)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any case regressed")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of each measurement")
+    parser.add_argument("--quick", action="store_true", help="Fewer and shorter repetitions (smoke run)")
+    parser.add_argument("--models", nargs="+", help="Models of the parameters benchmark (all if not given)")
+    parser.add_argument("--nodes", type=int, default=4, help="Nodes of the localhost scenario")
+    parser.add_argument("--des-nodes", type=int, default=100, help="Nodes of the simulated scenario")
+    parser.add_argument("--rounds", type=int, default=3, help="Rounds of the macro scenarios")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.list:
+        for name, group, function in BENCHMARKS:
+            print("{:<20} {:<6} {}".format(name, group, (function.__doc__ or "").strip().splitlines()[0]))
+        return 0
+
+    options = {"nodes": args.nodes, "des_nodes": args.des_nodes, "rounds": args.rounds}
+    if args.models:
+        options["models"] = args.models
+    if args.quick:
+        runner = Runner(repeat=3, min_time=0.05, options=options)
+    else:
+        runner = Runner(repeat=args.repeat, options=options)
+    results = runner.run(names=args.filter, groups=args.group)
+
+    if args.output:
+        save_results(results, args.output)
+        print("\nResults stored in {}".format(args.output))
+
+    if args.baseline:
+        rows = compare(results, load_results(args.baseline), args.threshold)
+        print_comparison(rows)
+        if args.fail_on_regression and any(status == "regression" for *_, status in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Registry, timing, results and baseline comparison of the benchmarks.
+
+A benchmark is a function registered with ``@benchmark(name, group)`` that receives a ``Runner`` and measures
+one or more cases with ``runner.measure(case, fn)`` (timed by repetition) or ``runner.record(case, samples)``
+(samples measured by the benchmark itself, e.g. the rounds of a scenario).
+"""
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+
+BENCHMARKS = []
+
+RESULTS_VERSION = 1
+
+
+class Skip(Exception):
+    """
+    Raised by a benchmark when it cannot run (e.g. a missing optional dependency).
+    """
+
+
+def benchmark(name, group="micro"):
+    """
+    Registers a benchmark.
+
+    Args:
+        name (str): Name of the benchmark.
+        group (str): "micro" or "macro".
+    """
+
+    def register(function):
+        BENCHMARKS.append((name, group, function))
+        return function
+
+    return register
+
+
+def seed_everything(seed=0):
+    random.seed(seed)
+    try:
+        import numpy as np
+        np.random.seed(seed)
+    except ImportError:
+        pass
+    try:
+        import torch
+        torch.manual_seed(seed)
+    except ImportError:
+        pass
+
+
+def environment():
+    """
+    Returns:
+        dict: Information of the host and the libraries (to interpret the comparisons).
+    """
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+    try:
+        import torch
+        env["torch"] = torch.__version__
+        env["torch_threads"] = torch.get_num_threads()
+        env["cuda"] = torch.cuda.is_available()
+    except ImportError:
+        pass
+    return env
+
+
+################
+#    Runner    #
+################
+
+
+class Runner:
+    """
+    Measures the cases of the benchmarks and collects the results.
+
+    Args:
+        repeat (int): Repetitions of each measurement (the median is compared).
+        min_time (float): Minimum seconds of each repetition (calls are batched to reach it).
+        options (dict): Options of the benchmarks (e.g. nodes and rounds of the macro benchmarks).
+    """
+
+    def __init__(self, repeat=5, min_time=0.2, options=None):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.options = options or {}
+        self.results = []
+        self.current = None
+
+    def measure(self, case, fn, **extra):
+        """
+        Times a callable.
+
+        Args:
+            case (str): Name of the case.
+            fn (callable): Function to time (without arguments).
+            extra: Values stored with the result (e.g. bytes processed).
+
+        Returns:
+            dict: Result of the case.
+        """
+        timer = timeit.Timer(fn)
+        number = 1
+        while True:
+            elapsed = timer.timeit(number)
+            if elapsed >= self.min_time or number >= 1_000_000:
+                break
+            number = max(number * 2, int(number * self.min_time / max(elapsed, 1e-9)))
+        samples = [elapsed / number] + [timer.timeit(number) / number for _ in range(self.repeat - 1)]
+        return self.record(case, samples, number=number, **extra)
+
+    def record(self, case, samples, **extra):
+        """
+        Stores samples (seconds) measured by the benchmark.
+        """
+        result = {
+            "benchmark": self.current,
+            "case": case,
+            "median": statistics.median(samples),
+            "mean": statistics.fmean(samples),
+            "min": min(samples),
+            "max": max(samples),
+            "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            "samples": len(samples),
+        }
+        result.update(extra)
+        self.results.append(result)
+        print("  {:<40} {:>12} (±{:.1f}%)".format(case, format_time(result["median"]), 100 * result["stdev"] / result["median"] if result["median"] else 0))
+        return result
+
+    def run(self, names=None, groups=None):
+        """
+        Runs the registered benchmarks (filtered by name substrings and groups).
+
+        Returns:
+            dict: Results document.
+        """
+        skipped = {}
+        for name, group, function in BENCHMARKS:
+            if groups and group not in groups:
+                continue
+            if names and not any(n in name for n in names):
+                continue
+            print("{} ({})".format(name, group))
+            self.current = name
+            seed_everything()
+            try:
+                function(self)
+            except Skip as e:
+                skipped[name] = str(e)
+                print("  skipped: {}".format(e))
+        return {
+            "version": RESULTS_VERSION,
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "environment": environment(),
+            "options": {"repeat": self.repeat, "min_time": self.min_time, **self.options},
+            "results": self.results,
+            "skipped": skipped,
+        }
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.3f} {}".format(seconds / scale, unit)
+    return "{:.1f} ns".format(seconds / 1e-9)
+
+
+####################
+#    Comparison    #
+####################
+
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        results = json.load(f)
+    if results.get("version") != RESULTS_VERSION:
+        raise ValueError("Unsupported results version in {}".format(path))
+    return results
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Compares the medians of the cases present in both results.
+
+    Args:
+        current (dict): Results of this run.
+        baseline (dict): Results of the baseline.
+        threshold (float): Relative change considered a regression (or an improvement).
+
+    Returns:
+        list: (benchmark, case, baseline median, current median, ratio, status) of each case.
+    """
+    base = {(r["benchmark"], r["case"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        key = (result["benchmark"], result["case"])
+        if key not in base or not base[key]["median"]:
+            continue
+        ratio = result["median"] / base[key]["median"]
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 - threshold:
+            status = "improvement"
+        else:
+            status = "="
+        rows.append((key[0], key[1], base[key]["median"], result["median"], ratio, status))
+    return rows
+
+
+def print_comparison(rows, stream=sys.stdout):
+    stream.write("\n{:<28} {:<40} {:>12} {:>12} {:>8}  {}\n".format("benchmark", "case", "baseline", "current", "ratio", "status"))
+    for name, case, base, current, ratio, status in rows:
+        stream.write("{:<28} {:<40} {:>12} {:>12} {:>8.2f}  {}\n".format(name, case, format_time(base), format_time(current), ratio, status))
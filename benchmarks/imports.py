@@ -0,0 +1,157 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Import time of the entry points of fedstellar, measured with ``python -X importtime`` in a new interpreter.
+
+Every entry point has a budget (cumulative import time) and modules it must not import: the datasets, models and
+loggers are imported when selected (see fedstellar.registry), and the plotting stack only to draw a topology. Libraries
+are attributed to the module that imports them: other libraries may import them (e.g. torchmetrics imports
+matplotlib), only the imports by fedstellar modules are reported.
+
+    python -m benchmarks.imports                   # exits with status 1 if an entry point exceeds its budget
+    python -m benchmarks.imports --scale 2         # slower hosts
+    python -m pytest tests                         # same check (tests/test_imports.py)
+    python -m benchmarks --filter imports          # measured with the other benchmarks (baseline comparison)
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from benchmarks.harness import Skip, benchmark, format_time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules of the components selected in participant.json, never imported by the entry points
+COMPONENTS = [
+    "fedstellar.learning.pytorch.mnist",
+    "fedstellar.learning.pytorch.femnist",
+    "fedstellar.learning.pytorch.syscall",
+    "fedstellar.learning.pytorch.cifar10",
+    "fedstellar.learning.pytorch.remotelogger",
+    "fedstellar.learning.pytorch.statisticslogger",
+    "fedstellar.learning.aggregators.fedavg",
+]
+# Libraries that fedstellar modules import when they are used (W&B logger, drawing a topology)
+LAZY_LIBRARIES = ["wandb", "matplotlib", "networkx"]
+
+# Entry point: (budget in seconds, components not imported, libraries not imported by fedstellar modules). The budget
+# of node_start is mostly the import of torch and Lightning
+ENTRY_POINTS = {
+    "fedstellar.node_start": (10.0, COMPONENTS, LAZY_LIBRARIES),
+    "fedstellar.controller": (1.0, COMPONENTS, LAZY_LIBRARIES + ["torch", "lightning"]),
+}
+
+
+def import_profile(module, python=sys.executable):
+    """
+    Imports a module in a new interpreter.
+
+    Returns:
+        dict: Cumulative import time (seconds) and importer (None for the top level) of every module imported.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    process = subprocess.run([python, "-X", "importtime", "-c", "import {}".format(module)], cwd=ROOT, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise ImportError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "exit status {}".format(process.returncode))
+    lines = [line for line in process.stderr.splitlines() if line.startswith("import time:") and "cumulative" not in line]
+    # A module is reported after the modules it imports, indented one more level
+    profile = {}
+    last_at_level = {}
+    for line in reversed(lines):
+        _, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        profile[name] = (int(cumulative) / 1e6, last_at_level.get(level - 1))
+        last_at_level[level] = name
+    return profile
+
+
+def _matches(name, prefixes):
+    return any(name == p or name.startswith(p + ".") for p in prefixes)
+
+
+def forbidden_imports(profile, components, libraries):
+    """
+    Returns:
+        list: Components imported and libraries imported by fedstellar modules (``"module (from importer)"``).
+    """
+    found = []
+    for name, (_, importer) in profile.items():
+        if importer is None:
+            continue
+        if (_matches(name, components) and not _matches(importer, components)) or (_matches(name, libraries) and _matches(importer, ["fedstellar"])):
+            found.append("{} (from {})".format(name, importer))
+    return sorted(found)
+
+
+def check_entry_point(module, scale=1.0, repeat=3, python=sys.executable):
+    """
+    Measures an entry point (best of ``repeat`` imports, after a first import that compiles the bytecode).
+
+    Returns:
+        tuple: (seconds, budget, forbidden modules imported, error), seconds is None if it can not be imported.
+    """
+    budget, components, libraries = ENTRY_POINTS[module]
+    try:
+        import_profile(module, python)
+        profiles = [import_profile(module, python) for _ in range(repeat)]
+    except ImportError as e:
+        return None, budget * scale, [], str(e)
+    best = min(profiles, key=lambda p: p[module][0])
+    return best[module][0], budget * scale, forbidden_imports(best, components, libraries), None
+
+
+def check(scale=1.0, repeat=3, python=sys.executable):
+    """
+    Returns:
+        list: (entry point, seconds, budget, forbidden modules imported, error) of every entry point.
+    """
+    return [(module,) + check_entry_point(module, scale, repeat, python) for module in ENTRY_POINTS]
+
+
+@benchmark("imports")
+def imports(runner):
+    """
+    Import time of the entry points (node_start, controller) in a new interpreter.
+    """
+    measured = False
+    for module in ENTRY_POINTS:
+        try:
+            import_profile(module)
+            samples = [import_profile(module)[module][0] for _ in range(runner.repeat)]
+        except ImportError as e:
+            print("  {:<40} skipped ({})".format(module, e))
+            continue
+        runner.record(module, samples)
+        measured = True
+    if not measured:
+        raise Skip("No entry point can be imported")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.imports", description="Import time budgets of the fedstellar entry points")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor applied to the budgets (slower hosts)")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports of each entry point (the best is compared)")
+    args = parser.parse_args()
+
+    failed = False
+    for module, seconds, budget, imported, error in check(args.scale, args.repeat):
+        if error is not None:
+            print("{:<28} skipped ({})".format(module, error))
+            continue
+        status = "ok"
+        if seconds > budget:
+            status, failed = "over budget", True
+        if imported:
+            status, failed = "imports {}".format(", ".join(imported)), True
+        print("{:<28} {:>10} / {:<10} {}".format(module, format_time(seconds), format_time(budget), status))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Macro benchmarks: duration of the rounds of complete federations.
+"""
+import logging
+import tempfile
+import time
+
+from benchmarks.harness import Skip, benchmark
+from benchmarks.micro import participant_config
+
+# Settings of the nodes of the localhost scenario (short periods, the scenario only lasts a few rounds)
+SCENARIO_SETTINGS = {
+    "HEARTBEAT_PERIOD": 1,
+    "WAIT_HEARTBEATS_CONVERGENCE": 2,
+    "NODE_TIMEOUT": 10,
+    "TRAIN_SET_SIZE": 100,
+}
+
+
+def _synthetic_data(samples, seed):
+    """
+    Data module with random MNIST-shaped samples (training cost without reading a dataset).
+    """
+    try:
+        import torch
+        from lightning import LightningDataModule
+        from fedstellar.learning.pytorch.tensorloader import TensorBatchLoader
+    except ImportError as e:
+        raise Skip("PyTorch not available ({})".format(e))
+
+    class SyntheticDataModule(LightningDataModule):
+        def __init__(self):
+            super().__init__()
+            generator = torch.Generator().manual_seed(seed)
+            self.data = torch.rand(samples, 1, 28, 28, generator=generator)
+            self.targets = torch.randint(0, 10, (samples,), generator=generator)
+            self.dataset = torch.utils.data.TensorDataset(self.data, self.targets)
+
+        def loader(self):
+            return TensorBatchLoader(self.dataset, self.data, self.targets, batch_size=32)
+
+        def train_dataloader(self):
+            return self.loader()
+
+        def val_dataloader(self):
+            return self.loader()
+
+        def test_dataloader(self):
+            return self.loader()
+
+    return SyntheticDataModule()
+
+
+def _ring(n):
+    return [(i, (i + 1) % n) for i in range(n)] if n > 2 else [(0, 1)]
+
+
+@benchmark("localhost_rounds", group="macro")
+def localhost_rounds(runner):
+    """
+    Rounds of a federation of N nodes (MNIST MLP, synthetic data) connected in a ring through localhost TCP.
+    """
+    try:
+        from fedstellar.node import Node
+        from fedstellar.learning.pytorch.mnist.models.mlp import MNISTModelMLP
+    except ImportError as e:
+        raise Skip("Node dependencies not available ({})".format(e))
+
+    n = runner.options.get("nodes", 4)
+    rounds = runner.options.get("rounds", 3)
+    timeout = runner.options.get("timeout", 600)
+    log_dir = tempfile.mkdtemp(prefix="fedstellar-benchmark-")
+
+    nodes = []
+    try:
+        for i in range(n):
+            config = participant_config(**SCENARIO_SETTINGS)
+            config.participant["scenario_args"].update({"name": "benchmark", "n_nodes": n, "controller": "127.0.0.1:1"})
+            config.participant["device_args"]["idx"] = i
+            config.participant["tracking_args"].update({"log_dir": log_dir, "config_dir": log_dir, "local_tracking": "csv", "instrumentation": False})
+            node = Node(i, "benchmark", MNISTModelMLP(seed=0), _synthetic_data(512, i), host="127.0.0.1", port=None, config=config)
+            node.start()
+            nodes.append(node)
+        # Node logs go to the temporary directory, only the benchmark output is printed
+        logging.getLogger().setLevel(logging.WARNING)
+
+        for a, b in _ring(n):
+            nodes[a].connect_to(nodes[b].host, nodes[b].port, full=False)
+        time.sleep(SCENARIO_SETTINGS["WAIT_HEARTBEATS_CONVERGENCE"] + 1)
+
+        start = time.monotonic()
+        nodes[0].set_start_learning(rounds=rounds, epochs=1)
+
+        # Duration of each round (the slowest node), the round of a node is None before starting and after finishing
+        durations = []
+        progress = [None] * n
+        last = start
+        deadline = start + timeout
+        while len(durations) < rounds and time.monotonic() < deadline:
+            for i, node in enumerate(nodes):
+                r = node.round
+                if r is not None:
+                    progress[i] = r
+                elif progress[i] is not None:
+                    progress[i] = rounds
+            finished = min(p or 0 for p in progress)
+            while len(durations) < min(finished, rounds):
+                now = time.monotonic()
+                durations.append(now - last)
+                last = now
+            time.sleep(0.05)
+        if len(durations) < rounds:
+            raise Skip("Scenario did not finish {} rounds in {} seconds".format(rounds, timeout))
+    finally:
+        for node in nodes:
+            node.stop()
+
+    runner.record("{} nodes round".format(n), durations, nodes=n)
+    runner.record("{} nodes total".format(n), [sum(durations)], nodes=n, rounds=rounds)
+
+
+@benchmark("des_rounds", group="macro")
+def des_rounds(runner):
+    """
+    Wall time of the discrete-event simulation of a federation (protocol overhead without training nor sockets).
+    """
+    from fedstellar.simulator.des import NetworkSimulator, random_topology
+
+    n = runner.options.get("des_nodes", 100)
+    rounds = runner.options.get("rounds", 3)
+    samples = []
+    for _ in range(runner.repeat):
+        simulator = NetworkSimulator(random_topology(n, 4, seed=0), rounds=rounds, heartbeats=False, seed=0)
+        report = simulator.run()
+        samples.append(report["wall_time"])
+    runner.record("{} nodes {} rounds".format(n, rounds), samples, nodes=n, events=report["events"], virtual_time=report["virtual_time"])
@@ -0,0 +1,310 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Micro benchmarks of the hot paths of a node: parameters (de)serialization, aggregation, message processing,
+model fragmentation and encryption, and of the generation of the topologies.
+"""
+import copy
+import json
+import os
+
+from benchmarks.harness import Skip, benchmark
+from fedstellar.communication_protocol import CommunicationProtocol
+from fedstellar.config.config import Config
+
+PARTICIPANT_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fedstellar", "config", "participant.json.example")
+
+
+def participant_config(**overrides):
+    """
+    Returns:
+        Config: Configuration of a participant (``participant.json.example`` with the overrides applied).
+    """
+    with open(PARTICIPANT_CONFIG) as f:
+        participant = json.load(f)
+    participant.update(copy.deepcopy(overrides))
+    config = Config(entity="participant")
+    config.participant = participant
+    return config
+
+
+class _NullLogger:
+    """
+    Logger of the learners built by the benchmarks (metrics are discarded).
+    """
+    global_step = 0
+
+    def log_metrics(self, metrics, step=None):
+        pass
+
+
+def _models():
+    """
+    Returns:
+        dict: Bundled models by name (only those whose dependencies are installed).
+    """
+    try:
+        from fedstellar.learning.pytorch.mnist.models.mlp import MNISTModelMLP
+        from fedstellar.learning.pytorch.mnist.models.cnn import MNISTModelCNN
+        from fedstellar.learning.pytorch.femnist.models.cnn import FEMNISTModelCNN
+        from fedstellar.learning.pytorch.cifar10.models.resnet import CIFAR10ModelResNet
+        from fedstellar.learning.pytorch.cifar10.models.fastermobilenet import FasterMobileNet
+        from fedstellar.learning.pytorch.cifar10.models.simplemobilenet import SimpleMobileNetV1
+    except ImportError as e:
+        raise Skip("PyTorch models not available ({})".format(e))
+
+    models = {
+        "mnist-mlp": MNISTModelMLP,
+        "mnist-cnn": MNISTModelCNN,
+        "femnist-cnn": FEMNISTModelCNN,
+        "cifar10-resnet9": lambda: CIFAR10ModelResNet(classifier="resnet9"),
+        "cifar10-resnet18": lambda: CIFAR10ModelResNet(classifier="resnet18"),
+        "cifar10-fastermobilenet": FasterMobileNet,
+        "cifar10-simplemobilenet": SimpleMobileNetV1,
+    }
+    try:
+        from fedstellar.learning.pytorch.syscall.models.mlp import SyscallModelMLP
+        from fedstellar.learning.pytorch.syscall.models.autoencoder import SyscallModelAutoencoder
+        models["syscall-mlp"] = SyscallModelMLP
+        models["syscall-autoencoder"] = SyscallModelAutoencoder
+    except ImportError:
+        pass
+    return models
+
+
+def _learner(model):
+    try:
+        from fedstellar.learning.pytorch.lightninglearner import LightningLearner
+    except ImportError as e:
+        raise Skip("Lightning not available ({})".format(e))
+    return LightningLearner(model, None, config=None, logger=_NullLogger())
+
+
+###################
+#    Learning     #
+###################
+
+
+@benchmark("parameters")
+def parameters(runner):
+    """
+    Encoding and decoding of the parameters of each bundled model.
+    """
+    models = _models()
+    selected = runner.options.get("models")
+    for name, build in models.items():
+        if selected and name not in selected:
+            continue
+        learner = _learner(build())
+        data = learner.encode_parameters()
+        runner.measure("encode {}".format(name), learner.encode_parameters, bytes=len(data))
+        runner.measure("decode {}".format(name), lambda: learner.decode_parameters(data), bytes=len(data))
+
+
+@benchmark("fedavg")
+def fedavg(runner):
+    """
+    FedAvg aggregation by number of models.
+    """
+    try:
+        from fedstellar.learning.aggregators.fedavg import FedAvg
+    except ImportError as e:
+        raise Skip("PyTorch not available ({})".format(e))
+    models = _models()
+    config = participant_config()
+    for name in ("mnist-mlp", "cifar10-resnet9"):
+        if name not in models:
+            continue
+        params = models[name]().state_dict()
+        for n in (2, 5, 10, 20):
+            aggregator = FedAvg(node_name="benchmark", config=config)
+            node_models = {"node{}".format(i): (params, 1 + i) for i in range(n)}
+            runner.measure("{} x{}".format(name, n), lambda: aggregator.aggregate(node_models))
+
+
+@benchmark("compression")
+def compression(runner):
+    """
+    Compression (top-k with error feedback, quantization) and reconstruction of a model by layer size.
+    """
+    import pickle
+
+    import numpy as np
+
+    from fedstellar.learning.compression import BF16, FP16, INT8, Quantizer, UpdateCompressor, decode_layers
+
+    rng = np.random.default_rng(0)
+    for size in (100_000, 1_000_000, 10_000_000):
+        reference = [rng.standard_normal(size).astype(np.float32)]
+        model = [reference[0] + 0.01 * rng.standard_normal(size).astype(np.float32)]
+        sender, receiver = UpdateCompressor(), UpdateCompressor()
+        sender.set_reference(reference)
+        receiver.set_reference(reference)
+
+        def compress():
+            sender.set_reference(reference)  # Drops the cached result
+            return sender.compress(model, ["node"], 1, own=True)
+
+        layers = compress()
+        encoded = len(pickle.dumps(layers))
+        runner.measure("topk compress {}".format(size), compress, bytes=encoded, ratio=model[0].nbytes / encoded)
+        runner.measure("topk decompress {}".format(size), lambda: receiver.decompress(layers, sender.reference_id), bytes=encoded)
+
+        for mode in (FP16, BF16, INT8):
+            quantizer = Quantizer(mode)
+            layers = quantizer.quantize(model)
+            encoded = len(pickle.dumps(layers))
+            runner.measure("{} quantize {}".format(mode, size), lambda: quantizer.quantize(model), bytes=encoded, ratio=model[0].nbytes / encoded)
+            runner.measure("{} dequantize {}".format(mode, size), lambda: decode_layers(layers), bytes=encoded)
+
+
+@benchmark("lossless")
+def lossless(runner):
+    """
+    Lossless compression (byte shuffle and each installed codec) of encoded float32 parameters.
+    """
+    import pickle
+
+    import numpy as np
+
+    from fedstellar.lossless import LEVELS, LosslessCodec, available_codecs, decompress
+
+    rng = np.random.default_rng(0)
+    data = pickle.dumps(([(0.05 * rng.standard_normal(2_500_000)).astype(np.float32)], ["node"], 1))
+    for codec in available_codecs():
+        for level in LEVELS:
+            frame = LosslessCodec(codec, level=level, min_ratio=1.0).compress(data)
+            # A new codec every time, so the frame of the last payload is not reused
+            runner.measure("{} {} compress".format(codec, level), lambda: LosslessCodec(codec, level=level, min_ratio=1.0).compress(data), bytes=len(frame), ratio=len(data) / len(frame))
+            runner.measure("{} {} decompress".format(codec, level), lambda: decompress(frame), bytes=len(frame))
+
+
+@benchmark("topology")
+def topology(runner):
+    """
+    Generation of the topologies of a scenario (links and neighbors of every node) by number of nodes.
+    """
+    try:
+        from fedstellar.utils.topologymanager import TopologyManager
+    except ImportError as e:
+        raise Skip("Topology dependencies not available ({})".format(e))
+
+    generators = {
+        "ring": lambda tm: tm.generate_ring_topology(increase_convergence=True),
+        "random": lambda tm: tm.generate_topology(),
+        "smallworld": lambda tm: tm.generate_small_world_topology(),
+        "scalefree": lambda tm: tm.generate_scale_free_topology(),
+        "star": lambda tm: tm.generate_server_topology(),
+    }
+    for n in (100, 1000, 10000):
+        nodes = [("127.0.0.1", 45000 + i, "trainer", None) for i in range(n)]
+        for name, generate in generators.items():
+            if name == "ring" and n > 1000:
+                continue  # About 10% of the pairs are linked, the topology itself is quadratic
+
+            def scenario():
+                tm = TopologyManager(n_nodes=n, undirected_neighbor_num=4, seed=0)
+                generate(tm)
+                tm.add_nodes(nodes)
+                return [tm.get_neighbors_string(i) for i in range(n)]
+
+            runner.measure("{} {}".format(name, n), scenario, nodes=n)
+
+
+###################
+#    Protocol     #
+###################
+
+
+class _NullCommand:
+    def execute(self, *args):
+        pass
+
+
+@benchmark("process_message")
+def process_message(runner):
+    """
+    Throughput of the processing of gossiped messages (hashed beats, models aggregated and model fragments).
+    """
+    commands = {cmd: _NullCommand() for cmd in (
+        CommunicationProtocol.BEAT,
+        CommunicationProtocol.MODELS_AGGREGATED,
+        CommunicationProtocol.PARAMS,
+        CommunicationProtocol.METRICS,
+    )}
+    config = participant_config()
+    batch = 1000
+
+    beats = [CommunicationProtocol.build_beat_msg("127.0.0.1:{}".format(45000 + i % 50)) for i in range(batch)]
+
+    def process_beats():
+        protocol = CommunicationProtocol(commands, config)
+        for msg in beats:
+            protocol.process_message(msg)
+
+    aggregated = [CommunicationProtocol.build_models_aggregated_msg(["127.0.0.1:{}".format(45000 + j) for j in range(i % 20)]) for i in range(batch)]
+
+    def process_aggregated():
+        protocol = CommunicationProtocol(commands, config)
+        for msg in aggregated:
+            protocol.process_message(msg)
+
+    fragments = CommunicationProtocol.build_params_msg(os.urandom(batch * 1024), config.participant["BLOCK_SIZE"])
+
+    def process_fragments():
+        protocol = CommunicationProtocol(commands, config)
+        for msg in fragments:
+            protocol.process_message(msg)
+
+    runner.measure("{} beats".format(batch), process_beats, messages=batch)
+    runner.measure("{} models aggregated".format(batch), process_aggregated, messages=batch)
+    runner.measure("{} params fragments".format(len(fragments)), process_fragments, messages=len(fragments))
+
+
+@benchmark("build_params_msg")
+def build_params_msg(runner):
+    """
+    Fragmentation of the encoded parameters in ``BLOCK_SIZE`` messages.
+    """
+    block_size = participant_config().participant["BLOCK_SIZE"]
+    for size in (100_000, 1_000_000, 10_000_000):
+        data = os.urandom(size)
+        runner.measure("{} bytes".format(size), lambda: CommunicationProtocol.build_params_msg(data, block_size), bytes=size)
+
+
+###################
+#   Encryption    #
+###################
+
+
+@benchmark("encryption")
+def encryption(runner):
+    """
+    Symmetric encryption of the messages and cost of the asymmetric handshake.
+    """
+    try:
+        from fedstellar.encrypter import AESCipher, RSACipher
+    except ImportError as e:
+        raise Skip("pycryptodome not available ({})".format(e))
+
+    aes = AESCipher()
+    message = aes.add_padding(os.urandom(1_000_000))
+    encrypted = aes.encrypt(message)
+    runner.measure("aes encrypt 1MB", lambda: aes.encrypt(message), bytes=len(message))
+    runner.measure("aes decrypt 1MB", lambda: aes.decrypt(encrypted), bytes=len(message))
+
+    runner.measure("rsa keygen", RSACipher)
+
+    def handshake():
+        # Keys exchange of a connection: both ends generate their pair, the AES key goes encrypted with RSA
+        local, remote = RSACipher(), RSACipher()
+        local.load_pair_public_key(remote.get_key())
+        remote.load_pair_public_key(local.get_key())
+        key = AESCipher().get_key()
+        remote.decrypt(local.encrypt(key))
+
+    runner.measure("handshake", handshake)
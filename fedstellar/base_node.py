@@ -31,6 +31,21 @@ from fedstellar.node_connection import NodeConnection
 from fedstellar.utils.observer import Events, Observer
 
 
+class NodeLogFilter(logging.Filter):
+    """
+    Keeps the records emitted by the threads of a node (their names contain the name of the node).
+    Used when several nodes share a process, so each node only writes its own records in its log files.
+    """
+
+    def __init__(self, node_name):
+        super().__init__()
+        self.node_name = node_name
+
+    def filter(self, record):
+        parts = record.threadName.split("-")
+        return len(parts) > 1 and parts[1] == self.node_name
+
+
 class BaseNode(threading.Thread, Observer):
     """
     This class represents a base node in the network (without **FL**). It is a thread, so it's going to process all messages in a background thread using the CommunicationProtocol.
@@ -39,6 +54,7 @@ class BaseNode(threading.Thread, Observer):
         host (str): The host of the node.
         port (int): The port of the node.
         simulation (bool): If False, communication will be encrypted.
+        transport: In-memory transport shared by the nodes of the same process (see fedstellar.simulator). None to only use TCP.
 
     Attributes:
         host (str): The host of the node.
@@ -52,7 +68,7 @@ class BaseNode(threading.Thread, Observer):
     #     Node Init     #
     #####################
 
-    def __init__(self, experiment_name, hostdemo=None, host="127.0.0.1", port=None, encrypt=False, config=None):
+    def __init__(self, experiment_name, hostdemo=None, host="127.0.0.1", port=None, encrypt=False, config=None, transport=None):
         self.experiment_name = experiment_name
         # Node Attributes
         self.hostdemo = hostdemo
@@ -61,6 +77,7 @@ class BaseNode(threading.Thread, Observer):
         self.encrypt = encrypt
         self.simulation = config.participant["scenario_args"]["simulation"]
         self.config = config
+        self.transport = transport
 
         # Super init
         threading.Thread.__init__(self, name="node-" + self.get_name())
@@ -97,18 +114,28 @@ class BaseNode(threading.Thread, Observer):
         console_handler, file_handler, file_handler_only_debug, exp_errors_file_handler = self.setup_logging(self.log_filename)
 
         level = logging.DEBUG if config.participant["scenario_args"]["debug"] else logging.WARNING
-        logging.basicConfig(level=level,
-                            handlers=[
-                                console_handler,
-                                file_handler,
-                                file_handler_only_debug,
-                                exp_errors_file_handler
-                            ])
+        if self.transport is None:
+            logging.basicConfig(level=level,
+                                handlers=[
+                                    console_handler,
+                                    file_handler,
+                                    file_handler_only_debug,
+                                    exp_errors_file_handler
+                                ])
+        else:
+            # The process is shared with other nodes (the simulator configures the root logger and the console)
+            node_filter = NodeLogFilter(self.get_name())
+            for handler in [file_handler, file_handler_only_debug, exp_errors_file_handler]:
+                handler.addFilter(node_filter)
+                logging.getLogger().addHandler(handler)
 
         # Heartbeater and Gossiper
         self.gossiper = None
         self.heartbeater = None
 
+        if self.transport is not None:
+            self.transport.register(self)
+
     def get_addr(self):
         """
         Returns:
@@ -230,6 +257,8 @@ class BaseNode(threading.Thread, Observer):
         for n in nei_copy_list:
             n.stop()
         self.__node_socket.close()
+        if self.transport is not None:
+            self.transport.unregister(self)
 
     def __process_new_connection(self, node_socket, h, p, full, force):
         try:
@@ -332,8 +361,19 @@ class BaseNode(threading.Thread, Observer):
             force = "0"
 
         try:
-            # Check if connection with the node already exist
             h = socket.gethostbyname(h)
+        except Exception as e:
+            logging.info(
+                "{} Can't connect to the node {}:{}".format(self.get_name(), h, p)
+            )
+            return None
+
+        # Nodes of the same process are connected in memory
+        if self.transport is not None and self.transport.is_local(h, p):
+            return self.__connect_in_memory(h, p, full, force)
+
+        try:
+            # Check if connection with the node already exist
             self.__nei_lock.acquire()
             if self.get_neighbor(h, p, thread_safe=False) is None:
 
@@ -379,6 +419,63 @@ class BaseNode(threading.Thread, Observer):
                 pass
             return None
 
+    def __connect_in_memory(self, h, p, full, force):
+        """
+        Connects to a node of the same process (see fedstellar.simulator).
+
+        The lock of the neighbors is not held while the other node accepts the connection (it could be connecting to
+        this one).
+        """
+        with self.__nei_lock:
+            if self.get_neighbor(h, p, thread_safe=False) is not None:
+                logging.info("{} Already connected to {}:{}".format(self.get_name(), h, p))
+                return None
+        try:
+            nc = self.transport.connect(self, h, p, full == "1", force == "1")
+        except Exception as e:
+            logging.info("{} Can't connect to the node {}:{}".format(self.get_name(), h, p))
+            return None
+        if nc is None:
+            return None
+        nc.add_observer(self)
+        with self.__nei_lock:
+            if self.get_neighbor(h, p, thread_safe=False) is not None:
+                nc.stop()
+                return None
+            self.__neighbors.append(nc)
+        logging.info("[BASENODE_connect_to] Connected to {}:{} (in memory) -> New neighbor {}".format(h, p, nc.get_name()))
+        nc.start(force=force)
+        return nc
+
+    def accept_connection(self, nc, full=False, force=False):
+        """
+        Adds a connection requested by another node of the same process (see fedstellar.simulator).
+
+        Args:
+            nc (NodeConnection): The connection with the other node.
+            full (bool): If True, the other node will be connected to the entire network.
+            force (bool): If True, the connection will be kept even though it should not be.
+
+        Returns:
+            bool: True if the connection was accepted (it was not already a neighbor).
+        """
+        with self.__nei_lock:
+            h, p = nc.get_addr()
+            if self.get_neighbor(h, p, thread_safe=False) is not None:
+                return False
+            logging.info("{} Connection accepted with {}:{} (in memory)".format(self.get_name(), h, p))
+            nc.add_observer(self)
+            self.__neighbors.append(nc)
+            nc.start(force=force)
+
+            if full:
+                self.broadcast(
+                    CommunicationProtocol.build_connect_to_msg(h, p),
+                    exc=[nc],
+                    thread_safe=False,
+                )
+        return True
+
     def disconnect_from(self, h, p):
         """
         Disconnects from a node.
@@ -110,6 +110,7 @@ class Params_cmd(Command):
         if done:
             params = self.node_connection.get_params()
             self.node_connection.clear_buffer()
+            self.node_connection.acknowledge_params()
             self.node_connection.notify_params(params)
 
 
@@ -158,6 +159,15 @@ class Model_initialized_cmd(Command):
         self.node_connection.set_model_initialized(True)
 
 
+class Model_received_cmd(Command):
+    """
+    Command that should be executed as a response to a **model_received** message.
+    """
+
+    def execute(self):
+        self.node_connection.params_received()
+
+
 class Transfer_leadership_cmd(Command):
     """
     Command that should be executed as a response to a **transfer_leadership** message.
@@ -165,3 +175,30 @@ class Transfer_leadership_cmd(Command):
 
     def execute(self):
         self.node_connection.set_transfer_leadership("aggregator")
+
+
+class Shm_model_cmd(Command):
+    """
+    Command that should be executed as a response to a **shm_model** message.
+    """
+
+    def execute(self, name, offset, size, version):
+        self.node_connection.receive_shared_params(name, offset, size, version)
+
+
+class Shm_release_cmd(Command):
+    """
+    Command that should be executed as a response to a **shm_release** message.
+    """
+
+    def execute(self, name, version):
+        self.node_connection.release_shared_params(name, version)
+
+
+class Reference_cmd(Command):
+    """
+    Command that should be executed as a response to a **reference** message.
+    """
+
+    def execute(self, reference):
+        self.node_connection.set_reference(reference)
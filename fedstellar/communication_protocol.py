@@ -51,6 +51,10 @@ class CommunicationProtocol:
             - MODELS_READY <round>
             - MODELS_AGGREGATED <node>* MODELS_AGGREGATED_CLOSE
             - MODEL_INITIALIZED
+            - MODEL_RECEIVED
+            - SHM_MODEL <segment> <offset> <size> <version>
+            - SHM_RELEASE <segment> <version>
+            - REFERENCE <reference>
 
     Furthermore, all messages consist of encoded text (utf-8), except the `PARAMS` message, which contains serialized binaries.
 
@@ -132,6 +136,22 @@ class CommunicationProtocol:
     Model initialized message header.
     """
     MODEL_INITIALIZED = "MODEL_INITIALIZED"
+    """
+    Model received (all the params messages of a model) message header.
+    """
+    MODEL_RECEIVED = "MODEL_RECEIVED"
+    """
+    Shared-memory model message header (the name must not contain the binary header, see ``check_collapse``).
+    """
+    SHM_MODEL = "SHM_MODEL"
+    """
+    Shared-memory model release message header.
+    """
+    SHM_RELEASE = "SHM_RELEASE"
+    """
+    Reference model (of the compressed updates) message header.
+    """
+    REFERENCE = "REFERENCE"
 
     ############################################
     #    MSG PROCESSING (Non Static Methods)   #
@@ -431,6 +451,14 @@ class CommunicationProtocol:
                         error = True
                         break
 
+                # Model Received
+                elif message[0] == CommunicationProtocol.MODEL_RECEIVED:
+                    if self.__exec(CommunicationProtocol.MODEL_RECEIVED, None, None):
+                        message = message[1:]
+                    else:
+                        error = True
+                        break
+
                 # Model Initialized
                 elif message[0] == CommunicationProtocol.TRANSFER_LEADERSHIP:
                     if self.__exec(CommunicationProtocol.TRANSFER_LEADERSHIP, None, None):
@@ -439,6 +467,58 @@ class CommunicationProtocol:
                         error = True
                         break
 
+                # Shared-memory model (non gossiped)
+                elif message[0] == CommunicationProtocol.SHM_MODEL:
+                    if len(message) > 4:
+                        try:
+                            if self.__exec(
+                                    CommunicationProtocol.SHM_MODEL,
+                                    None,
+                                    None,
+                                    message[1],
+                                    int(message[2]),
+                                    int(message[3]),
+                                    int(message[4]),
+                            ):
+                                message = message[5:]
+                            else:
+                                error = True
+                                break
+                        except ValueError:
+                            error = True
+                            break
+                    else:
+                        error = True
+                        break
+
+                # Shared-memory model release (non gossiped)
+                elif message[0] == CommunicationProtocol.SHM_RELEASE:
+                    if len(message) > 2:
+                        try:
+                            if self.__exec(CommunicationProtocol.SHM_RELEASE, None, None, message[1], int(message[2])):
+                                message = message[3:]
+                            else:
+                                error = True
+                                break
+                        except ValueError:
+                            error = True
+                            break
+                    else:
+                        error = True
+                        break
+
+                # Reference model (non gossiped)
+                elif message[0] == CommunicationProtocol.REFERENCE:
+                    if len(message) > 1:
+                        if self.__exec(CommunicationProtocol.REFERENCE, None, None, message[1]):
+                            message = message[2:]
+                        else:
+                            error = True
+                            break
+                    else:
+                        error = True
+                        break
+
                 # Non Recognized message
                 else:
                     error = True
@@ -706,6 +786,14 @@ class CommunicationProtocol:
         """
         return (CommunicationProtocol.MODEL_INITIALIZED + "\n").encode("utf-8")
 
+    @staticmethod
+    def build_model_received_msg():
+        """
+        Returns:
+            An encoded model received message (acknowledges the params messages of a model).
+        """
+        return (CommunicationProtocol.MODEL_RECEIVED + "\n").encode("utf-8")
+
     @staticmethod
     def build_connect_msg(ip, port, broadcast, force):
         """
@@ -768,6 +856,48 @@ class CommunicationProtocol:
 
         return data_msgs
 
+    @staticmethod
+    def build_shm_model_msg(name, offset, size, version):
+        """
+        Build the handle of model parameters written in a shared-memory segment.
+        Not Hashed. Only sent to nodes of the same host.
+
+        Args:
+            name: Name of the segment.
+            offset: Position of the parameters in the segment.
+            size: Length of the parameters.
+            version: Version of the segment.
+
+        Returns:
+            An encoded shared-memory model message.
+        """
+        return (
+                CommunicationProtocol.SHM_MODEL + " " + name + " " + str(offset) + " " + str(size) + " " + str(version) + "\n"
+        ).encode("utf-8")
+
+    @staticmethod
+    def build_shm_release_msg(name, version):
+        """
+        Args:
+            name: Name of the segment.
+            version: Version of the segment.
+
+        Returns:
+            An encoded shared-memory model release message.
+        """
+        return (CommunicationProtocol.SHM_RELEASE + " " + name + " " + str(version) + "\n").encode("utf-8")
+
+    @staticmethod
+    def build_reference_msg(reference):
+        """
+        Args:
+            reference: Id of the reference model of the compressed updates.
+
+        Returns:
+            An encoded reference message.
+        """
+        return (CommunicationProtocol.REFERENCE + " " + reference + "\n").encode("utf-8")
+
     @staticmethod
     def build_transfer_leadership_msg():
         """
@@ -1,5 +1,6 @@
 import glob
 import hashlib
+import importlib.util
 import json
 import logging
 import os
@@ -14,6 +15,8 @@ from dotenv import load_dotenv
 
 from fedstellar.config.config import Config
 from fedstellar.config.mender import Mender
+from fedstellar.launcher import FORKSERVER, PROCESS, Launcher
+from fedstellar.registry import DATASETS
 from fedstellar.utils.topologymanager import TopologyManager
 
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
@@ -80,6 +83,13 @@ class Controller:
         self.statistics_port = args.statsport if hasattr(args, "statsport") else 5100
         self.simulation = args.simulation
         self.docker = args.docker if hasattr(args, 'docker') else None
+        # How the participants of a simulation are started: "cmd" (one process per participant), "forkserver" (one process
+        # per participant, forked from a server with the modules already imported) or "inprocess" (fedstellar.simulator)
+        self.launcher = args.launcher if hasattr(args, 'launcher') and args.launcher else "cmd"
+        self.simulator_workers = args.workers if hasattr(args, 'workers') else None
+        # Participants of the "cmd" launcher starting at the same time (one per core by default)
+        self.launcher_concurrency = args.launcher_concurrency if hasattr(args, 'launcher_concurrency') else None
+        self.node_launcher = None
         self.config_dir = args.config
         self.log_dir = args.logs
         self.env_path = args.env
@@ -172,6 +182,13 @@ class Controller:
             with open(f'{self.log_dir}/server.log', 'w', encoding='utf-8') as log_file:
                 # Remove option --reload for production
                 subprocess.Popen(["gunicorn", "--workers", "4", "--threads", "4", "--bind", f"unix:/tmp/fedstellar.sock", "--access-logfile", f"{self.log_dir}/server.log", "app:app"], cwd=webserver_path, env=controller_env, stdout=log_file, stderr=log_file, encoding='utf-8')
+            # The monitoring streams (/api/scenario/<scenario_name>/monitoring/stream) are long-lived, they are served
+            # by an asynchronous worker on its own socket (routed by the reverse proxy) instead of holding a thread
+            if importlib.util.find_spec("gevent") is None:
+                logging.warning("Gevent is not installed, the monitoring streams are served by the webserver threads. Please, install it with pip install gevent")
+                return
+            with open(f'{self.log_dir}/stream_server.log', 'w', encoding='utf-8') as log_file:
+                subprocess.Popen(["gunicorn", "--worker-class", "gevent", "--workers", "1", "--worker-connections", "1000", "--bind", f"unix:/tmp/fedstellar-stream.sock", "--access-logfile", f"{self.log_dir}/stream_server.log", "app:app"], cwd=webserver_path, env=controller_env, stdout=log_file, stderr=log_file, encoding='utf-8')
 
         else:
             logging.info(f"Running Fedstellar Webserver (local): http://127.0.0.1:{self.webserver_port}")
@@ -297,6 +314,9 @@ class Controller:
             raise ValueError("No start node found")
         self.config.set_participants_config(participant_files)
 
+        if self.simulation:
+            self.generate_partitions()
+
         # Add role to the topology (visualization purposes)
         self.topologymanager.update_nodes(self.config.participants)
         self.topologymanager.draw_graph(path=f"{self.log_dir}/{self.scenario_name}/topology.png", plot=False)
@@ -304,11 +324,47 @@ class Controller:
         if self.simulation:
             if self.docker:
                 self.start_nodes_docker(idx_start_node)
+            elif self.launcher == "inprocess":
+                self.start_nodes_inprocess()
             else:
                 self.start_nodes_cmd(idx_start_node)
         else:
             logging.info("Simulation mode is disabled, waiting for nodes to start...")
 
+    def generate_partitions(self):
+        """
+        Computes the data partition of every participant once for the scenario and saves it as index files in the
+        config directory, so participants only load their own indices.
+        """
+        import numpy as np
+        from fedstellar.learning.partitioning import CONTIGUOUS, partition_dataset, save_partitions
+
+        data_args = self.config.participants[0]["data_args"]
+        strategy = data_args.get("partition", CONTIGUOUS)
+        if strategy == CONTIGUOUS:
+            return
+
+        dataset = data_args["dataset"]
+        root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+        datamodule = DATASETS.load(dataset)
+
+        if strategy == "dirichlet":
+            params = {"alpha": data_args.get("partition_alpha", 0.5)}
+        elif strategy == "quantity":
+            params = {"beta": data_args.get("partition_alpha", 0.5)}
+        elif strategy == "shard":
+            params = {"shards_per_node": data_args.get("partition_shards", 2)}
+        else:
+            params = {}
+        seed = self.config.participants[0]["scenario_args"].get("random_seed", 0)
+
+        logging.info("Generating {} partitions of {} for {} nodes...".format(strategy, dataset, self.n_nodes))
+        targets = {split: np.asarray(datamodule.get_targets(root_dir, train=split == "train")) for split in ("train", "test")}
+        n_classes = int(max(t.max() for t in targets.values())) + 1
+        for split, split_targets in targets.items():
+            partitions = partition_dataset(split_targets, self.n_nodes, strategy=strategy, seed=seed, n_classes=n_classes, **params)
+            save_partitions(os.path.join(self.config_dir, "partitions"), split, partitions, metadata={"dataset": dataset, "strategy": strategy, "seed": seed, "params": params})
+
     def create_topology(self, matrix=None):
         import numpy as np
         if matrix is not None:
@@ -329,6 +385,14 @@ class Controller:
             topologymanager = TopologyManager(scenario_name=self.scenario_name, n_nodes=self.n_nodes, b_symmetric=True,
                                               undirected_neighbor_num=3)
             topologymanager.generate_topology()
+        elif self.topology == "smallworld":
+            # Ring lattice with some links rewired at random (Watts-Strogatz)
+            topologymanager = TopologyManager(scenario_name=self.scenario_name, n_nodes=self.n_nodes, b_symmetric=True, undirected_neighbor_num=4)
+            topologymanager.generate_small_world_topology()
+        elif self.topology == "scalefree":
+            # Preferential attachment (Barabási-Albert), a few nodes concentrate most of the links
+            topologymanager = TopologyManager(scenario_name=self.scenario_name, n_nodes=self.n_nodes, b_symmetric=True, undirected_neighbor_num=4)
+            topologymanager.generate_scale_free_topology()
         elif self.topology == "star" and self.federation == "CFL":
             # Create a centralized network
             topologymanager = TopologyManager(scenario_name=self.scenario_name, n_nodes=self.n_nodes, b_symmetric=True)
@@ -471,6 +535,22 @@ class Controller:
             raise ValueError("Unknown operating system")
 
     def start_nodes_cmd(self, idx_start_node):
+        if sys.platform != "win32":
+            # Participants started in parallel, the start node is released when all of them are ready
+            start_file = next(path for path, participant in zip(self.config.participants_path, self.config.participants) if participant["device_args"]["start"])
+            self.node_launcher = Launcher(
+                self.python_path,
+                os.path.join(os.path.dirname(os.path.realpath(__file__)), "node_start.py"),
+                self.config.participants_path,
+                start_file,
+                log_dir=os.path.join(self.log_dir, self.scenario_name),
+                concurrency=self.launcher_concurrency,
+                mode=FORKSERVER if self.launcher == "forkserver" else PROCESS,
+            )
+            logging.info("Starting {} nodes in parallel (start node: {})".format(self.n_nodes, start_file))
+            self.node_launcher.start()
+            return
+
         # Start the nodes
         # Get directory path of the current file
         for idx in range(0, self.n_nodes):
@@ -484,6 +564,15 @@ class Controller:
         logging.info("Starting node {} with configuration {}".format(idx_start_node, self.config.participants[idx_start_node]))
         self.start_node(idx_start_node)
 
+    def start_nodes_inprocess(self):
+        # All the participants run as nodes of a pool of worker processes (the start node is started by the simulator)
+        command = [self.python_path, "-u", "-m", "fedstellar.simulator", self.config_dir]
+        if self.simulator_workers:
+            command += ["--workers", str(self.simulator_workers)]
+        logging.info("Starting {} nodes in process with command: {}".format(self.n_nodes, " ".join(command)))
+        with open(f'{self.log_dir}/{self.scenario_name}/simulator.log', 'w', encoding='utf-8') as log_file:
+            subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.realpath(__file__))), stdout=log_file, stderr=log_file, encoding='utf-8')
+
     @classmethod
     def remove_files_by_scenario(cls, scenario_name):
         import shutil
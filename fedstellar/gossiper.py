@@ -20,6 +20,7 @@ import threading
 import time
 
 from fedstellar.config.config import Config
+from fedstellar.utils.instrumentation import get_instrumentation
 from fedstellar.utils.observer import Events, Observable
 
 
@@ -49,6 +50,7 @@ class Gossiper(threading.Thread, Observable):
         self.__msgs = {}
         self.__add_lock = threading.Lock()
         self.__terminate_flag = threading.Event()
+        self.instrumentation = get_instrumentation(node_name)
 
     def add_messages(self, msgs, node):
         """
@@ -68,42 +70,8 @@ class Gossiper(threading.Thread, Observable):
         Gossiper Main Loop. Sends `GOSSIP_MODEL_SENDS_BY_ROUND` messages ``GOSSIP_FREC`` times per second.
         """
         while not self.__terminate_flag.is_set():
-
-            messages_left = self.config.participant["GOSSIP_MESSAGES_PER_ROUND"]
-
-            # Lock
-            self.__add_lock.acquire()
             begin = time.time()
-
-            # Send to all the nodes except the ones that the message was already sent to
-            if len(self.__msgs) > 0:
-                msg_list = list(self.__msgs.items()).copy()
-                logging.debug("[GOSSIPER] Message list: {}".format(msg_list))
-                nei = set(self.__neighbors.copy())  # copy to avoid concurrent problems
-
-                for msg, nodes in msg_list:
-                    nodes = set(nodes)
-                    sended = len(nei - nodes)
-
-                    if messages_left - sended >= 0:
-                        logging.debug("[GOSSIPER] Send msg: {} --> to {}".format(msg, list(nodes)))
-                        self.notify(Events.GOSSIP_BROADCAST_EVENT, (msg, list(nodes)))
-                        del self.__msgs[msg]
-                        messages_left = messages_left - sended
-                        if messages_left == 0:
-                            break
-                    else:
-                        # Lists to concatenate / Sets to difference
-                        excluded = (list(nei - nodes))[: abs(messages_left - sended)]
-                        logging.debug("[GOSSIPER] Send msg: {} --> to {} | Excluded: {}".format(msg, list(nodes) + excluded, excluded))
-                        self.notify(
-                            Events.GOSSIP_BROADCAST_EVENT, (msg, list(nodes) + excluded)
-                        )
-                        self.__msgs[msg] = list(nodes) + list(nei - set(excluded))
-                        break
-
-            # Unlock
-            self.__add_lock.release()
+            self.gossip_step()
 
             # Wait to guarantee the frequency of gossipping
             time_diff = time.time() - begin
@@ -111,6 +79,51 @@ class Gossiper(threading.Thread, Observable):
             if time_sleep > 0:
                 time.sleep(time_sleep)
 
+    def gossip_step(self):
+        """
+        Sends up to ``GOSSIP_MESSAGES_PER_ROUND`` pending messages (one iteration of the gossiper).
+
+        Returns:
+            int: Number of messages still pending.
+        """
+        messages_left = self.config.participant["GOSSIP_MESSAGES_PER_ROUND"]
+
+        # Lock
+        self.__add_lock.acquire()
+        self.instrumentation.gauge("gossip_messages", len(self.__msgs))
+
+        # Send to all the nodes except the ones that the message was already sent to
+        if len(self.__msgs) > 0:
+            msg_list = list(self.__msgs.items()).copy()
+            logging.debug("[GOSSIPER] Message list: {}".format(msg_list))
+            nei = set(self.__neighbors.copy())  # copy to avoid concurrent problems
+
+            for msg, nodes in msg_list:
+                nodes = set(nodes)
+                sended = len(nei - nodes)
+
+                if messages_left - sended >= 0:
+                    logging.debug("[GOSSIPER] Send msg: {} --> to {}".format(msg, list(nodes)))
+                    self.notify(Events.GOSSIP_BROADCAST_EVENT, (msg, list(nodes)))
+                    del self.__msgs[msg]
+                    messages_left = messages_left - sended
+                    if messages_left == 0:
+                        break
+                else:
+                    # Lists to concatenate / Sets to difference
+                    excluded = (list(nei - nodes))[: abs(messages_left - sended)]
+                    logging.debug("[GOSSIPER] Send msg: {} --> to {} | Excluded: {}".format(msg, list(nodes) + excluded, excluded))
+                    self.notify(
+                        Events.GOSSIP_BROADCAST_EVENT, (msg, list(nodes) + excluded)
+                    )
+                    self.__msgs[msg] = list(nodes) + list(nei - set(excluded))
+                    break
+
+        pending = len(self.__msgs)
+        # Unlock
+        self.__add_lock.release()
+        return pending
+
     def stop(self):
         """
         Stop the gossiper.
@@ -64,18 +64,7 @@ class Heartbeater(threading.Thread, Observable):
         It happend ``HEARTBEATER_REFRESH_NEIGHBORS_BY_PERIOD`` per HEARTBEAT_PERIOD
         """
         while not self.__terminate_flag.is_set():
-            # We do not check if the message was sent
-            #   - If the model is sending, a beat is not necessary
-            #   - If the connection its down timeouts will destroy connections
-            self.notify(Events.SEND_BEAT_EVENT, None)
-            # self.get_nodes(print=True)
-            self.update_config_with_neighbors()
-            self.__count += 1
-            # Send role notify each 10 beats
-            if self.__count % 2 == 0:
-                self.notify(Events.SEND_ROLE_EVENT, None)
-                # Report my status to the controller
-                self.notify(Events.REPORT_STATUS_TO_CONTROLLER_EVENT, None)
+            self.beat()
 
             # Wait and refresh node list
             for _ in range(self.config.participant["HEARTBEATER_REFRESH_NEIGHBORS_BY_PERIOD"]):
@@ -85,6 +74,23 @@ class Heartbeater(threading.Thread, Observable):
                     / self.config.participant["HEARTBEATER_REFRESH_NEIGHBORS_BY_PERIOD"]
                 )
 
+    def beat(self):
+        """
+        Send a beat to the neighbors (and the role and the status every two beats).
+        """
+        # We do not check if the message was sent
+        #   - If the model is sending, a beat is not necessary
+        #   - If the connection its down timeouts will destroy connections
+        self.notify(Events.SEND_BEAT_EVENT, None)
+        # self.get_nodes(print=True)
+        self.update_config_with_neighbors()
+        self.__count += 1
+        # Send role notify each 10 beats
+        if self.__count % 2 == 0:
+            self.notify(Events.SEND_ROLE_EVENT, None)
+            # Report my status to the controller
+            self.notify(Events.REPORT_STATUS_TO_CONTROLLER_EVENT, None)
+
     def clear_nodes(self):
         """
         Clear the list of neighbors.
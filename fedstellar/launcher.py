@@ -0,0 +1,335 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Parallel launcher of the participants of a simulation (one process per participant).
+
+The participants are spawned in parallel, with at most ``concurrency`` of them starting (importing and loading their
+data) at the same time, and pinned to CPU sets so they do not oversubscribe the host. Every participant has a control
+socket (``FEDSTELLAR_CONTROL_FD``) to report its phases to the launcher: ``listening`` once its server is up and
+``ready`` once it is connected to its neighbors. The launcher answers ``connect`` when all the participants listen
+(instead of a fixed grace time) and ``start`` to the start node when all of them are ready. The end of the control
+socket is the exit of the participant: its exit status is collected, and the start is aborted if a participant exits
+or does not report in time.
+
+Participants are either new interpreters running ``node_start.py`` (``process``) or forked from a fork server that
+has imported torch, Lightning and the fedstellar modules once (``forkserver``): they skip the imports, and share the
+memory of the modules (copy-on-write).
+"""
+import logging
+import multiprocessing
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from fedstellar.registry import DATASETS, MODELS
+
+CONTROL_FD = "FEDSTELLAR_CONTROL_FD"
+
+# Messages of the participants
+LISTENING = "listening"
+READY = "ready"
+# Messages of the launcher
+CONNECT = "connect"
+START = "start"
+
+# How the participants are started
+PROCESS = "process"
+FORKSERVER = "forkserver"
+
+# Modules imported by the fork server, with the modules of the bundled datasets and models (see fedstellar.registry).
+# The main module of the launching process is imported once there too, otherwise every participant imports it when
+# it is forked
+FORKSERVER_PRELOAD = ["__main__", "torch", "torchvision", "torchmetrics", "lightning", "requests", "fedstellar.node_start"]
+
+_forkserver_context = None
+
+
+def forkserver_context():
+    """
+    Returns:
+        multiprocessing.context.ForkServerContext: Context of the fork server of the participants (None if the
+        platform has no fork server).
+    """
+    global _forkserver_context
+    if _forkserver_context is None and FORKSERVER in multiprocessing.get_all_start_methods():
+        _forkserver_context = multiprocessing.get_context(FORKSERVER)
+        _forkserver_context.set_forkserver_preload(FORKSERVER_PRELOAD + DATASETS.modules() + MODELS.modules())
+    return _forkserver_context
+
+
+def run_participant(config_file, control, output, threads=None):
+    """
+    Runs a participant forked from the fork server (as ``node_start.py <config_file>``).
+
+    Args:
+        config_file: Configuration file of the participant.
+        control: Control socket of the participant.
+        output: File of the console output of the participant.
+        threads: Threads of the thread pools of the participant (None to keep the default).
+    """
+    fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+    os.environ[CONTROL_FD] = str(control.detach())
+    if threads is not None:
+        os.environ.update(OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads)
+        if "torch" in sys.modules:  # Preloaded, the environment is read too late
+            sys.modules["torch"].set_num_threads(int(threads))
+    from fedstellar.node_start import main
+    main(config_file)
+
+
+def available_cpus():
+    """
+    Returns:
+        list: CPUs the process can run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_sets(n, cpus=None):
+    """
+    Splits the CPUs among ``n`` participants: disjoint sets if there are enough CPUs, one CPU per participant
+    (round-robin) otherwise.
+
+    Returns:
+        list: CPU set of every participant.
+    """
+    cpus = available_cpus() if cpus is None else sorted(cpus)
+    if n >= len(cpus):
+        return [{cpus[i % len(cpus)]} for i in range(n)]
+    size = len(cpus) // n
+    return [set(cpus[i * size:(i + 1) * size]) for i in range(n)]
+
+
+class ControlChannel:
+    """
+    Control socket of a participant started by the launcher.
+    """
+
+    def __init__(self, fd):
+        self.__socket = socket.socket(fileno=fd)
+        self.__buffer = b""
+
+    @classmethod
+    def from_env(cls):
+        """
+        Returns:
+            ControlChannel: Channel of the participant (None if it was not started by the launcher).
+        """
+        fd = os.environ.pop(CONTROL_FD, None)
+        return cls(int(fd)) if fd else None
+
+    def report(self, phase):
+        self.__socket.sendall("{}\n".format(phase).encode())
+
+    def wait(self, message):
+        """
+        Blocks until the launcher sends the message.
+        """
+        while True:
+            while b"\n" in self.__buffer:
+                line, self.__buffer = self.__buffer.split(b"\n", 1)
+                if line.decode() == message:
+                    return
+            data = self.__socket.recv(1024)
+            if not data:
+                raise ConnectionError("Launcher closed the control channel")
+            self.__buffer += data
+
+
+class _ForkedProcess:
+    """
+    Participant forked from the fork server (same interface as ``subprocess.Popen``).
+    """
+
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+
+    def poll(self):
+        return self.process.exitcode
+
+    def wait(self):
+        self.process.join()
+        return self.process.exitcode
+
+    def terminate(self):
+        self.process.terminate()
+
+
+class _Participant:
+    __slots__ = ("idx", "config_file", "process", "socket", "buffer", "phase", "output")
+
+    def __init__(self, idx, config_file):
+        self.idx = idx
+        self.config_file = config_file
+        self.process = None
+        self.socket = None
+        self.buffer = b""
+        self.phase = None
+        self.output = None
+
+
+class Launcher:
+    """
+    Args:
+        python_path: Python interpreter of the participants.
+        script: Script that starts a participant (``node_start.py``), called with its configuration file.
+        config_files: Configuration files of the participants.
+        start_file: Configuration file of the start node.
+        log_dir: Directory of the console output of the participants (``participant_<n>_console.log``).
+        concurrency: Participants starting at the same time (one per CPU by default).
+        pin: Pin the participants to CPU sets (Linux).
+        timeout: Seconds for all the participants to be ready.
+        mode: ``process`` (new interpreters) or ``forkserver`` (forked from the fork server, if the platform has one).
+    """
+
+    def __init__(self, python_path, script, config_files, start_file, log_dir, concurrency=None, pin=True, timeout=600, mode=PROCESS):
+        self.python_path = python_path
+        self.script = script
+        # The start node is spawned last
+        others = [f for f in config_files if f != start_file]
+        self.participants = [_Participant(i, f) for i, f in enumerate(others + [start_file])]
+        self.log_dir = log_dir
+        self.concurrency = concurrency or len(available_cpus())
+        self.cpu_sets = cpu_sets(len(self.participants)) if pin and hasattr(os, "sched_setaffinity") else None
+        self.timeout = timeout
+        self.context = forkserver_context() if mode == FORKSERVER else None
+        if mode == FORKSERVER and self.context is None:
+            logging.warning("[Launcher] Fork server not available, starting the participants as new processes")
+        self.returncodes = {}
+        self.failed = False
+        self.__thread = None
+
+    def start(self):
+        """
+        Starts the participants in the background.
+        """
+        self.__thread = threading.Thread(target=self.__run, name="launcher", daemon=True)
+        self.__thread.start()
+
+    def wait(self):
+        """
+        Waits for all the participants to exit.
+
+        Returns:
+            dict: Exit status of every configuration file.
+        """
+        self.__thread.join()
+        return self.returncodes
+
+    def __spawn(self, participant, selector):
+        parent, child = socket.socketpair()
+        # Libraries with thread pools (torch, OpenMP, MKL) size them to the CPU set
+        threads = str(len(self.cpu_sets[participant.idx])) if self.cpu_sets is not None else None
+        name = os.path.splitext(os.path.basename(participant.config_file))[0]
+        participant.output = os.path.join(self.log_dir, "{}_console.log".format(name))
+        if self.context is not None:
+            process = self.context.Process(target=run_participant, args=(participant.config_file, child, participant.output, threads), name=name)
+            process.start()
+            participant.process = _ForkedProcess(process)
+        else:
+            env = dict(os.environ, **{CONTROL_FD: str(child.fileno()), "PYTHONUNBUFFERED": "1"})
+            if threads is not None:
+                env.update(OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads)
+            with open(participant.output, "w", encoding="utf-8") as output:
+                participant.process = subprocess.Popen(
+                    [self.python_path, "-u", self.script, participant.config_file],
+                    cwd=os.path.dirname(self.script), env=env, stdout=output, stderr=subprocess.STDOUT, pass_fds=(child.fileno(),),
+                )
+        child.close()
+        if self.cpu_sets is not None:
+            try:
+                os.sched_setaffinity(participant.process.pid, self.cpu_sets[participant.idx])
+            except OSError as e:
+                logging.warning("[Launcher] Can't pin {} to CPUs {}: {}".format(name, self.cpu_sets[participant.idx], e))
+        participant.socket = parent
+        participant.phase = "starting"
+        selector.register(parent, selectors.EVENT_READ, participant)
+        logging.info("[Launcher] Started {} (pid {})".format(name, participant.process.pid))
+
+    def __send(self, participant, message):
+        try:
+            participant.socket.sendall("{}\n".format(message).encode())
+        except OSError:
+            pass  # Its exit is handled when the socket is closed
+
+    def __exited(self, participant, selector):
+        selector.unregister(participant.socket)
+        participant.socket.close()
+        returncode = participant.process.wait()
+        self.returncodes[participant.config_file] = returncode
+        level = logging.INFO if returncode == 0 else logging.ERROR
+        logging.log(level, "[Launcher] {} exited with status {} (console output in {})".format(participant.config_file, returncode, participant.output))
+        return participant.phase
+
+    def __abort(self, reason):
+        logging.error("[Launcher] Aborting the start of the scenario: {}".format(reason))
+        self.failed = True
+        for participant in self.participants:
+            if participant.process is not None and participant.process.poll() is None:
+                participant.process.terminate()
+
+    def __run(self):
+        selector = selectors.DefaultSelector()
+        pending = list(self.participants)
+        starting = listening = ready = 0
+        begin = time.monotonic()
+        started = False
+        while pending or selector.get_map():
+            # Bounded concurrency of the starting participants (imports and data loading)
+            while pending and starting < self.concurrency and not self.failed:
+                self.__spawn(pending.pop(0), selector)
+                starting += 1
+            if self.failed:
+                pending = []
+
+            events = selector.select(timeout=1)
+            if not started and not self.failed and time.monotonic() - begin > self.timeout:
+                late = [p.config_file for p in self.participants if p.phase != READY]
+                self.__abort("participants not ready after {} seconds: {}".format(self.timeout, late))
+
+            for key, _ in events:
+                participant = key.data
+                try:
+                    data = participant.socket.recv(1024)
+                except OSError:
+                    data = b""
+                if not data:
+                    phase = self.__exited(participant, selector)
+                    if phase == "starting":
+                        starting -= 1
+                    if not started and not self.failed:
+                        self.__abort("{} exited before being ready".format(participant.config_file))
+                    continue
+                participant.buffer += data
+                while b"\n" in participant.buffer:
+                    line, participant.buffer = participant.buffer.split(b"\n", 1)
+                    participant.phase = line.decode()
+                    if participant.phase == LISTENING:
+                        starting -= 1
+                        listening += 1
+                        if listening == len(self.participants):
+                            logging.info("[Launcher] All the participants are listening ({:.1f} s)".format(time.monotonic() - begin))
+                            for p in self.participants:
+                                self.__send(p, CONNECT)
+                    elif participant.phase == READY:
+                        ready += 1
+                        if ready == len(self.participants):
+                            started = True
+                            logging.info("[Launcher] All the participants are ready ({:.1f} s), releasing the start node".format(time.monotonic() - begin))
+                            self.__send(self.participants[-1], START)
+        selector.close()
+        logging.info("[Launcher] All the participants exited")
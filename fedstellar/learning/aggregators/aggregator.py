@@ -8,6 +8,7 @@ import logging
 import threading
 
 from fedstellar.role import Role
+from fedstellar.utils.instrumentation import get_instrumentation
 from fedstellar.utils.observer import Events, Observable
 
 
@@ -36,6 +37,7 @@ class Aggregator(threading.Thread, Observable):
         self.__aggregation_lock = threading.Lock()
         self.__aggregation_lock.acquire()
         self.__thread_executed = False
+        self.instrumentation = get_instrumentation(node_name)
 
     def run(self):
         """
@@ -46,10 +48,17 @@ class Aggregator(threading.Thread, Observable):
         # Wait for all models to be added or TIMEOUT
         try:
             logging.info("[Aggregator] __aggregation_lock.acquire() during {} seconds".format(self.config.participant["AGGREGATION_TIMEOUT"]))
-            self.__aggregation_lock.acquire(timeout=self.config.participant["AGGREGATION_TIMEOUT"])
+            with self.instrumentation.timer("aggregation_wait"):
+                self.__aggregation_lock.acquire(timeout=self.config.participant["AGGREGATION_TIMEOUT"])
         except Exception as e:
             logging.error("[Aggregator] Error waiting for aggregation: {}".format(e))
 
+        self.finish_aggregation()
+
+    def finish_aggregation(self):
+        """
+        Aggregate the models added (all of them or the ones received before the timeout) and notify it.
+        """
         logging.info("[Aggregator] Aggregating models, timeout reached.")
 
         # Check if node still running (could happen if aggregation thread was a residual thread)
@@ -71,9 +80,12 @@ class Aggregator(threading.Thread, Observable):
             )
         else:
             logging.info("[Aggregator] Aggregating models.")
+        self.instrumentation.set_value("Models_aggregated", n_model_aggregated)
 
         # Notify node
-        self.notify(Events.AGGREGATION_FINISHED_EVENT, self.aggregate(self.__models))
+        with self.instrumentation.timer("aggregation"):
+            aggregated_model = self.aggregate(self.__models)
+        self.notify(Events.AGGREGATION_FINISHED_EVENT, aggregated_model)
 
     def aggregate(self, models):
         """
@@ -112,6 +124,10 @@ class Aggregator(threading.Thread, Observable):
             nodes: Nodes that collaborated to get the model.
             weight: Number of samples used to get the model.
         """
+        with self.instrumentation.timer("add_model"):
+            return self.__add_model(model, nodes, weight)
+
+    def __add_model(self, model, nodes, weight):
         logging.info("[Aggregator.add_model] Entry point")
         logging.info("[Aggregator.add_model] Nodes who contributed to the model: {}".format(nodes))
         # if self.__waiting_aggregated_model and self.__stored_models is not None:
@@ -149,6 +165,7 @@ class Aggregator(threading.Thread, Observable):
                     if all([n not in models_added for n in nodes]):
                         # Aggregate model
                         self.__models[" ".join(nodes)] = (model, weight)
+                        self.instrumentation.gauge("aggregator_models", len(self.__models))
                         logging.info(
                             "[Aggregator] Model added ({}/{}) from {}".format(
                                 str(len(models_added) + len(nodes)),
@@ -205,7 +222,9 @@ class Aggregator(threading.Thread, Observable):
             logging.info("[Aggregator.get_partial_aggregation] No models to aggregate")
             return None, None, None
 
-        return (self.aggregate(dict_aux), nodes_aggregated, aggregation_weight)
+        with self.instrumentation.timer("partial_aggregation"):
+            partial_model = self.aggregate(dict_aux)
+        return (partial_model, nodes_aggregated, aggregation_weight)
 
     def check_and_run_aggregation(self, force=False):
         """
@@ -224,10 +243,16 @@ class Aggregator(threading.Thread, Observable):
                     force or len(models_added) >= len(self.__train_set)
             ) and self.__train_set != []:
                 logging.info("[Aggregator] __aggregation_lock.release() --> __models = {}".format(self.__models.keys()))
-                self.__aggregation_lock.release()
+                self.release_aggregation()
         except threading.ThreadError:
             pass
 
+    def release_aggregation(self):
+        """
+        Stop waiting for models (``run`` aggregates the models added).
+        """
+        self.__aggregation_lock.release()
+
     def clear(self):
         """
         Clear all for a new aggregation.
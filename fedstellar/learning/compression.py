@@ -0,0 +1,388 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+"""
+Compression of the model parameters exchanged during the gossip.
+
+Instead of the dense parameters, a node sends the update of every layer with respect to its reference model (the
+last global model it agreed on: the initial model, then the aggregated model of every finished round). The receiver
+adds the update to its own reference before handing the model to the aggregator. The references of two nodes only
+match if they aggregated the same models, so every payload carries the id of its reference (round and digest): nodes
+announce their reference id to their neighbors, updates are only sent to neighbors with the same reference (dense
+parameters otherwise) and updates with another reference are rejected.
+
+Top-k sparsification keeps the ``ratio`` largest entries (by magnitude) of each layer as (int32 index, value) pairs.
+With error feedback, the part of the own update that was not sent is accumulated and added to the next own update, so
+no information is permanently lost.
+
+Quantization (fp16, bf16 or int8 with per-tensor or per-channel scale and zero-point) reduces the precision of the
+values sent: the top-k values when sparsification is enabled, the whole parameters otherwise. Parameters are
+decoded back to float32 before the aggregation.
+
+Layers are encoded independently, each one prefixed by the id of its codec. Small and non-floating layers (biases,
+batch norm counters) and, optionally, the batch norm statistics are always sent dense.
+"""
+
+import hashlib
+import math
+import threading
+
+import numpy as np
+
+from fedstellar.learning.exceptions import ReferenceMismatchError
+
+# Algorithms (``compression_args.algorithm``)
+NONE = "none"
+TOPK = "topk"
+
+# Quantization modes (``compression_args.quantization``)
+FP16 = "fp16"
+BF16 = "bf16"
+INT8 = "int8"
+QUANTIZATIONS = (NONE, FP16, BF16, INT8)
+
+# Codec of each layer
+DENSE_LAYER = 0
+TOPK_LAYER = 1
+FP16_LAYER = 2
+BF16_LAYER = 3
+INT8_LAYER = 4
+
+# Layers of the batch norm statistics (state dict names)
+BATCHNORM_STATISTICS = ("running_mean", "running_var", "num_batches_tracked")
+
+
+###################
+#  Quantization   #
+###################
+
+
+def quantize(array, mode, per_channel=False):
+    """
+    Args:
+        array: Floating array.
+        mode: Quantization mode (fp16, bf16 or int8).
+        per_channel: Scale and zero-point of int8 by output channel (first axis) instead of by tensor.
+
+    Returns:
+        tuple: Encoded layer.
+    """
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    if mode == FP16:
+        return FP16_LAYER, array.astype(np.float16)
+    if mode == BF16:
+        # Upper half of the float32 bits, rounded to nearest even (only NaN payloads can overflow)
+        bits = array.view(np.uint32)
+        return BF16_LAYER, ((bits + np.uint32(0x7FFF) + ((bits >> 16) & 1)) >> 16).astype(np.uint16)
+    if mode == INT8:
+        axis = 0 if per_channel and array.ndim > 1 else None
+        flat = array.reshape(array.shape[0], -1) if axis == 0 else array.reshape(1, -1)
+        # The range always includes zero, so zero is exactly representable
+        low = np.minimum(flat.min(axis=1), 0)
+        high = np.maximum(flat.max(axis=1), 0)
+        scale = ((high - low) / 255).astype(np.float32)
+        scale[scale == 0] = 1
+        zero_point = np.round(-128 - low / scale).astype(np.int32)
+        q = np.clip(np.round(flat / scale[:, None]) + zero_point[:, None], -128, 127).astype(np.int8)
+        if axis is None:
+            scale, zero_point = scale[0], zero_point[0]
+        return INT8_LAYER, q.reshape(array.shape), scale, zero_point, axis
+    raise ValueError("Quantization {} not supported".format(mode))
+
+
+def dequantize(layer):
+    """
+    Args:
+        layer: Encoded layer (dense or quantized).
+
+    Returns:
+        np.ndarray: Values of the layer (float32 if it was quantized).
+    """
+    codec = layer[0]
+    if codec == DENSE_LAYER:
+        return layer[1]
+    if codec == FP16_LAYER:
+        return layer[1].astype(np.float32)
+    if codec == BF16_LAYER:
+        return (layer[1].astype(np.uint32) << 16).view(np.float32)
+    if codec == INT8_LAYER:
+        q, scale, zero_point, axis = layer[1:]
+        if axis == 0:
+            shape = (-1,) + (1,) * (q.ndim - 1)
+            scale, zero_point = np.reshape(scale, shape), np.reshape(zero_point, shape)
+        return ((q.astype(np.int32) - zero_point) * scale).astype(np.float32)
+    raise ValueError("Unknown layer codec {}".format(codec))
+
+
+class Quantizer:
+    """
+    Quantizes the parameters of a model (no reference needed, used for every model sent).
+
+    Args:
+        mode: Quantization mode (fp16, bf16 or int8).
+        per_channel: Scale and zero-point of int8 by output channel.
+        keep_batchnorm: Send the batch norm statistics in full precision.
+        min_layer_size: Layers with fewer entries are sent in full precision.
+    """
+
+    def __init__(self, mode, per_channel=False, keep_batchnorm=True, min_layer_size=1024):
+        if mode not in QUANTIZATIONS or mode == NONE:
+            raise ValueError("Quantization {} not supported".format(mode))
+        self.mode = mode
+        self.per_channel = per_channel
+        self.keep_batchnorm = keep_batchnorm
+        self.min_layer_size = min_layer_size
+
+    def full_precision(self, name, array):
+        return (
+            not np.issubdtype(array.dtype, np.floating)
+            or array.size < self.min_layer_size
+            or (self.keep_batchnorm and name is not None and name.endswith(BATCHNORM_STATISTICS))
+        )
+
+    def quantize(self, arrays, names=None):
+        """
+        Args:
+            arrays: Parameters of the model (list of arrays).
+            names: Names of the layers (state dict keys).
+
+        Returns:
+            list: Encoded layers.
+        """
+        names = names or [None] * len(arrays)
+        return [
+            (DENSE_LAYER, array) if self.full_precision(name, array) else quantize(array, self.mode, self.per_channel)
+            for name, array in zip(names, arrays)
+        ]
+
+
+def decode_layers(layers):
+    """
+    Decodes quantized (or dense) layers back to arrays.
+    """
+    return [dequantize(layer) for layer in layers]
+
+
+###################
+#    Top-k        #
+###################
+
+
+def topk_sparsify(update, ratio):
+    """
+    Args:
+        update: Flat float32 array.
+        ratio: Fraction of the entries to keep.
+
+    Returns:
+        tuple: (indices, values) of the largest entries by magnitude, as sorted int32 indices and float32 values.
+    """
+    k = min(update.size, max(1, math.ceil(ratio * update.size)))
+    if k == update.size:
+        indices = np.arange(update.size, dtype=np.int32)
+    else:
+        indices = np.sort(np.argpartition(np.abs(update), update.size - k)[update.size - k:]).astype(np.int32)
+    return indices, update[indices]
+
+
+############################
+#    UpdateCompressor      #
+############################
+
+
+class UpdateCompressor:
+    """
+    Compresses the parameters of a learner as updates with respect to its reference model.
+
+    Args:
+        algorithm: Compression algorithm (``topk``).
+        ratio: Fraction of the entries of each layer sent by top-k.
+        error_feedback: Accumulate the entries of the own updates not sent and add them to the next own update.
+        min_layer_size: Layers with fewer entries are sent dense.
+        quantization: Quantization of the values sent (fp16 if none).
+        keep_batchnorm: Send the batch norm statistics dense.
+    """
+
+    def __init__(self, algorithm=TOPK, ratio=0.01, error_feedback=True, min_layer_size=1024, quantization=NONE, keep_batchnorm=True):
+        if algorithm != TOPK:
+            raise ValueError("Compression algorithm {} not supported".format(algorithm))
+        if not 0 < ratio <= 1:
+            raise ValueError("Top-k ratio must be in (0, 1], got {}".format(ratio))
+        if quantization not in QUANTIZATIONS:
+            raise ValueError("Quantization {} not supported".format(quantization))
+        self.algorithm = algorithm
+        self.ratio = ratio
+        self.error_feedback = error_feedback
+        self.min_layer_size = min_layer_size
+        self.values_quantization = FP16 if quantization == NONE else quantization
+        self.keep_batchnorm = keep_batchnorm
+        self.__reference = None
+        self.__reference_id = None
+        self.__residuals = None
+        self.__cache = {}
+        self.__lock = threading.Lock()
+
+    def set_reference(self, arrays, round=0):
+        """
+        Sets the reference model (the updates are computed and applied with respect to it).
+
+        Args:
+            arrays: Parameters of the model (list of arrays, in the order of the state dict).
+            round: Round of the reference (part of its id).
+        """
+        reference = [np.array(a, copy=True) for a in arrays]
+        digest = hashlib.blake2b(digest_size=8)
+        for array in reference:
+            digest.update(np.ascontiguousarray(array).view(np.uint8))
+        with self.__lock:
+            self.__reference = reference
+            self.__reference_id = "{}-{}".format(round, digest.hexdigest())
+            self.__cache = {}
+
+    def has_reference(self):
+        return self.__reference is not None
+
+    @property
+    def reference_id(self):
+        """
+        str: Id of the reference model (round and digest of its parameters), None if not set.
+        """
+        return self.__reference_id
+
+    def __compressible(self, name, array):
+        return (
+            np.issubdtype(array.dtype, np.floating)
+            and array.size >= self.min_layer_size
+            and not (self.keep_batchnorm and name is not None and name.endswith(BATCHNORM_STATISTICS))
+        )
+
+    def compress(self, arrays, contributors=None, weight=None, names=None, own=False):
+        """
+        Compresses the parameters of a model.
+
+        The result is cached by contributors and weight until the reference changes, so the same model gossiped
+        several times is compressed once (and its residual accumulated once).
+
+        Args:
+            arrays: Parameters of the model (list of arrays).
+            contributors: Nodes that contributed to the model.
+            weight: Weight of the model.
+            names: Names of the layers (state dict keys).
+            own: The model is the own model of the node (the only one with error feedback).
+
+        Returns:
+            list: Encoded layers.
+        """
+        key = (tuple(contributors or ()), weight)
+        names = names or [None] * len(arrays)
+        with self.__lock:
+            if key in self.__cache:
+                return self.__cache[key]
+            if len(arrays) != len(self.__reference):
+                raise ValueError("Model has {} layers, reference has {}".format(len(arrays), len(self.__reference)))
+
+            # Only the own updates keep a residual, relayed models and partial aggregations change every round
+            feedback = self.error_feedback and own
+            residuals = self.__residuals if feedback else None
+            new_residuals = []
+            layers = []
+            for i, (name, array, reference) in enumerate(zip(names, arrays, self.__reference)):
+                if not self.__compressible(name, array):
+                    layers.append((DENSE_LAYER, array))
+                    new_residuals.append(None)
+                    continue
+                update = (np.asarray(array, dtype=np.float32) - reference).ravel()
+                if residuals is not None and residuals[i] is not None:
+                    update += residuals[i]
+                indices, values = topk_sparsify(update, self.ratio)
+                values = quantize(values, self.values_quantization)
+                layers.append((TOPK_LAYER, indices, values))
+                if feedback:
+                    update[indices] -= dequantize(values)
+                    new_residuals.append(update)
+
+            if feedback:
+                self.__residuals = new_residuals
+            self.__cache[key] = layers
+            return layers
+
+    def decompress(self, layers, reference_id=None):
+        """
+        Rebuilds the parameters of a model from its encoded layers and the reference.
+
+        Args:
+            layers: Encoded layers.
+            reference_id: Id of the reference of the sender.
+
+        Returns:
+            list: Parameters of the model (list of arrays).
+
+        Raises:
+            ReferenceMismatchError: If the update was computed with respect to another reference.
+        """
+        with self.__lock:
+            reference, own_id = self.__reference, self.__reference_id
+        if reference is None:
+            raise ValueError("Compressed parameters received without a reference model")
+        if reference_id != own_id:
+            raise ReferenceMismatchError("Update computed on reference {}, own reference is {}".format(reference_id, own_id))
+        if len(layers) != len(reference):
+            raise ValueError("Received {} layers, reference has {}".format(len(layers), len(reference)))
+
+        arrays = []
+        for layer, base in zip(layers, reference):
+            if layer[0] == TOPK_LAYER:
+                indices, values = layer[1], dequantize(layer[2])
+                if len(indices) and indices[-1] >= base.size:
+                    raise ValueError("Update index out of the layer ({} entries)".format(base.size))
+                array = base.astype(np.float32).ravel()
+                array[indices] += values
+                arrays.append(array.reshape(base.shape))
+            else:
+                arrays.append(dequantize(layer))
+        return arrays
+
+
+def build_compressor(config):
+    """
+    Builds the compressor of the learner from ``compression_args`` of the participant configuration.
+
+    Returns:
+        UpdateCompressor: The compressor, or None if compression is disabled.
+    """
+    if config is None:
+        return None
+    args = config.participant.get("compression_args", {})
+    algorithm = args.get("algorithm", NONE)
+    if algorithm == NONE:
+        return None
+    return UpdateCompressor(
+        algorithm=algorithm,
+        ratio=args.get("topk_ratio", 0.01),
+        error_feedback=args.get("error_feedback", True),
+        min_layer_size=args.get("min_layer_size", 1024),
+        quantization=args.get("quantization", NONE),
+        keep_batchnorm=args.get("keep_batchnorm", True),
+    )
+
+
+def build_quantizer(config):
+    """
+    Builds the quantizer of the learner from ``compression_args`` of the participant configuration.
+
+    Returns:
+        Quantizer: The quantizer, or None if quantization is disabled.
+    """
+    if config is None:
+        return None
+    args = config.participant.get("compression_args", {})
+    mode = args.get("quantization", NONE)
+    if mode == NONE:
+        return None
+    return Quantizer(
+        mode,
+        per_channel=args.get("per_channel", False),
+        keep_batchnorm=args.get("keep_batchnorm", True),
+        min_layer_size=args.get("min_layer_size", 1024),
+    )
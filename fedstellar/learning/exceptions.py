@@ -12,6 +12,14 @@ class DecodingParamsError(Exception):
     pass
 
 
+class ReferenceMismatchError(DecodingParamsError):
+    """
+    An exception raised when a compressed update was computed with respect to another reference model.
+    """
+
+    pass
+
+
 class ModelNotMatchingError(Exception):
     """
     An exception raised when parameters do not match with the model.
@@ -47,7 +47,16 @@ class NodeLearner:
         """
         pass
 
-    def encode_parameters(self, params=None, contributors=None, weight=None):
+    def set_instrumentation(self, instrumentation):
+        """
+        Set the instrumentation used to measure the training and evaluation.
+
+        Args:
+            instrumentation: Instrumentation of the node.
+        """
+        pass
+
+    def encode_parameters(self, params=None, contributors=None, weight=None, dense=False, own=False):
         """
         Encode the parameters of the model. (binary)
         If params are not provided, self parameters are encoded.
@@ -56,6 +65,8 @@ class NodeLearner:
             params: The parameters of the model. (non-binary)
             contributors: The contributors of the model.
             weight: The weight of the model.
+            dense: Send the parameters instead of the compressed update (the receiver has another reference).
+            own: The parameters are the own model of the node.
 
         Returns:
             The encoded parameters of the model (params, contributors, weight).
@@ -101,6 +112,22 @@ class NodeLearner:
         """
         pass
 
+    def set_reference(self, round=0):
+        """
+        Set the actual parameters as the reference model of the compressed updates (the last agreed global model).
+
+        Args:
+            round: The round the reference is used in.
+        """
+        pass
+
+    def get_reference(self):
+        """
+        Returns:
+            The id of the reference model of the compressed updates (None if compression is disabled).
+        """
+        return None
+
     def get_parameters(self):
         """
         Get the parameters of the model.
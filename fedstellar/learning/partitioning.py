@@ -0,0 +1,179 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+"""
+Partitioning of a dataset among the participants of a scenario.
+
+Partitions are computed once per scenario (by the controller) from the targets of the dataset, and saved as
+one compact index file per participant and split. Each participant then loads only its own indices.
+
+Every strategy draws its random parameters before looking at the data, so the train and test splits of a
+participant follow the same distribution when they are partitioned with the same seed.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+# Strategy used when the configuration does not define one (legacy contiguous ranges, computed by the data modules)
+CONTIGUOUS = "contiguous"
+
+
+def _group_by_node(assignment, n_nodes):
+    """
+    Args:
+        assignment: Array with the node assigned to every sample.
+        n_nodes: Number of nodes.
+
+    Returns:
+        list: One array of sample indices per node.
+    """
+    order = np.argsort(assignment, kind="stable")
+    counts = np.bincount(assignment, minlength=n_nodes)
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+def _class_sorted_order(labels, rng):
+    """
+    Returns:
+        np.ndarray: Indices of the samples sorted by label, randomly ordered within each label.
+    """
+    perm = rng.permutation(len(labels))
+    return perm[np.argsort(labels[perm], kind="stable")]
+
+
+def iid_partition(labels, n_nodes, rng, n_classes):
+    """
+    Uniformly random split in (almost) equal parts.
+    """
+    assignment = np.empty(len(labels), dtype=np.int64)
+    assignment[rng.permutation(len(labels))] = np.arange(len(labels)) % n_nodes
+    return _group_by_node(assignment, n_nodes)
+
+
+def dirichlet_partition(labels, n_nodes, rng, n_classes, alpha=0.5):
+    """
+    Label skew: the samples of each class are split among the nodes following proportions drawn from Dir(alpha).
+    Lower alpha means more heterogeneous nodes.
+    """
+    proportions = rng.dirichlet(np.full(n_nodes, alpha), size=n_classes)  # (classes, nodes)
+    order = _class_sorted_order(labels, rng)
+    class_counts = np.bincount(labels, minlength=n_classes)
+    class_start = np.concatenate(([0], np.cumsum(class_counts)[:-1]))
+
+    # Cut points of every class, shifted to global positions in the class-sorted order (monotonic when flattened)
+    cuts = np.floor(np.cumsum(proportions, axis=1) * class_counts[:, None]).astype(np.int64)
+    cuts[:, -1] = class_counts
+    cuts += class_start[:, None]
+    nodes_sorted = np.searchsorted(cuts.ravel(), np.arange(len(labels)), side="right") % n_nodes
+
+    assignment = np.empty(len(labels), dtype=np.int64)
+    assignment[order] = nodes_sorted
+    return _group_by_node(assignment, n_nodes)
+
+
+def shard_partition(labels, n_nodes, rng, n_classes, shards_per_node=2):
+    """
+    Pathological non-IID: the label-sorted dataset is split into n_nodes * shards_per_node shards and each node
+    receives shards_per_node random shards.
+    """
+    n_shards = n_nodes * shards_per_node
+    shard_owner = rng.permutation(n_shards) % n_nodes
+    order = _class_sorted_order(labels, rng)
+    shard_of_position = np.arange(len(labels)) * n_shards // max(len(labels), 1)
+
+    assignment = np.empty(len(labels), dtype=np.int64)
+    assignment[order] = shard_owner[shard_of_position]
+    return _group_by_node(assignment, n_nodes)
+
+
+def quantity_partition(labels, n_nodes, rng, n_classes, beta=0.5):
+    """
+    Quantity skew: random samples, with the size of each partition drawn from Dir(beta).
+    """
+    proportions = rng.dirichlet(np.full(n_nodes, beta))
+    cuts = np.floor(np.cumsum(proportions) * len(labels)).astype(np.int64)
+    cuts[-1] = len(labels)
+    nodes_sorted = np.searchsorted(cuts, np.arange(len(labels)), side="right")
+
+    assignment = np.empty(len(labels), dtype=np.int64)
+    assignment[rng.permutation(len(labels))] = nodes_sorted
+    return _group_by_node(assignment, n_nodes)
+
+
+PARTITION_STRATEGIES = {
+    "iid": iid_partition,
+    "dirichlet": dirichlet_partition,
+    "shard": shard_partition,
+    "quantity": quantity_partition,
+}
+
+
+def partition_dataset(labels, n_nodes, strategy="iid", seed=0, n_classes=None, **params):
+    """
+    Splits a dataset among the nodes.
+
+    Args:
+        labels: Array with the label of every sample.
+        n_nodes: Number of nodes.
+        strategy: One of PARTITION_STRATEGIES.
+        seed: Random seed (same seed and same number of classes give the same distribution in train and test).
+        n_classes: Number of classes (inferred from the labels if None).
+        params: Parameters of the strategy (e.g. alpha, shards_per_node, beta).
+
+    Returns:
+        list: One array of sample indices per node.
+    """
+    if strategy not in PARTITION_STRATEGIES:
+        raise ValueError("Partition strategy {} not supported".format(strategy))
+    labels = np.asarray(labels).astype(np.int64, copy=False)
+    if n_classes is None:
+        n_classes = int(labels.max()) + 1 if len(labels) else 0
+    rng = np.random.default_rng(seed)
+    return PARTITION_STRATEGIES[strategy](labels, n_nodes, rng, n_classes, **params)
+
+
+def save_partitions(directory, split, partitions, metadata=None):
+    """
+    Saves one index file per node ({split}_{idx}.npy) and a manifest with the partition sizes.
+
+    Args:
+        directory: Directory of the partitions of the scenario.
+        split: Name of the split (train or test).
+        partitions: List of arrays of indices.
+        metadata: Information about the partition (strategy, parameters, seed).
+    """
+    os.makedirs(directory, exist_ok=True)
+    dtype = np.int32 if sum(len(p) for p in partitions) < np.iinfo(np.int32).max else np.int64
+    for idx, indices in enumerate(partitions):
+        np.save(os.path.join(directory, "{}_{}.npy".format(split, idx)), indices.astype(dtype))
+
+    manifest_file = os.path.join(directory, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    manifest.update(metadata or {})
+    manifest[split] = [int(len(p)) for p in partitions]
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_partition(directory, idx):
+    """
+    Args:
+        directory: Directory of the partitions of the scenario.
+        idx: Index of the node.
+
+    Returns:
+        tuple: (train indices, test indices) of the node or None if the partitions were not generated.
+    """
+    train_file = os.path.join(directory, "train_{}.npy".format(idx))
+    test_file = os.path.join(directory, "test_{}.npy".format(idx))
+    if not os.path.exists(train_file) or not os.path.exists(test_file):
+        return None
+    logging.info("[Partitioning] Loading partition of node {} from {}".format(idx, directory))
+    return np.load(train_file).astype(np.int64), np.load(test_file).astype(np.int64)
@@ -7,10 +7,11 @@ from math import floor
 # To Avoid Crashes with a lot of nodes
 import torch.multiprocessing
 import lightning as pl
-from torch.utils.data import DataLoader
 from torchvision import transforms as T
 from torchvision.datasets import CIFAR10
 
+from fedstellar.learning.pytorch.tensorloader import build_dataloader
+
 import re
 from pathlib import Path
 from PIL import Image
@@ -18,7 +19,10 @@ import pandas as pd
 
 
 class CIFAR10DataModule(pl.LightningDataModule):
-    def __init__(self, normalization="cifar10", loading="torchvision", sub_id=0, number_sub=1, num_workers=4, batch_size=32, iid=True, root_dir="./data"):
+    # Datasets shared by the nodes of the same process, by (root_dir, train, normalization)
+    datasets = {}
+
+    def __init__(self, normalization="cifar10", loading="torchvision", sub_id=0, number_sub=1, num_workers=4, batch_size=32, iid=True, root_dir="./data", partition=None):
         super().__init__()
         self.sub_id = sub_id
         self.number_sub = number_sub
@@ -28,8 +32,13 @@ class CIFAR10DataModule(pl.LightningDataModule):
         self.root_dir = root_dir
         self.loading = loading
         self.normalization = normalization
+        # Tuple (train indices, test indices) precomputed once per scenario (see fedstellar.learning.partitioning)
+        self.partition = partition
         self.mean = self.set_normalization(normalization)["mean"]
         self.std = self.set_normalization(normalization)["std"]
+        # DataLoaders are built on first use and reused afterwards
+        self.train_loader = None
+        self.val_loader = None
 
     def set_normalization(self, normalization):
         # Image classification on the CIFAR10 dataset - Albumentations Documentation https://albumentations.ai/docs/autoalbument/examples/cifar10/
@@ -46,19 +55,41 @@ class CIFAR10DataModule(pl.LightningDataModule):
 
     def get_dataset(self, train, transform, download=True):
         if self.loading == "torchvision":
-            dataset = CIFAR10(
-                root=self.root_dir,
-                train=train,
-                transform=transform,
-                download=download,
-            )
+            # The transforms only depend on the split and the normalization
+            key = (self.root_dir, train, self.normalization)
+            dataset = CIFAR10DataModule.datasets.get(key)
+            if dataset is None:
+                dataset = CIFAR10(
+                    root=self.root_dir,
+                    train=train,
+                    transform=transform,
+                    download=download,
+                )
+                CIFAR10DataModule.datasets[key] = dataset
         elif self.loading == "custom":
             raise NotImplementedError
         else:
             raise NotImplementedError
         return dataset
 
+    def get_indices(self, dataset, train=True):
+        if self.partition is not None:
+            return self.partition[0] if train else self.partition[1]
+        # To Avoid same data in all nodes
+        rows_by_sub = floor(len(dataset) / self.number_sub)
+        return range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
+
+    @staticmethod
+    def get_targets(root_dir, train=True):
+        """
+        Returns:
+            Targets of the whole dataset, used to compute the partitions of a scenario.
+        """
+        return CIFAR10(root=root_dir, train=train, download=True).targets
+
     def train_dataloader(self):
+        if self.train_loader is not None:
+            return self.train_loader
         transform = T.Compose(
             [
                 T.RandomCrop(32, padding=4),
@@ -72,24 +103,23 @@ class CIFAR10DataModule(pl.LightningDataModule):
             transform=transform,
         )
 
-        # To Avoid same data in all nodes
-        rows_by_sub = floor(len(dataset) / self.number_sub)
-        cifar10_train = torch.utils.data.Subset(dataset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub))
+        cifar10_train = torch.utils.data.Subset(dataset, self.get_indices(dataset, train=True))
 
-        dataloader = DataLoader(
+        self.train_loader = build_dataloader(
             cifar10_train,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
             shuffle=True,
             drop_last=True,
-            pin_memory=False,
         )
 
         print(f"Train Dataset Size: {len(cifar10_train)}")
 
-        return dataloader
+        return self.train_loader
 
     def val_dataloader(self):
+        if self.val_loader is not None:
+            return self.val_loader
         transform = T.Compose(
             [
                 T.ToTensor(),
@@ -97,20 +127,24 @@ class CIFAR10DataModule(pl.LightningDataModule):
             ]
         )
         dataset = self.get_dataset(train=False, transform=transform)
-        # To Avoid same data in all nodes
-        rows_by_sub = floor(len(dataset) / self.number_sub)
-        cifar10_val = torch.utils.data.Subset(dataset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub))
+        cifar10_val = torch.utils.data.Subset(dataset, self.get_indices(dataset, train=False))
         print(f"Val/Test Dataset Size: {len(cifar10_val)}")
         print(f"Example: {cifar10_val[0][0].shape}")
-        dataloader = DataLoader(
+        self.val_loader = build_dataloader(
             cifar10_val,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
             drop_last=True,
-            pin_memory=False,
         )
 
-        return dataloader
+        return self.val_loader
 
     def test_dataloader(self):
         return self.val_dataloader()
+
+    @property
+    def num_samples(self):
+        """
+        Number of samples (train, test), the datasets are only built the first time.
+        """
+        return len(self.train_dataloader().dataset), len(self.test_dataloader().dataset)
@@ -13,17 +13,22 @@ from collections import defaultdict
 import torch.multiprocessing
 from PIL import Image
 from lightning import LightningDataModule
-from torch.utils.data import DataLoader, Subset, random_split, Dataset
+from torch.utils.data import Subset, random_split, Dataset
 from torchvision.datasets import MNIST, utils
 from torchvision import transforms
 import numpy as np
 
+from fedstellar.learning.pytorch.tensorcache import TensorCache
+from fedstellar.learning.pytorch.tensorloader import build_dataloader
+
 torch.multiprocessing.set_sharing_strategy("file_system")
 
 
 class FEMNIST(MNIST):
-    def __init__(self, sub_id, number_sub, root_dir, train=True, transform=None, target_transform=None, download=False):
+    def __init__(self, sub_id, number_sub, root_dir, train=True, transform=None, target_transform=None, download=False, preprocess=None):
         super(MNIST, self).__init__(root_dir, transform=transform, target_transform=target_transform)
+        # Deterministic PIL transforms, applied once when the tensor cache is built
+        self.preprocess = preprocess
         self.sub_id = sub_id
         self.number_sub = number_sub
         self.download = download
@@ -47,19 +52,51 @@ class FEMNIST(MNIST):
         else:
             data_file = self.test_file
 
-        # Whole dataset
+        # Whole dataset, preprocessed once and memory-mapped from the tensor cache
+        cache = TensorCache(
+            f'{self.root}/FEMNIST/cache/{"train" if self.train else "test"}',
+            fingerprint="{}|{}".format(TensorCache.file_fingerprint(data_file), repr(self.preprocess))
+        )
+        if not cache.is_valid():
+            self.build_cache(cache, data_file)
+        self.data, self.targets = cache.load("data"), cache.load("targets")
+
+    def build_cache(self, cache, data_file):
+        """
+        Applies the deterministic preprocessing to every sample once and stores the result as float32 arrays.
+
+        Args:
+            cache: TensorCache where the arrays are written.
+            data_file: Original .pt file with the images and the targets.
+        """
+        print('Building FEMNIST tensor cache ({})...'.format(cache.cache_dir))
         data_and_targets = torch.load(data_file)
-        self.data, self.targets = data_and_targets[0], data_and_targets[1]
+        data, targets = data_and_targets[0], data_and_targets[1]
+        if self.preprocess is not None:
+            data = torch.stack([self.preprocess(Image.fromarray(img.numpy(), mode='F')) for img in data])
+        cache.save({
+            "data": np.asarray(data, dtype=np.float32),
+            "targets": np.asarray(targets, dtype=np.int64)
+        })
 
     def __getitem__(self, index):
-        img, target = self.data[index], int(self.targets[index])
-        img = Image.fromarray(img.numpy(), mode='F')
+        img, target = torch.from_numpy(np.array(self.data[index])), int(self.targets[index])
         if self.transform is not None:
             img = self.transform(img)
         if self.target_transform is not None:
             target = self.target_transform(target)
         return img, target
 
+    def __getitems__(self, indices):
+        # Batched read: a single fancy-indexing on the memory-mapped arrays per batch
+        indices = np.asarray(indices)
+        imgs, targets = torch.from_numpy(self.data[indices]), self.targets[indices].tolist()
+        if self.transform is not None:
+            imgs = [self.transform(img) for img in imgs]
+        if self.target_transform is not None:
+            targets = [self.target_transform(target) for target in targets]
+        return list(zip(imgs, targets))
+
     def dataset_download(self):
         paths = [f'{self.root}/FEMNIST/raw/', f'{self.root}/FEMNIST/processed/']
         for path in paths:
@@ -98,7 +135,13 @@ class FEMNISTDataModule(LightningDataModule):
     Details: 62 different classes (10 digits, 26 lowercase, 26 uppercase), images are 28 by 28 pixels (with option to make them all 128 by 128 pixels), 3500 users
 
     Args:
-
+        sub_id: Subset id of partition. (0 <= sub_id < number_sub)
+        number_sub: Number of subsets.
+        batch_size: The batch size of the data.
+        num_workers: The number of workers of the data.
+        val_percent: The percentage of the validation set.
+        root_dir: Directory of the datasets.
+        partition: Tuple (train indices, test indices) of this subset, overrides the contiguous ranges.
     """
 
     # Singleton
@@ -113,6 +156,7 @@ class FEMNISTDataModule(LightningDataModule):
             num_workers=4,
             val_percent=0.1,
             root_dir=None,
+            partition=None,
     ):
         super().__init__()
         self.sub_id = sub_id
@@ -122,28 +166,30 @@ class FEMNISTDataModule(LightningDataModule):
         self.val_percent = val_percent
         self.root_dir = root_dir
 
-        transform_data = transforms.Compose(
-            [
-                transforms.CenterCrop((96, 96)),
-                transforms.Grayscale(num_output_channels=1),
-                transforms.Resize((28, 28)),
-                transforms.ColorJitter(contrast=3),
-                transforms.ToTensor(),
-                transforms.Normalize((0.1307,), (0.3081,))]
-        )
+        preprocess_data = self.preprocess_transform()
+        transform_data = self.augment_transform()
 
-        self.train = FEMNIST(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=True, transform=transform_data, target_transform=None, download=True)
-        self.test = FEMNIST(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=False, transform=transform_data, target_transform=None, download=True)
+        # Singletons of FEMNIST train and test datasets (shared by the nodes of the same process)
+        if FEMNISTDataModule.femnist_train is None or FEMNISTDataModule.femnist_train.root != root_dir:
+            FEMNISTDataModule.femnist_train = FEMNIST(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=True, transform=transform_data, target_transform=None, download=True, preprocess=preprocess_data)
+        if FEMNISTDataModule.femnist_val is None or FEMNISTDataModule.femnist_val.root != root_dir:
+            FEMNISTDataModule.femnist_val = FEMNIST(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=False, transform=transform_data, target_transform=None, download=True, preprocess=preprocess_data)
+        self.train = FEMNISTDataModule.femnist_train
+        self.test = FEMNISTDataModule.femnist_val
 
         if len(self.test) < self.number_sub:
             raise ValueError("Too many partitions")
 
         # Training / validation set
         trainset = self.train
-        rows_by_sub = floor(len(trainset) / self.number_sub)
-        tr_subset = Subset(
-            trainset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
-        )
+        if partition is not None:
+            # Indices precomputed once per scenario (see fedstellar.learning.partitioning)
+            tr_subset = Subset(trainset, partition[0])
+        else:
+            rows_by_sub = floor(len(trainset) / self.number_sub)
+            tr_subset = Subset(
+                trainset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
+            )
         femnist_train, femnist_val = random_split(
             tr_subset,
             [
@@ -154,25 +200,30 @@ class FEMNISTDataModule(LightningDataModule):
 
         # Test set
         testset = self.test
-        rows_by_sub = floor(len(testset) / self.number_sub)
-        te_subset = Subset(
-            testset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
-        )
+        if partition is not None:
+            te_subset = Subset(testset, partition[1])
+        else:
+            rows_by_sub = floor(len(testset) / self.number_sub)
+            te_subset = Subset(
+                testset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
+            )
+
+        self.num_samples = (len(femnist_train), len(te_subset))
 
         # DataLoaders
-        self.train_loader = DataLoader(
+        self.train_loader = build_dataloader(
             femnist_train,
             batch_size=self.batch_size,
             shuffle=True,
             num_workers=self.num_workers,
         )
-        self.val_loader = DataLoader(
+        self.val_loader = build_dataloader(
             femnist_val,
             batch_size=self.batch_size,
             shuffle=False,
             num_workers=self.num_workers,
         )
-        self.test_loader = DataLoader(
+        self.test_loader = build_dataloader(
             te_subset,
             batch_size=self.batch_size,
             shuffle=False,
@@ -184,6 +235,39 @@ class FEMNISTDataModule(LightningDataModule):
             )
         )
 
+    @staticmethod
+    def preprocess_transform():
+        """
+        Deterministic part of the pipeline, cached on disk as float32 tensors.
+        """
+        return transforms.Compose(
+            [
+                transforms.CenterCrop((96, 96)),
+                transforms.Grayscale(num_output_channels=1),
+                transforms.Resize((28, 28)),
+                transforms.ToTensor()]
+        )
+
+    @staticmethod
+    def augment_transform():
+        """
+        Random augmentation and normalization, applied on tensors at load time.
+        """
+        return transforms.Compose(
+            [
+                transforms.ColorJitter(contrast=3),
+                transforms.Normalize((0.1307,), (0.3081,))]
+        )
+
+    @staticmethod
+    def get_targets(root_dir, train=True):
+        """
+        Returns:
+            Targets of the whole dataset, used to compute the partitions of a scenario.
+        """
+        dataset = FEMNIST(sub_id=0, number_sub=1, root_dir=root_dir, train=train, download=True, preprocess=FEMNISTDataModule.preprocess_transform())
+        return np.asarray(dataset.targets)
+
     def train_dataloader(self):
         """ """
         return self.train_loader
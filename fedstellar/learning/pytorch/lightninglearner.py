@@ -26,8 +26,10 @@ from lightning.pytorch.callbacks import ModelSummary
 from lightning.pytorch.callbacks import RichProgressBar, RichModelSummary
 from lightning.pytorch.callbacks.progress.rich_progress import RichProgressBarTheme
 
-from fedstellar.learning.exceptions import DecodingParamsError, ModelNotMatchingError
+from fedstellar.learning.compression import TOPK, build_compressor, build_quantizer, decode_layers
+from fedstellar.learning.exceptions import DecodingParamsError, ModelNotMatchingError, ReferenceMismatchError
 from fedstellar.learning.learner import NodeLearner
+from fedstellar.utils.instrumentation import NULL_INSTRUMENTATION
 
 
 ###########################
@@ -53,7 +55,12 @@ class LightningLearner(NodeLearner):
         self.config = config
         self.logger = logger
         self.__trainer = None
+        self.__num_samples = None
+        self.instrumentation = NULL_INSTRUMENTATION
         self.epochs = 1
+        # Compression of the updates gossiped for aggregation and quantization of the models sent (None if disabled)
+        self.compressor = build_compressor(config)
+        self.quantizer = build_quantizer(config)
         logging.getLogger("lightning.pytorch").setLevel(logging.WARNING)
 
         # FL information
@@ -69,22 +76,50 @@ class LightningLearner(NodeLearner):
 
     def set_data(self, data):
         self.data = data
+        self.__num_samples = None
 
-    def encode_parameters(self, params=None, contributors=None, weight=None):
+    def set_instrumentation(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    def encode_parameters(self, params=None, contributors=None, weight=None, dense=False, own=False):
         if params is None:
             params = self.model.state_dict()
         array = [val.cpu().numpy() for _, val in params.items()]
+        # Models for aggregation are sent as compressed updates, diffused (and initial) models are only quantized
+        if self.compressor is not None and contributors is not None and not dense and self.compressor.has_reference():
+            with self.instrumentation.timer("compress"):
+                array = {
+                    "algorithm": self.compressor.algorithm,
+                    "reference": self.compressor.reference_id,
+                    "layers": self.compressor.compress(array, contributors, weight, names=list(params.keys()), own=own),
+                }
+        elif self.quantizer is not None:
+            with self.instrumentation.timer("compress"):
+                array = {"algorithm": self.quantizer.mode, "layers": self.quantizer.quantize(array, names=list(params.keys()))}
         return pickle.dumps((array, contributors, weight))
 
     def decode_parameters(self, data):
         try:
             params, contributors, weight = pickle.loads(data)
+            # Compressed parameters are decoded back to float32 before the aggregation
+            if isinstance(params, dict):
+                try:
+                    if params["algorithm"] == TOPK:
+                        if self.compressor is None:
+                            raise ValueError("Compressed parameters received but compression is disabled")
+                        params = self.compressor.decompress(params["layers"], params.get("reference"))
+                    else:
+                        params = decode_layers(params["layers"])
+                except ValueError as e:
+                    raise DecodingParamsError(str(e))
             params_dict = zip(self.model.state_dict().keys(), params)
             return (
                 OrderedDict({k: torch.tensor(v) for k, v in params_dict}),
                 contributors,
                 weight,
             )
+        except ReferenceMismatchError:
+            raise
         except DecodingParamsError:
             raise DecodingParamsError("Error decoding parameters")
 
@@ -104,6 +139,13 @@ class LightningLearner(NodeLearner):
         except ModelNotMatchingError:
             raise ModelNotMatchingError("Not matching models")
 
+    def set_reference(self, round=0):
+        if self.compressor is not None:
+            self.compressor.set_reference([val.cpu().numpy() for val in self.model.state_dict().values()], round)
+
+    def get_reference(self):
+        return self.compressor.reference_id if self.compressor is not None else None
+
     def get_parameters(self):
         return self.model.state_dict()
 
@@ -114,7 +156,8 @@ class LightningLearner(NodeLearner):
         try:
             if self.epochs > 0:
                 self.create_trainer()
-                self.__trainer.fit(self.model, self.data)
+                with self.instrumentation.timer("fit"):
+                    self.__trainer.fit(self.model, self.data)
                 self.__trainer = None
         except Exception as e:
             logging.error("Something went wrong with pytorch lightning. {}".format(e))
@@ -128,7 +171,8 @@ class LightningLearner(NodeLearner):
         try:
             if self.epochs > 0:
                 self.create_trainer()
-                self.__trainer.test(self.model, self.data, verbose=True)
+                with self.instrumentation.timer("evaluate"):
+                    self.__trainer.test(self.model, self.data, verbose=True)
                 self.__trainer = None
                 # results = self.__trainer.test(self.model, self.data, verbose=True)
                 # loss = results[0]["Test/Loss"]
@@ -147,10 +191,16 @@ class LightningLearner(NodeLearner):
         pass
 
     def get_num_samples(self):
-        return (
-            len(self.data.train_dataloader().dataset),
-            len(self.data.test_dataloader().dataset),
-        )
+        # Computed once (used every round to weight the model), the data modules expose the counts from their setup
+        if self.__num_samples is None:
+            num_samples = getattr(self.data, "num_samples", None)
+            if num_samples is None:
+                num_samples = (
+                    len(self.data.train_dataloader().dataset),
+                    len(self.data.test_dataloader().dataset),
+                )
+            self.__num_samples = tuple(num_samples)
+        return self.__num_samples
 
     def init(self):
         self.close()
@@ -21,13 +21,36 @@ from math import floor
 # To Avoid Crashes with a lot of nodes
 import torch.multiprocessing
 from lightning import LightningDataModule
-from torch.utils.data import DataLoader, Subset, random_split
+from torch.utils.data import Subset, random_split
 from torchvision import transforms
 from torchvision.datasets import MNIST
 
+from fedstellar.learning.pytorch.tensorloader import build_dataloader
+
 torch.multiprocessing.set_sharing_strategy("file_system")
 
 
+class MNISTDataset(MNIST):
+    """
+    MNIST dataset that can be materialized as tensors for the in-memory loading path.
+    """
+
+    def as_tensors(self, indices=None):
+        """
+        Args:
+            indices: Tensor of indices to materialize (None for the whole dataset).
+
+        Returns:
+            tuple: (data, targets) tensors equivalent to applying ToTensor to every sample, or None if other transforms are used.
+        """
+        if not isinstance(self.transform, transforms.ToTensor) or self.target_transform is not None:
+            return None
+        data, targets = self.data, self.targets
+        if indices is not None:
+            data, targets = data[indices], targets[indices]
+        return data.unsqueeze(1).float().div(255), targets
+
+
 #######################################
 #    FederatedDataModule for MNIST    #
 #######################################
@@ -43,6 +66,9 @@ class MNISTDataModule(LightningDataModule):
         batch_size: The batch size of the data.
         num_workers: The number of workers of the data.
         val_percent: The percentage of the validation set.
+        iid: If False (and no partition is given), each subset is a contiguous range of the label-sorted dataset.
+        root_dir: Directory of the dataset (``<sys.path[0]>/data`` by default).
+        partition: Tuple (train indices, test indices) of this subset, overrides the contiguous ranges.
     """
 
     # Singleton
@@ -57,6 +83,8 @@ class MNISTDataModule(LightningDataModule):
             num_workers=4,
             val_percent=0.1,
             iid=True,
+            root_dir=None,
+            partition=None,
     ):
         super().__init__()
         self.sub_id = sub_id
@@ -66,42 +94,32 @@ class MNISTDataModule(LightningDataModule):
         self.val_percent = val_percent
 
         # Singletons of MNIST train and test datasets
-        if not os.path.exists(f"{sys.path[0]}/data"):
-            os.makedirs(f"{sys.path[0]}/data")
+        root_dir = root_dir or f"{sys.path[0]}/data"
+        if not os.path.exists(root_dir):
+            os.makedirs(root_dir)
 
         if MNISTDataModule.mnist_train is None:
-            MNISTDataModule.mnist_train = MNIST(
-                f"{sys.path[0]}/data", train=True, download=True, transform=transforms.ToTensor()
+            MNISTDataModule.mnist_train = MNISTDataset(
+                root_dir, train=True, download=True, transform=transforms.ToTensor()
             )
-            if not iid:
-                sorted_indexes = MNISTDataModule.mnist_train.targets.sort()[1]
-                MNISTDataModule.mnist_train.targets = (
-                    MNISTDataModule.mnist_train.targets[sorted_indexes]
-                )
-                MNISTDataModule.mnist_train.data = MNISTDataModule.mnist_train.data[
-                    sorted_indexes
-                ]
         if MNISTDataModule.mnist_val is None:
-            MNISTDataModule.mnist_val = MNIST(
-                f"{sys.path[0]}/data", train=False, download=True, transform=transforms.ToTensor()
+            MNISTDataModule.mnist_val = MNISTDataset(
+                root_dir, train=False, download=True, transform=transforms.ToTensor()
             )
-            if not iid:
-                sorted_indexes = MNISTDataModule.mnist_val.targets.sort()[1]
-                MNISTDataModule.mnist_val.targets = MNISTDataModule.mnist_val.targets[
-                    sorted_indexes
-                ]
-                MNISTDataModule.mnist_val.data = MNISTDataModule.mnist_val.data[
-                    sorted_indexes
-                ]
         if self.sub_id + 1 > self.number_sub:
             raise ("Not exist the subset {}".format(self.sub_id))
 
-        # Training / validation set
         trainset = MNISTDataModule.mnist_train
-        rows_by_sub = floor(len(trainset) / self.number_sub)
-        tr_subset = Subset(
-            trainset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
-        )
+        testset = MNISTDataModule.mnist_val
+        if partition is not None:
+            # Indices precomputed once per scenario (see fedstellar.learning.partitioning)
+            train_indices, test_indices = partition
+        else:
+            train_indices = self.contiguous_indices(trainset, iid)
+            test_indices = self.contiguous_indices(testset, iid)
+
+        # Training / validation set
+        tr_subset = Subset(trainset, train_indices)
         mnist_train, mnist_val = random_split(
             tr_subset,
             [
@@ -111,29 +129,27 @@ class MNISTDataModule(LightningDataModule):
         )
 
         # Test set
-        testset = MNISTDataModule.mnist_val
-        rows_by_sub = floor(len(testset) / self.number_sub)
-        te_subset = Subset(
-            testset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
-        )
+        te_subset = Subset(testset, test_indices)
 
         if len(testset) < self.number_sub:
             raise ("Too much partitions")
 
+        self.num_samples = (len(mnist_train), len(te_subset))
+
         # DataLoaders
-        self.train_loader = DataLoader(
+        self.train_loader = build_dataloader(
             mnist_train,
             batch_size=self.batch_size,
             shuffle=True,
             num_workers=self.num_workers,
         )
-        self.val_loader = DataLoader(
+        self.val_loader = build_dataloader(
             mnist_val,
             batch_size=self.batch_size,
             shuffle=False,
             num_workers=self.num_workers,
         )
-        self.test_loader = DataLoader(
+        self.test_loader = build_dataloader(
             te_subset,
             batch_size=self.batch_size,
             shuffle=False,
@@ -145,6 +161,25 @@ class MNISTDataModule(LightningDataModule):
             )
         )
 
+    def contiguous_indices(self, dataset, iid=True):
+        """
+        Returns:
+            Indices of the contiguous range of this subset (over the label-sorted dataset if not iid).
+        """
+        rows_by_sub = floor(len(dataset) / self.number_sub)
+        indices = range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
+        if iid:
+            return indices
+        return dataset.targets.sort(stable=True)[1][indices.start:indices.stop]
+
+    @staticmethod
+    def get_targets(root_dir, train=True):
+        """
+        Returns:
+            Targets of the whole dataset, used to compute the partitions of a scenario.
+        """
+        return MNISTDataset(root_dir, train=train, download=True).targets.numpy()
+
     def train_dataloader(self):
         """ """
         return self.train_loader
@@ -1,7 +1,12 @@
+import atexit
 import logging
 import os
+import queue
+import threading
+import time
 from argparse import Namespace
-from typing import Any, Dict, Mapping, Optional, Union
+from numbers import Number
+from typing import Any, Callable, Dict, Mapping, Optional, Union
 
 import numpy as np
 from lightning_utilities.core.imports import RequirementCache
@@ -23,6 +28,99 @@ log = logging.getLogger(__name__)
 _TENSORBOARD_AVAILABLE = RequirementCache("tensorboard")
 
 
+class AsyncScalarWriter(threading.Thread):
+    """
+    Background writer of scalars to a SummaryWriter.
+
+    The training thread only enqueues (tag, value, step) tuples in a bounded queue and never blocks on disk I/O:
+    if the queue is full the scalar is dropped (and counted). The writer thread coalesces the scalars by
+    (tag, step), keeping the last value, and writes them in batches every ``flush_interval`` seconds or when
+    ``max_batch`` different scalars are pending, followed by a single flush of the event file.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        get_experiment: Callable[[], SummaryWriter],
+        flush_interval: float = 2.0,
+        max_queue_size: int = 10000,
+        max_batch: int = 1000,
+    ):
+        super().__init__(daemon=True, name="metrics_writer")
+        self._get_experiment = get_experiment
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._dropped = 0
+        self._closed = False
+        atexit.register(self.close)
+
+    def put(self, tag: str, value: Any, step: int) -> bool:
+        try:
+            self._queue.put_nowait((tag, value, step))
+            return True
+        except queue.Full:
+            self._dropped += 1
+            if self._dropped == 1 or self._dropped % 1000 == 0:
+                log.warning(f"Metrics queue full, {self._dropped} scalars dropped")
+            return False
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """
+        Blocks until every scalar enqueued before the call is written.
+        """
+        if self._closed or not self.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(self._STOP)
+
+    def _write(self, batch: Dict) -> None:
+        if not batch:
+            return
+        experiment = self._get_experiment()
+        for (tag, step), value in batch.items():
+            if isinstance(value, dict):
+                experiment.add_scalars(tag, value, step)
+            else:
+                experiment.add_scalar(tag, value, step)
+        experiment.flush()
+
+    def run(self) -> None:
+        batch = {}
+        deadline = time.monotonic() + self._flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            if item is None or item is self._STOP or isinstance(item, threading.Event) or len(batch) >= self._max_batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    log.error(f"Error writing metrics: {e}")
+                batch = {}
+                deadline = time.monotonic() + self._flush_interval
+                if item is self._STOP:
+                    return
+                if isinstance(item, threading.Event):
+                    item.set()
+                    continue
+
+            if item is not None:
+                tag, value, step = item
+                batch[(tag, step)] = value
+
+
 class FedstellarLogger(Logger):
 
     NAME_HPARAMS_FILE = "hparams.yaml"
@@ -37,6 +135,9 @@ class FedstellarLogger(Logger):
         default_hp_metric: bool = True,
         prefix: str = "",
         sub_dir: Optional[_PATH] = None,
+        async_metrics: bool = True,
+        flush_interval: float = 2.0,
+        max_queue_size: int = 10000,
         **kwargs: Any,
     ):
         super().__init__()
@@ -54,6 +155,11 @@ class FedstellarLogger(Logger):
         self._fs = get_filesystem(save_dir)
 
         self._experiment: Optional["SummaryWriter"] = None
+        self._experiment_lock = threading.Lock()
+        self._writer: Optional[AsyncScalarWriter] = None
+        if async_metrics:
+            self._writer = AsyncScalarWriter(lambda: self.experiment, flush_interval=flush_interval, max_queue_size=max_queue_size)
+            self._writer.start()
         self.hparams: Union[Dict[str, Any], Namespace] = {}
         self._kwargs = kwargs
 
@@ -95,9 +201,12 @@ class FedstellarLogger(Logger):
             return self._experiment
 
         assert rank_zero_only.rank == 0, "tried to init log dirs in non global_rank=0"
-        if self.root_dir:
-            self._fs.makedirs(self.root_dir, exist_ok=True)
-        self._experiment = SummaryWriter(log_dir=self.log_dir, **self._kwargs)
+        # The experiment can be requested at the same time by the training thread and the metrics writer
+        with self._experiment_lock:
+            if self._experiment is None:
+                if self.root_dir:
+                    self._fs.makedirs(self.root_dir, exist_ok=True)
+                self._experiment = SummaryWriter(log_dir=self.log_dir, **self._kwargs)
         return self._experiment
 
     @rank_zero_only
@@ -142,7 +251,11 @@ class FedstellarLogger(Logger):
             if isinstance(v, Tensor):
                 v = v.item()
 
-            if isinstance(v, dict):
+            if self._writer is not None:
+                if not isinstance(v, (dict, Number, np.number)):
+                    raise ValueError(f"\n you tried to log {v} which is currently not supported. Try a dict or a scalar/tensor.")
+                self._writer.put(k, v, __step)
+            elif isinstance(v, dict):
                 self.experiment.add_scalars(k, v, __step)
             else:
                 try:
@@ -190,6 +303,9 @@ class FedstellarLogger(Logger):
 
     @rank_zero_only
     def finalize(self, status: str) -> None:
+        if self._writer is not None:
+            # Pending scalars are written before closing the event file
+            self._writer.flush()
         if self._experiment is not None:
             self.experiment.flush()
             self.experiment.close()
@@ -240,4 +356,10 @@ class FedstellarLogger(Logger):
     def __getstate__(self) -> Dict[str, Any]:
         state = self.__dict__.copy()
         state["_experiment"] = None
+        state["_experiment_lock"] = None
+        state["_writer"] = None
         return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._experiment_lock = threading.Lock()
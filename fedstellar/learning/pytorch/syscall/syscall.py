@@ -2,23 +2,31 @@
 # This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
 # Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
 #
+import json
 import os
 import zipfile
 import ast
 from math import floor
 
+import numpy as np
 import pandas as pd
 # To Avoid Crashes with a lot of nodes
 import torch.multiprocessing
 from lightning import LightningDataModule
 from sklearn.model_selection import train_test_split
-from torch.utils.data import DataLoader, Subset, random_split, Dataset
+from torch.utils.data import Subset, random_split, Dataset
 from torchvision.datasets import utils
 
+from fedstellar.learning.pytorch.tensorcache import TensorCache
+from fedstellar.learning.pytorch.tensorloader import build_dataloader
+
 torch.multiprocessing.set_sharing_strategy("file_system")
 
 
 class SYSCALL(Dataset):
+    # Bump when the preprocessing in process() changes
+    CACHE_FINGERPRINT = "syscall-1gram-v1"
+
     def __init__(self, sub_id, number_sub, root_dir, train=True, transform=None, target_transform=None, download=False):
         self.transform = transform
         self.target_transform = target_transform
@@ -30,33 +38,49 @@ class SYSCALL(Dataset):
         self.root = root_dir
         self.training_file = f'{self.root}/syscall/processed/syscall_train.pt'
         self.test_file = f'{self.root}/syscall/processed/syscall_test.pt'
-
-        if not os.path.exists(f'{self.root}/syscall/processed/syscall_test.pt') or not os.path.exists(f'{self.root}/syscall/processed/syscall_train.pt'):
-            if self.download:
+        self.cache_dir = f'{self.root}/syscall/cache'
+
+        train_cache = TensorCache(f'{self.cache_dir}/train', fingerprint=self.CACHE_FINGERPRINT)
+        test_cache = TensorCache(f'{self.cache_dir}/test', fingerprint=self.CACHE_FINGERPRINT)
+        if not train_cache.is_valid() or not test_cache.is_valid():
+            if os.path.exists(self.training_file) and os.path.exists(self.test_file):
+                # Dataset processed by a previous version, convert it instead of parsing the CSV files again
+                self.convert_legacy(train_cache, test_cache)
+            elif self.download:
                 self.dataset_download()
-                self.process()
+                self.process(train_cache, test_cache)
             else:
                 raise RuntimeError('Dataset not found, set parameter download=True to download')
         else:
             print('SYSCALL dataset already downloaded and processed.')
 
-        if self.train:
-            data_file = self.training_file
-        else:
-            data_file = self.test_file
+        # Whole dataset, memory-mapped from the tensor cache
+        cache = train_cache if self.train else test_cache
+        self.data, self.targets = cache.load("data"), cache.load("targets")
+        self.classes = cache.metadata.get("classes", [])
 
-        # Whole dataset
-        data_and_targets = torch.load(data_file)
-        self.data, self.targets = data_and_targets[0], data_and_targets[1]
+    def __len__(self):
+        return len(self.targets)
 
     def __getitem__(self, index):
-        img, target = self.data[index], int(self.targets[index])
+        img, target = torch.from_numpy(np.array(self.data[index])), int(self.targets[index])
         if self.transform is not None:
             img = img
         if self.target_transform is not None:
             target = target
         return img, target
 
+    def __getitems__(self, indices):
+        # Batched read: a single fancy-indexing on the memory-mapped arrays per batch
+        indices = np.asarray(indices)
+        return list(zip(torch.from_numpy(self.data[indices]), self.targets[indices].tolist()))
+
+    def as_tensors(self, indices=None):
+        if indices is None:
+            return torch.from_numpy(np.array(self.data)), torch.from_numpy(np.array(self.targets))
+        indices = np.asarray(indices)
+        return torch.from_numpy(self.data[indices]), torch.from_numpy(self.targets[indices])
+
     def dataset_download(self):
         paths = [f'{self.root}/syscall/raw/', f'{self.root}/syscall/processed/']
         for path in paths:
@@ -71,45 +95,58 @@ class SYSCALL(Dataset):
         with zipfile.ZipFile(f'{self.root}/syscall/raw/{filename}', 'r') as zip_ref:
             zip_ref.extractall(f'{self.root}/syscall/raw/')
 
-    def process(self):
+    def process(self, train_cache, test_cache):
         print('Processing SYSCALL dataset...')
-        df = pd.DataFrame()
-        files = os.listdir(f'{self.root}/syscall/raw/')
+        files = sorted(f for f in os.listdir(f'{self.root}/syscall/raw/') if '.csv' in f)
         feature_name = 'system calls frequency_1gram-scaled'
+        features, labels = [], []
         for f in files:
-            if '.csv' in f:
-                fi_path = f'{self.root}/syscall/raw/{f}'
-                csv_df = pd.read_csv(fi_path, sep='\t')
-                feature = [ast.literal_eval(i) for i in csv_df[feature_name]]
-                csv_df[feature_name] = feature
-                df = pd.concat([df, csv_df])
-        df['maltype'] = df['maltype'].replace(to_replace='normalv2', value='normal')
-        classes_to_targets = {}
-        t = 0
-        for i in set(df['maltype']):
-            classes_to_targets[i] = t
-            t += 1
-        classes = list(classes_to_targets.keys())
-
-        for c in classes_to_targets:
-            df['maltype'] = df['maltype'].replace(to_replace=c, value=classes_to_targets[c])
-
-        all_targes = torch.tensor(df['maltype'].tolist())
-        all_data = torch.tensor(df[feature_name].tolist())
-
-        x_train, x_test, y_train, y_test = train_test_split(all_data, all_targes, test_size=0.15, random_state=42)
-        train = [x_train, y_train, classes_to_targets, classes]
-        test = [x_test, y_test, classes_to_targets, classes]
-
-        # save to files
-        train_file = f'{self.root}/syscall/processed/syscall_train.pt'
-        test_file = f'{self.root}/syscall/processed/syscall_test.pt'
-
-        # save to processed dir
-        if not os.path.exists(train_file):
-            torch.save(train, train_file)
-        if not os.path.exists(test_file):
-            torch.save(test, test_file)
+            fi_path = f'{self.root}/syscall/raw/{f}'
+            csv_df = pd.read_csv(fi_path, sep='\t', usecols=[feature_name, 'maltype'])
+            features.append(parse_feature_column(csv_df[feature_name]))
+            labels.append(csv_df['maltype'].to_numpy(dtype=str))
+
+        all_data = np.concatenate(features)
+        labels = np.concatenate(labels)
+        labels[labels == 'normalv2'] = 'normal'
+        classes, all_targets = np.unique(labels, return_inverse=True)
+        classes_to_targets = {c: t for t, c in enumerate(classes.tolist())}
+
+        x_train, x_test, y_train, y_test = train_test_split(all_data, all_targets, test_size=0.15, random_state=42)
+        self.save_cache(train_cache, x_train, y_train, classes_to_targets)
+        self.save_cache(test_cache, x_test, y_test, classes_to_targets)
+
+    def convert_legacy(self, train_cache, test_cache):
+        print('Converting processed SYSCALL dataset to the tensor cache...')
+        for cache, file in ((train_cache, self.training_file), (test_cache, self.test_file)):
+            data, targets, classes_to_targets, _ = torch.load(file)
+            self.save_cache(cache, np.asarray(data), np.asarray(targets), classes_to_targets)
+
+    @staticmethod
+    def save_cache(cache, data, targets, classes_to_targets):
+        cache.save(
+            {"data": np.asarray(data, dtype=np.float32), "targets": np.asarray(targets, dtype=np.int64)},
+            metadata={"classes_to_targets": classes_to_targets, "classes": list(classes_to_targets.keys())}
+        )
+
+
+def parse_feature_column(column):
+    """
+    Parses a column of serialized feature vectors ("[0.1, 0.2, ...]") into a 2D float32 array.
+
+    The whole column is decoded with a single json.loads call instead of one ast.literal_eval per row.
+
+    Args:
+        column: pandas Series of strings.
+
+    Returns:
+        np.ndarray: Array of shape (rows, features).
+    """
+    try:
+        return np.array(json.loads("[" + ",".join(column) + "]"), dtype=np.float32)
+    except ValueError:
+        # Values that are not valid JSON (e.g. nan), fall back to the slow path
+        return np.array([ast.literal_eval(i) for i in column], dtype=np.float32)
 
 
 #######################################
@@ -118,7 +155,7 @@ class SYSCALL(Dataset):
 
 
 def sort_dataset(dataset):
-    sorted_indexes = dataset.targets.sort()[1]
+    sorted_indexes = np.argsort(dataset.targets, kind='stable')
     dataset.targets = (dataset.targets[sorted_indexes])
     dataset.data = dataset.data[sorted_indexes]
     return dataset
@@ -129,7 +166,13 @@ class SYSCALLDataModule(LightningDataModule):
     LightningDataModule of partitioned SYSCALL.
 
     Args:
-
+        sub_id: Subset id of partition. (0 <= sub_id < number_sub)
+        number_sub: Number of subsets.
+        batch_size: The batch size of the data.
+        num_workers: The number of workers of the data.
+        val_percent: The percentage of the validation set.
+        root_dir: Directory of the datasets.
+        partition: Tuple (train indices, test indices) of this subset, overrides the contiguous ranges.
     """
 
     # Singleton
@@ -144,6 +187,7 @@ class SYSCALLDataModule(LightningDataModule):
             num_workers=4,
             val_percent=0.01,
             root_dir=None,
+            partition=None,
     ):
         super().__init__()
         self.sub_id = sub_id
@@ -153,18 +197,27 @@ class SYSCALLDataModule(LightningDataModule):
         self.val_percent = val_percent
         self.root_dir = root_dir
 
-        self.train = SYSCALL(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=True, download=True)
-        self.test = SYSCALL(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=False, download=True)
+        # Singletons of SYSCALL train and test datasets (shared by the nodes of the same process)
+        if SYSCALLDataModule.syscall_train is None or SYSCALLDataModule.syscall_train.root != root_dir:
+            SYSCALLDataModule.syscall_train = SYSCALL(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=True, download=True)
+        if SYSCALLDataModule.syscall_val is None or SYSCALLDataModule.syscall_val.root != root_dir:
+            SYSCALLDataModule.syscall_val = SYSCALL(sub_id=self.sub_id, number_sub=self.number_sub, root_dir=root_dir, train=False, download=True)
+        self.train = SYSCALLDataModule.syscall_train
+        self.test = SYSCALLDataModule.syscall_val
 
         if len(self.test.data) < self.number_sub:
             raise ValueError("Too many partitions")
 
         # Training / validation set
         trainset = self.train
-        rows_by_sub = floor(len(trainset.data) / self.number_sub)
-        tr_subset = Subset(
-            trainset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
-        )
+        if partition is not None:
+            # Indices precomputed once per scenario (see fedstellar.learning.partitioning)
+            tr_subset = Subset(trainset, partition[0])
+        else:
+            rows_by_sub = floor(len(trainset.data) / self.number_sub)
+            tr_subset = Subset(
+                trainset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
+            )
         syscall_train, syscall_val = random_split(
             tr_subset,
             [
@@ -175,25 +228,30 @@ class SYSCALLDataModule(LightningDataModule):
 
         # Test set
         testset = self.test
-        rows_by_sub = floor(len(testset.data) / self.number_sub)
-        te_subset = Subset(
-            testset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
-        )
+        if partition is not None:
+            te_subset = Subset(testset, partition[1])
+        else:
+            rows_by_sub = floor(len(testset.data) / self.number_sub)
+            te_subset = Subset(
+                testset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
+            )
+
+        self.num_samples = (len(syscall_train), len(te_subset))
 
         # DataLoaders
-        self.train_loader = DataLoader(
+        self.train_loader = build_dataloader(
             syscall_train,
             batch_size=self.batch_size,
             shuffle=True,
             num_workers=self.num_workers,
         )
-        self.val_loader = DataLoader(
+        self.val_loader = build_dataloader(
             syscall_val,
             batch_size=self.batch_size,
             shuffle=False,
             num_workers=self.num_workers,
         )
-        self.test_loader = DataLoader(
+        self.test_loader = build_dataloader(
             te_subset,
             batch_size=self.batch_size,
             shuffle=False,
@@ -205,6 +263,14 @@ class SYSCALLDataModule(LightningDataModule):
             )
         )
 
+    @staticmethod
+    def get_targets(root_dir, train=True):
+        """
+        Returns:
+            Targets of the whole dataset, used to compute the partitions of a scenario.
+        """
+        return np.asarray(SYSCALL(sub_id=0, number_sub=1, root_dir=root_dir, train=train, download=True).targets)
+
     def train_dataloader(self):
         """ """
         return self.train_loader
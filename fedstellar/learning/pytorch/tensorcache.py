@@ -0,0 +1,109 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+import json
+import os
+
+import numpy as np
+
+
+class TensorCache:
+    """
+    On-disk cache of preprocessed datasets stored as ``.npy`` arrays plus a JSON manifest.
+
+    The arrays are written once (the expensive decoding/preprocessing is paid a single time per machine)
+    and then opened with ``np.load(mmap_mode='r')``, so every participant running on the same host shares
+    the same page cache instead of holding its own decoded copy of the dataset.
+
+    The manifest is written last and acts as the commit marker: a cache without a manifest, or whose
+    fingerprint does not match, is considered missing and is rebuilt.
+
+    Args:
+        cache_dir: Directory where the arrays and the manifest are stored.
+        fingerprint: Description of the source data and preprocessing. Changing it invalidates the cache.
+    """
+
+    MANIFEST = "manifest.json"
+    VERSION = 1
+
+    def __init__(self, cache_dir, fingerprint):
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        self.__manifest = None
+
+    @staticmethod
+    def file_fingerprint(path):
+        """
+        Returns:
+            str: Fingerprint of a source file (name, size and modification time).
+        """
+        stat = os.stat(path)
+        return "{}:{}:{}".format(os.path.basename(path), stat.st_size, int(stat.st_mtime))
+
+    def __read_manifest(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_valid(self):
+        """
+        Returns:
+            bool: True if the cache exists and was built from the same source and preprocessing.
+        """
+        manifest = self.__read_manifest()
+        if manifest is None or manifest.get("version") != self.VERSION or manifest.get("fingerprint") != self.fingerprint:
+            return False
+        for name in manifest["arrays"]:
+            if not os.path.exists(os.path.join(self.cache_dir, name + ".npy")):
+                return False
+        self.__manifest = manifest
+        return True
+
+    def save(self, arrays, metadata=None):
+        """
+        Writes the arrays atomically (temporary file + rename) and commits the manifest.
+
+        Several participants may build the same cache concurrently, the last rename wins and readers
+        never observe a partially written file.
+
+        Args:
+            arrays: Dict name -> np.ndarray.
+            metadata: JSON-serializable dict stored in the manifest (e.g. class names).
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        suffix = ".tmp-{}".format(os.getpid())
+        description = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            path = os.path.join(self.cache_dir, name + ".npy")
+            with open(path + suffix, "wb") as f:
+                np.save(f, array)
+            os.replace(path + suffix, path)
+            description[name] = {"shape": list(array.shape), "dtype": str(array.dtype)}
+
+        manifest = {"version": self.VERSION, "fingerprint": self.fingerprint, "arrays": description, "metadata": metadata or {}}
+        path = os.path.join(self.cache_dir, self.MANIFEST)
+        with open(path + suffix, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + suffix, path)
+        self.__manifest = manifest
+
+    def load(self, name, mmap=True):
+        """
+        Args:
+            name: Name of the array.
+            mmap: Memory-map the array (read-only) instead of reading it into memory.
+
+        Returns:
+            np.ndarray: The cached array.
+        """
+        return np.load(os.path.join(self.cache_dir, name + ".npy"), mmap_mode="r" if mmap else None)
+
+    @property
+    def metadata(self):
+        if self.__manifest is None:
+            self.__manifest = self.__read_manifest() or {}
+        return self.__manifest.get("metadata", {})
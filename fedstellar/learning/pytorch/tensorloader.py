@@ -0,0 +1,158 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+import logging
+import os
+
+import torch
+from torch.utils.data import DataLoader, Subset, TensorDataset
+
+# Datasets materialized above this size keep using the DataLoader path
+MAX_RESIDENT_BYTES = 512 * 1024 * 1024
+
+
+class TensorBatchLoader:
+    """
+    Iterates over in-memory tensors yielding ready-made batches.
+
+    Batches are produced by slicing the tensors with a shuffled index block, in the main process, without
+    worker processes, file_system tensor sharing or per-sample collation. It is a drop-in replacement for
+    the DataLoaders of the data modules (Lightning accepts any iterable with a length).
+
+    Args:
+        dataset: Original dataset (kept so ``loader.dataset`` keeps working).
+        data: Tensor with the samples (already transformed).
+        targets: Tensor with the targets.
+        batch_size: Number of samples per batch.
+        shuffle: Reshuffle the samples at every epoch.
+        drop_last: Drop the last incomplete batch.
+    """
+
+    def __init__(self, dataset, data, targets, batch_size=1, shuffle=False, drop_last=False):
+        self.dataset = dataset
+        self.data = data
+        self.targets = targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __len__(self):
+        n = len(self.targets)
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = len(self.targets)
+        order = torch.randperm(n) if self.shuffle else None
+        for batch in range(len(self)):
+            start = batch * self.batch_size
+            if order is None:
+                yield self.data[start:start + self.batch_size], self.targets[start:start + self.batch_size]
+            else:
+                idx = order[start:start + self.batch_size]
+                yield self.data[idx], self.targets[idx]
+
+
+def resident_tensors(dataset):
+    """
+    Materializes a dataset as (data, targets) tensors if it supports it.
+
+    Subset chains (Subset, random_split) are resolved into a single index tensor. The base dataset must be
+    a TensorDataset or implement ``as_tensors(indices)``, returning the transformed samples or None when
+    it cannot be materialized (e.g. it applies random augmentation).
+
+    Args:
+        dataset: Dataset to materialize.
+
+    Returns:
+        tuple: (data, targets) tensors or None.
+    """
+    indices = None
+    while isinstance(dataset, Subset):
+        subset_indices = torch.as_tensor(dataset.indices, dtype=torch.long)
+        indices = subset_indices if indices is None else subset_indices[indices]
+        dataset = dataset.dataset
+
+    if isinstance(dataset, TensorDataset) and len(dataset.tensors) == 2:
+        data, targets = dataset.tensors
+        if indices is not None:
+            data, targets = data[indices], targets[indices]
+        return data, targets
+    if hasattr(dataset, "as_tensors"):
+        return dataset.as_tensors(indices)
+    return None
+
+
+def resident_size(dataset):
+    """
+    Estimates the size of the tensors of a dataset from its length and its first sample, without materializing it.
+
+    Args:
+        dataset: Dataset to estimate.
+
+    Returns:
+        int: Estimated bytes of the (data, targets) tensors or None if the samples are not tensors.
+    """
+    n = len(dataset)
+    if n == 0:
+        return 0
+    try:
+        data, target = (torch.as_tensor(value) for value in dataset[0][:2])
+    except (TypeError, ValueError, RuntimeError):
+        return None
+    return n * (data.element_size() * data.nelement() + target.element_size() * target.nelement())
+
+
+def cap_num_workers(num_workers, colocated_nodes=1):
+    """
+    Caps the DataLoader workers of a participant so that all the participants sharing the host do not
+    spawn more processes than cores.
+
+    Args:
+        num_workers: Requested workers per DataLoader.
+        colocated_nodes: Number of participants running on the same host.
+
+    Returns:
+        int: Number of workers to use (0 means loading in the main process).
+    """
+    cores = os.cpu_count() or 1
+    # One core per participant is kept for its main (training) process
+    budget = max(cores // max(colocated_nodes, 1) - 1, 0)
+    return min(num_workers, budget)
+
+
+def build_dataloader(dataset, batch_size=1, shuffle=False, num_workers=0, drop_last=False, max_resident_bytes=MAX_RESIDENT_BYTES):
+    """
+    Returns a TensorBatchLoader when the dataset can be kept resident in memory, a DataLoader otherwise.
+
+    Args:
+        dataset: Dataset to load.
+        batch_size: Number of samples per batch.
+        shuffle: Reshuffle the samples at every epoch.
+        num_workers: Workers of the DataLoader (only used in the fallback path).
+        drop_last: Drop the last incomplete batch.
+        max_resident_bytes: Maximum size of the materialized tensors.
+
+    Returns:
+        Iterable of batches.
+    """
+    # Datasets estimated too large are not materialized (the size is checked again once materialized)
+    size = resident_size(dataset)
+    tensors = resident_tensors(dataset) if size is None or size <= max_resident_bytes else None
+    if tensors is not None:
+        data, targets = tensors
+        size = data.element_size() * data.nelement() + targets.element_size() * targets.nelement()
+        if size <= max_resident_bytes:
+            return TensorBatchLoader(dataset, data, targets, batch_size=batch_size, shuffle=shuffle, drop_last=drop_last)
+    if size is not None and size > max_resident_bytes:
+        logging.info("[TensorBatchLoader] Dataset too large to be kept resident ({} bytes), using DataLoader".format(size))
+
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        drop_last=drop_last,
+    )
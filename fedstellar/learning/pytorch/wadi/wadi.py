@@ -9,11 +9,14 @@ from math import floor
 # To Avoid Crashes with a lot of nodes
 import torch.multiprocessing
 from lightning import LightningDataModule
-from torch.utils.data import DataLoader, Subset, random_split
+from torch.utils.data import Subset, random_split
 from torchvision import transforms
 from torchvision.datasets import MNIST, utils
 import urllib.request
 import numpy as np
+
+from fedstellar.learning.pytorch.tensorloader import build_dataloader
+
 torch.multiprocessing.set_sharing_strategy("file_system")
 
 
@@ -45,6 +48,12 @@ class WADI(MNIST):
         img, target = self.data[index], int(self.targets[index])
         return img, target
 
+    def as_tensors(self, indices=None):
+        data, targets = self.data, self.targets.long()
+        if indices is not None:
+            data, targets = data[indices], targets[indices]
+        return data, targets
+
     def dataset_download(self):
         paths = [f'{self.root}/WADI/']
         for path in paths:
@@ -125,20 +134,22 @@ class WADIDataModule(LightningDataModule):
             testset, range(self.sub_id * rows_by_sub, (self.sub_id + 1) * rows_by_sub)
         )
 
+        self.num_samples = (len(wadi_train), len(te_subset))
+
         # DataLoaders
-        self.train_loader = DataLoader(
+        self.train_loader = build_dataloader(
             wadi_train,
             batch_size=self.batch_size,
             shuffle=True,
             num_workers=self.num_workers,
         )
-        self.val_loader = DataLoader(
+        self.val_loader = build_dataloader(
             wadi_val,
             batch_size=self.batch_size,
             shuffle=False,
             num_workers=self.num_workers,
         )
-        self.test_loader = DataLoader(
+        self.test_loader = build_dataloader(
             te_subset,
             batch_size=self.batch_size,
             shuffle=False,
@@ -0,0 +1,183 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Estimation of the cost of the links with the neighbors, used to select the targets of the model gossip.
+
+Every link keeps an EWMA of its round-trip time (the smoothed RTT of the kernel, sampled when the neighbor's beats
+arrive, so it includes the delay shaped with ``tcset``) and of its throughput (measured on the model transfers, from
+the first byte sent to the acknowledgement of the receiver minus a round trip).
+The expected transfer time of a model is ``rtt + size / throughput``; links never measured take the median of the
+others, so they are tried too.
+"""
+import math
+import random
+import socket
+import struct
+import sys
+import threading
+
+# Offset of tcpi_rtt (microseconds) in struct tcp_info (Linux): 8 bytes of u8 fields, then rto, ato, snd_mss,
+# rcv_mss, unacked, sacked, lost, retrans, fackets, last_data_sent, last_ack_sent, last_data_recv, last_ack_recv,
+# pmtu and rcv_ssthresh (u32)
+_TCP_INFO_RTT = struct.Struct("=I")
+_TCP_INFO_RTT_OFFSET = 68
+
+# Neighbor selection (``GOSSIP_NEIGHBOR_SELECTION``)
+RANDOM = "random"
+LINK = "link"
+
+
+def tcp_rtt(sock):
+    """
+    Returns:
+        float: Smoothed round-trip time of a TCP connection in seconds (None if it is not available, e.g. connections
+        in memory have no socket).
+    """
+    if not sys.platform.startswith("linux") or not hasattr(socket, "TCP_INFO") or not hasattr(sock, "getsockopt"):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except (OSError, ValueError):
+        return None
+    if len(info) < _TCP_INFO_RTT_OFFSET + _TCP_INFO_RTT.size:
+        return None
+    rtt = _TCP_INFO_RTT.unpack_from(info, _TCP_INFO_RTT_OFFSET)[0]
+    return rtt / 1e6 if rtt else None
+
+
+class LinkEstimator:
+    """
+    Args:
+        alpha: Weight of the last observation in the EWMAs.
+        min_transfer_size: Transfers of fewer bytes are not used to estimate the throughput (their time is mostly the
+            round trip).
+    """
+
+    def __init__(self, alpha=0.3, min_transfer_size=64 * 1024):
+        self.alpha = alpha
+        self.min_transfer_size = min_transfer_size
+        self.__rtt = {}
+        self.__throughput = {}
+        self.__lock = threading.Lock()
+
+    def __update(self, table, neighbor, value):
+        last = table.get(neighbor)
+        table[neighbor] = value if last is None else self.alpha * value + (1 - self.alpha) * last
+
+    def observe_rtt(self, neighbor, rtt):
+        if rtt is None or rtt <= 0:
+            return
+        with self.__lock:
+            self.__update(self.__rtt, neighbor, rtt)
+
+    def observe_transfer(self, neighbor, size, seconds):
+        """
+        Args:
+            neighbor: Name of the neighbor.
+            size: Bytes sent.
+            seconds: Time taken to send them.
+        """
+        if size < self.min_transfer_size:
+            return
+        with self.__lock:
+            self.__update(self.__throughput, neighbor, size / max(seconds, 1e-6))
+
+    def forget(self, neighbor):
+        with self.__lock:
+            self.__rtt.pop(neighbor, None)
+            self.__throughput.pop(neighbor, None)
+
+    def get(self, neighbor):
+        """
+        Returns:
+            tuple: (rtt, throughput) estimates of the link (None if not measured).
+        """
+        with self.__lock:
+            return self.__rtt.get(neighbor), self.__throughput.get(neighbor)
+
+    def expected_times(self, neighbors, size):
+        """
+        Args:
+            neighbors: Names of the neighbors.
+            size: Bytes to send.
+
+        Returns:
+            list: Expected time (seconds) to send ``size`` bytes to every neighbor.
+        """
+        with self.__lock:
+            rtts = [self.__rtt.get(n) for n in neighbors]
+            throughputs = [self.__throughput.get(n) for n in neighbors]
+            default_rtt = _median(self.__rtt.values(), 1e-3)
+            default_throughput = _median(self.__throughput.values(), None)
+        times = []
+        for rtt, throughput in zip(rtts, throughputs):
+            throughput = throughput or default_throughput
+            times.append((rtt or default_rtt) + (size / throughput if throughput else 0))
+        return times
+
+    def select(self, neighbors, k, size=0, needs=None, budget=None, rng=random):
+        """
+        Weighted random selection of the gossip targets: the probability of a neighbor grows with what it needs
+        and decreases with its expected transfer time (sampling without replacement, Efraimidis-Spirakis).
+
+        Args:
+            neighbors: Names of the candidate neighbors.
+            k: Number of targets.
+            size: Bytes that will be sent to every target.
+            needs: What every neighbor needs (e.g. models it is missing), 1 for all by default.
+            budget: If given, more than ``k`` targets are selected while their expected transfer times fit in it.
+
+        Returns:
+            list: Names of the selected neighbors.
+        """
+        if not neighbors:
+            return []
+        needs = needs or [1] * len(neighbors)
+        times = self.expected_times(neighbors, size)
+        keys = []
+        for name, need, t in zip(neighbors, needs, times):
+            weight = max(need, 1e-9) / max(t, 1e-9)
+            keys.append((math.log(1 - rng.random()) / weight, name, t))  # log(u) / w, same order as u ** (1 / w)
+        keys.sort(reverse=True)
+        selected = keys[:k]
+        if budget is not None:
+            elapsed = sum(t for _, _, t in selected)
+            for key in keys[k:]:
+                if elapsed + key[2] > budget:
+                    break
+                elapsed += key[2]
+                selected.append(key)
+        return [name for _, name, _ in selected]
+
+
+def _median(values, default):
+    values = sorted(values)
+    if not values:
+        return default
+    return values[len(values) // 2]
+
+
+_estimators = {}
+
+
+def register_link_estimator(node_name, estimator):
+    """
+    Makes the link estimator of a node available to its connections.
+    """
+    _estimators[node_name] = estimator
+
+
+def unregister_link_estimator(node_name):
+    _estimators.pop(node_name, None)
+
+
+def get_link_estimator(node_name):
+    """
+    Returns:
+        LinkEstimator: Link estimator of the node (None if it has none).
+    """
+    return _estimators.get(node_name)
@@ -0,0 +1,269 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Lossless compression of the encoded parameters sent through the network.
+
+The payload is split in chunks, each chunk is byte-shuffled (the i-th byte of every value goes to the i-th plane, so
+the sign/exponent bytes of the floats end up together) and compressed with zstd, lz4 or zlib. Chunks are compressed
+in parallel on a thread pool (the compressors release the GIL).
+
+Frame: header (magic, codec, shuffle type size, chunk size, raw size, chunks) | compressed size and flags of every
+chunk | chunks. Chunks that do not compress are stored raw. Payloads that do not compress (probed on the first chunk)
+are sent without a frame, so receivers always accept both.
+"""
+import logging
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+MAGIC = b"FSLZ"
+HEADER = struct.Struct("<4sBBxxIQI")  # magic, codec, type size, chunk size, raw size, chunks
+CHUNK = struct.Struct("<IB")  # compressed size, stored raw
+
+# Codecs (``compression_args.lossless``)
+NONE = "none"
+AUTO = "auto"
+ZLIB = "zlib"
+ZSTD = "zstd"
+LZ4 = "lz4"
+CODEC_IDS = {ZLIB: 1, ZSTD: 2, LZ4: 3}
+CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+
+# Compression level of each codec by speed/ratio tradeoff (``compression_args.lossless_level``)
+LEVELS = {
+    "fast": {ZLIB: 1, ZSTD: 1, LZ4: 0},
+    "balanced": {ZLIB: 6, ZSTD: 3, LZ4: 4},
+    "ratio": {ZLIB: 9, ZSTD: 12, LZ4: 9},
+}
+
+CHUNK_SIZE = 1 << 20
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def available_codecs():
+    """
+    Returns:
+        list: Codecs whose library is installed (zlib always is).
+    """
+    return [c for c, lib in ((ZSTD, zstandard), (LZ4, lz4)) if lib is not None] + [ZLIB]
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="lossless")
+        return _executor
+
+
+def shuffle(chunk, typesize):
+    """
+    Groups the i-th byte of every value (the trailing bytes that do not fill a value are kept at the end).
+    """
+    if typesize <= 1:
+        return chunk
+    n = len(chunk) - len(chunk) % typesize
+    planes = np.frombuffer(chunk, dtype=np.uint8, count=n).reshape(-1, typesize).T.tobytes()
+    return planes + bytes(chunk[n:])
+
+
+def unshuffle(chunk, typesize):
+    if typesize <= 1:
+        return chunk
+    n = len(chunk) - len(chunk) % typesize
+    values = np.frombuffer(chunk, dtype=np.uint8, count=n).reshape(typesize, -1).T.tobytes()
+    return values + bytes(chunk[n:])
+
+
+def _compress_chunk(codec, level, chunk):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(chunk)
+    if codec == LZ4:
+        return lz4.compress(chunk, compression_level=level)
+    return zlib.compress(chunk, level)
+
+
+def _decompress_chunk(codec, chunk):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd payload received but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(chunk)
+    if codec == LZ4:
+        if lz4 is None:
+            raise ValueError("lz4 payload received but lz4 is not installed")
+        return lz4.decompress(chunk)
+    return zlib.decompress(chunk)
+
+
+#########################
+#    LosslessCodec      #
+#########################
+
+
+class LosslessCodec:
+    """
+    Compresses the encoded parameters before they are fragmented.
+
+    Args:
+        codec: Codec (zstd, lz4, zlib or auto, the first installed of them).
+        level: Speed/ratio tradeoff (fast, balanced or ratio).
+        typesize: Size of the values of the payload for the byte shuffle (1 disables it).
+        min_ratio: Payloads (and chunks) with a lower compression ratio are sent raw.
+        chunk_size: Size of the chunks compressed in parallel.
+    """
+
+    def __init__(self, codec=AUTO, level="fast", typesize=4, min_ratio=1.1, chunk_size=CHUNK_SIZE):
+        if codec == AUTO:
+            codec = available_codecs()[0]
+        if codec not in CODEC_IDS:
+            raise ValueError("Lossless codec {} not supported".format(codec))
+        if codec not in available_codecs():
+            logging.warning("[LosslessCodec] Codec {} not installed, using zlib".format(codec))
+            codec = ZLIB
+        if level not in LEVELS:
+            raise ValueError("Lossless level {} not supported".format(level))
+        self.codec = codec
+        self.level = LEVELS[level][codec]
+        self.typesize = typesize
+        self.min_ratio = min_ratio
+        # Chunks hold whole values, so they can be unshuffled independently
+        self.chunk_size = max(typesize, chunk_size - chunk_size % max(typesize, 1))
+        self.__last = (None, None)
+        self.__lock = threading.Lock()
+
+    def __compress(self, chunk):
+        return _compress_chunk(self.codec, self.level, shuffle(chunk, self.typesize))
+
+    def compress(self, data):
+        """
+        Args:
+            data: Encoded parameters.
+
+        Returns:
+            bytes: The frame, or the same data if it does not compress.
+        """
+        # The same encoded parameters are usually sent to several neighbors in a row
+        with self.__lock:
+            last_data, last_frame = self.__last
+            if last_data is data:
+                return last_frame
+
+        view = memoryview(data)
+        chunks = [view[i:i + self.chunk_size] for i in range(0, len(view), self.chunk_size)]
+        if not chunks:
+            return data
+
+        # Probe the first chunk, incompressible payloads (e.g. already quantized and sparsified) are not framed
+        first = self.__compress(chunks[0])
+        if len(chunks[0]) < self.min_ratio * len(first):
+            frame = data
+        else:
+            compressed = [first] + list(_pool().map(self.__compress, chunks[1:])) if len(chunks) > 1 else [first]
+            table = []
+            body = []
+            for chunk, c in zip(chunks, compressed):
+                stored = len(chunk) < self.min_ratio * len(c)
+                body.append(chunk if stored else c)
+                table.append(CHUNK.pack(len(body[-1]), stored))
+            frame = b"".join([HEADER.pack(MAGIC, CODEC_IDS[self.codec], self.typesize, self.chunk_size, len(data), len(chunks))] + table + body)
+            if len(data) < self.min_ratio * len(frame):
+                frame = data
+
+        with self.__lock:
+            self.__last = (data, frame)
+        return frame
+
+
+def is_frame(data):
+    return len(data) >= HEADER.size and bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decompress(data):
+    """
+    Args:
+        data: Frame (or raw encoded parameters).
+
+    Returns:
+        bytes: Encoded parameters.
+
+    Raises:
+        ValueError: If the frame is corrupted or its codec is not installed.
+    """
+    if not is_frame(data):
+        return data
+    view = memoryview(data)
+    _, codec_id, typesize, chunk_size, raw_size, n_chunks = HEADER.unpack_from(view, 0)
+    if codec_id not in CODEC_NAMES:
+        raise ValueError("Unknown lossless codec {}".format(codec_id))
+    codec = CODEC_NAMES[codec_id]
+
+    offset = HEADER.size + n_chunks * CHUNK.size
+    chunks = []
+    for i in range(n_chunks):
+        size, stored = CHUNK.unpack_from(view, HEADER.size + i * CHUNK.size)
+        chunks.append((view[offset:offset + size], stored))
+        offset += size
+    if offset != len(view):
+        raise ValueError("Corrupted lossless frame ({} bytes, {} expected)".format(len(view), offset))
+
+    def decode(item):
+        chunk, stored = item
+        if stored:
+            return bytes(chunk)
+        try:
+            return unshuffle(_decompress_chunk(codec, chunk), typesize)
+        except ValueError:
+            raise
+        except Exception as e:  # zlib.error, ZstdError and lz4 RuntimeError
+            raise ValueError("Corrupted lossless chunk: {}".format(e))
+
+    parts = list(_pool().map(decode, chunks)) if n_chunks > 1 else [decode(c) for c in chunks]
+    data = b"".join(parts)
+    if len(data) != raw_size:
+        raise ValueError("Corrupted lossless frame ({} bytes decoded, {} expected)".format(len(data), raw_size))
+    return data
+
+
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def get_codec(config):
+    """
+    Returns the lossless codec configured in ``compression_args`` of the participant configuration (shared by the
+    connections with the same settings, so parameters sent to several neighbors are compressed once).
+
+    Returns:
+        LosslessCodec: The codec, or None if lossless compression is disabled.
+    """
+    args = config.participant.get("compression_args", {})
+    codec = args.get("lossless", NONE)
+    if codec == NONE:
+        return None
+    # Shuffle by the size of the values sent (float32, or the quantized type)
+    typesize = {"fp16": 2, "bf16": 2, "int8": 1}.get(args.get("quantization"), 4)
+    key = (codec, args.get("lossless_level", "fast"), typesize, args.get("lossless_min_ratio", 1.1))
+    with _codecs_lock:
+        if key not in _codecs:
+            _codecs[key] = LosslessCodec(codec, level=key[1], typesize=typesize, min_ratio=key[3])
+        return _codecs[key]
@@ -14,20 +14,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
-import json
 import logging
 import math
 import os
 from datetime import datetime, timedelta
 
-from fedstellar.learning.pytorch.remotelogger import FedstellarWBLogger
-from fedstellar.learning.pytorch.statisticslogger import FedstellarLogger
-
 os.environ['WANDB_SILENT'] = 'true'
 
-# Import the requests module
-import requests
-
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("fsspec").setLevel(logging.WARNING)
@@ -36,15 +29,17 @@ import random
 import threading
 import time
 
-from lightning.pytorch.loggers import WandbLogger, CSVLogger
-
 from fedstellar.base_node import BaseNode
 from fedstellar.communication_protocol import CommunicationProtocol
 from fedstellar.config.config import Config
-from fedstellar.learning.aggregators.fedavg import FedAvg
-from fedstellar.learning.exceptions import DecodingParamsError, ModelNotMatchingError
+from fedstellar.learning.exceptions import DecodingParamsError, ModelNotMatchingError, ReferenceMismatchError
 from fedstellar.learning.pytorch.lightninglearner import LightningLearner
+from fedstellar.link_estimator import LINK, RANDOM, LinkEstimator, register_link_estimator, unregister_link_estimator
+from fedstellar.registry import AGGREGATORS, LOGGERS
+from fedstellar.reporter import Reporter
 from fedstellar.role import Role
+from fedstellar.telemetry import TelemetrySampler
+from fedstellar.utils.instrumentation import Instrumentation, NULL_INSTRUMENTATION, register_instrumentation, unregister_instrumentation
 from fedstellar.utils.observer import Events, Observer
 
 
@@ -62,6 +57,7 @@ class Node(BaseNode):
         learner (NodeLearner): Learner to be used in the learning process. Default: LightningLearner.
         simulation (bool): If True, the node will be simulated. Default: True.
         encrypt (bool): If True, node will encrypt the communications. Default: False.
+        transport: In-memory transport shared with the nodes of the same process. Default: None (TCP).
 
     Attributes:
         round (int): Round of the learning process.
@@ -86,9 +82,10 @@ class Node(BaseNode):
             config=Config,
             learner=LightningLearner,
             encrypt=False,
+            transport=None,
     ):
         # Super init
-        BaseNode.__init__(self, experiment_name, hostdemo, host, port, encrypt, config)
+        BaseNode.__init__(self, experiment_name, hostdemo, host, port, encrypt, config, transport)
         Observer.__init__(self)
 
         self.idx = idx
@@ -97,6 +94,8 @@ class Node(BaseNode):
         # Import configuration file
         self.config = config
         # Report the configuration to the controller (first instance)
+        self.reporter = Reporter(self.get_name(), self.config)
+        self.reporter.start()
         self.__report_status_to_controller()
 
         # Learning
@@ -112,27 +111,45 @@ class Node(BaseNode):
         if self.config.participant['tracking_args']['enable_remote_tracking']:
             logging.info("[NODE] Tracking W&B enabled")
             logging.getLogger("wandb").setLevel(logging.ERROR)
+            # Loggers (and wandb) are imported when selected
             if self.hostdemo:
-                wandblogger = FedstellarWBLogger(project="framework-enrique", group=self.experiment_name, name=f"participant_{self.idx}")
+                wandblogger = LOGGERS.create("wandb", project="framework-enrique", group=self.experiment_name, name=f"participant_{self.idx}")
             else:
-                wandblogger = FedstellarWBLogger(project="framework-enrique", group=self.experiment_name, name=f"participant_{self.idx}")
+                wandblogger = LOGGERS.create("wandb", project="framework-enrique", group=self.experiment_name, name=f"participant_{self.idx}")
             wandblogger.watch(model, log="all")
             self.learner = learner(model, data, config=self.config, logger=wandblogger)
         else:
             if self.config.participant['tracking_args']['local_tracking'] == 'csv':
                 logging.info("[NODE] Tracking CSV enabled")
-                csvlogger = CSVLogger(f"{self.log_dir}", name="metrics", version=f"participant_{self.idx}")
+                csvlogger = LOGGERS.create("csv", f"{self.log_dir}", name="metrics", version=f"participant_{self.idx}")
                 self.learner = learner(model, data, config=self.config, logger=csvlogger)
             elif self.config.participant['tracking_args']['local_tracking'] == 'web':
                 logging.info("[NODE] Tracking Web enabled")
-                tensorboardlogger = FedstellarLogger(f"{self.log_dir}", name="metrics", version=f"participant_{self.idx}", log_graph=True)
+                tensorboardlogger = LOGGERS.create("web", f"{self.log_dir}", name="metrics", version=f"participant_{self.idx}", log_graph=True, flush_interval=self.config.participant["tracking_args"].get("metrics_flush_interval", 2))
                 self.learner = learner(model, data, config=self.config, logger=tensorboardlogger)
 
+        # Per-round instrumentation (used by the learner, aggregator, gossiper and connections of the node)
+        if self.config.participant["tracking_args"].get("instrumentation", True):
+            self.instrumentation = Instrumentation(self.get_name(), path=f"{self.log_filename}_instrumentation.jsonl", logger=self.learner.logger)
+        else:
+            self.instrumentation = NULL_INSTRUMENTATION
+        register_instrumentation(self.get_name(), self.instrumentation)
+        self.learner.set_instrumentation(self.instrumentation)
+
+        # Cost of the links with the neighbors (measured by the connections, only to select the gossip targets by link)
+        self.links = None
+        self.__gossip_payload_size = 0
+        if self.config.participant.get("GOSSIP_NEIGHBOR_SELECTION", RANDOM) == LINK:
+            self.links = LinkEstimator()
+            register_link_estimator(self.get_name(), self.links)
+
+        # Resources telemetry (sampled in background, started with the node)
+        self.telemetry = TelemetrySampler(self.get_name(), self.learner.logger, self.config)
+
         logging.info("[NODE] Role: " + str(self.config.participant["device_args"]["role"]))
 
         # Aggregator
-        if self.config.participant["aggregator_args"]["algorithm"] == "FedAvg":
-            self.aggregator = FedAvg(node_name=self.get_name(), config=self.config)
+        self.aggregator = AGGREGATORS.create(self.config.participant["aggregator_args"]["algorithm"], node_name=self.get_name(), config=self.config)
 
         self.aggregator.add_observer(self)
 
@@ -185,6 +202,13 @@ class Node(BaseNode):
         # Connect
         return super().connect_to(h, p, full, force)
 
+    def start(self):
+        """
+        Start the node and the resources telemetry.
+        """
+        super().start()
+        self.telemetry.start()
+
     def stop(self):
         """
         Stop the node and the learning if it is running.
@@ -192,6 +216,10 @@ class Node(BaseNode):
         if self.round is not None:
             self.__stop_learning()
         self.learner.close()
+        self.reporter.stop()
+        self.telemetry.stop()
+        unregister_instrumentation(self.get_name())
+        unregister_link_estimator(self.get_name())
         super().stop()
 
     ##########################
@@ -291,6 +319,7 @@ class Node(BaseNode):
             self.round = 0
             self.totalrounds = rounds
             self.learner.init()
+            self.__set_reference()
             self.__start_thread_lock.release()
 
             begin = time.time()
@@ -375,9 +404,14 @@ class Node(BaseNode):
                     # Initialize model
                     model, _, _ = self.learner.decode_parameters(m)
                     self.learner.set_parameters(model)
+                    self.__set_reference()
                     self.__wait_init_model_lock.release()
                     self.broadcast(CommunicationProtocol.build_model_initialized_msg())
 
+            except ReferenceMismatchError as e:
+                # The sender sends dense parameters once it knows the own reference
+                logging.warning("[NODE] Discarding update: " + str(e))
+
             except DecodingParamsError as e:
                 logging.error("[NODE] Error decoding parameters: " + str(e))
                 self.stop()
@@ -406,6 +440,7 @@ class Node(BaseNode):
         Returns:
 
         """
+        self.instrumentation.start_round()
 
         # Set train set
         if self.round is not None:
@@ -629,6 +664,15 @@ class Node(BaseNode):
     #    Round finish    #
     ######################
 
+    def __set_reference(self):
+        """
+        Sets the actual model as the reference of the compressed updates and announces it to the neighbors.
+        """
+        self.learner.set_reference(self.round)
+        reference = self.learner.get_reference()
+        if reference is not None:
+            self.broadcast(CommunicationProtocol.build_reference_msg(reference))
+
     def __on_round_finished(self):
         # Remove trainset connections
         for nc in self.get_neighbors():
@@ -639,6 +683,9 @@ class Node(BaseNode):
         logging.info("[NODE] Finalizing round: {}".format(self.round))
         self.learner.finalize_round()  # TODO: Fix to improve functionality
         self.round = self.round + 1
+        # The aggregated model is the reference of the updates of the next round (set once the gossip finished)
+        self.__set_reference()
+        self.instrumentation.end_round(self.round - 1)
         self.learner.logger.log_metrics({"Round": self.round}, step=self.learner.logger.global_step)
         logging.info("[LightningLearner] Starting round: {}".format(self.round))
         # Clear node aggregation
@@ -695,20 +742,24 @@ class Node(BaseNode):
         candidate_condition = lambda nc: nc.get_name() in self.__train_set and len(nc.get_models_aggregated()) < len(self.__train_set)
         status_function = lambda nc: (nc.get_name(), len(nc.get_models_aggregated()))
         model_function = lambda nc: self.aggregator.get_partial_aggregation(nc.get_models_aggregated())
+        need_function = lambda nc: len(self.__train_set) - len(nc.get_models_aggregated())
 
         # Gossip
-        self.__gossip_model(candidate_condition, status_function, model_function)
+        with self.instrumentation.timer("gossip_aggregation"):
+            self.__gossip_model(candidate_condition, status_function, model_function, need_function)
 
     def __gossip_model_difusion(self, initialization=False):
         logging.info("[NODE.__gossip_model_difusion] Gossiping...")
         # Send model parameters using gossiping
         # Wait a model (init or aggregated)
         if initialization:
-            self.__wait_init_model_lock.acquire()
+            with self.instrumentation.timer("wait_model"):
+                self.__wait_init_model_lock.acquire()
             logging.info("[NODE.__gossip_model_difusion] Initialization=True")
             candidate_condition = lambda nc: not nc.get_model_initialized()
         else:
-            self.__finish_aggregation_lock.acquire()
+            with self.instrumentation.timer("wait_model"):
+                self.__finish_aggregation_lock.acquire()
             logging.info("[NODE.__gossip_model_difusion] Initialization=False")
             candidate_condition = lambda nc: nc.get_model_ready_status() < self.round
 
@@ -721,9 +772,10 @@ class Node(BaseNode):
         )  # At diffusion, contributors are not relevant
 
         # Gossip
-        self.__gossip_model(candidate_condition, status_function, model_function)
+        with self.instrumentation.timer("gossip_difusion"):
+            self.__gossip_model(candidate_condition, status_function, model_function)
 
-    def __gossip_model(self, candidate_condition, status_function, model_function):
+    def __gossip_model(self, candidate_condition, status_function, model_function, need_function=None):
         logging.debug("[NODE.__gossip_model] Traceback", stack_info=True)
         # Initialize list with status of nodes in the last X iterations
         last_x_status = []
@@ -776,12 +828,17 @@ class Node(BaseNode):
                     )
                     return
 
-            # Select a random subset of neighbors
+            # Select a subset of neighbors
             samples = min(self.config.participant["GOSSIP_MODELS_PER_ROUND"], len(nei))
-            nei = random.sample(nei, samples)
-            logging.info("[NODE.__gossip_model] Selected a random subset of neighbors (to exclude): {}".format(nei))
+            if self.links is not None:
+                nei = self.__select_by_link(nei, samples, need_function)
+            else:
+                nei = random.sample(nei, samples)
+            logging.info("[NODE.__gossip_model] Selected a subset of neighbors (to exclude): {}".format(nei))
 
             # Generate and Send Model Partial Aggregations (model, node_contributors)
+            # The same model is encoded once per iteration (and written once in shared memory for local neighbors)
+            encoded_models = {}
             for nc in nei:
                 model, contributors, weights = model_function(nc)
                 # Send Partial Aggregation
@@ -791,15 +848,19 @@ class Node(BaseNode):
                             nc.get_name()
                         )
                     )
-                    encoded_model = self.learner.encode_parameters(
-                        params=model, contributors=contributors, weight=weights
-                    )
-                    logging.info("[NODE.__gossip_model] Building params message | Contributors: {}".format(contributors))
-                    encoded_msgs = CommunicationProtocol.build_params_msg(encoded_model, self.config.participant["BLOCK_SIZE"])
-                    logging.info("[NODE.__gossip_model] Sending params message to {}".format(nc))
-                    # Send Fragments
-                    for msg in encoded_msgs:
-                        nc.send(msg)
+                    # Updates are only compressed for neighbors with the same reference model
+                    dense = nc.get_reference() != self.learner.get_reference()
+                    key = (id(model), tuple(contributors or ()), weights, dense)
+                    if key not in encoded_models:
+                        with self.instrumentation.timer("encode"):
+                            encoded_models[key] = (model, self.learner.encode_parameters(
+                                params=model, contributors=contributors, weight=weights,
+                                dense=dense, own=contributors == [self.get_name()]
+                            ))
+                    encoded_model = encoded_models[key][1]
+                    self.__gossip_payload_size = len(encoded_model)
+                    logging.info("[NODE.__gossip_model] Sending params message to {} | Contributors: {}".format(nc, contributors))
+                    nc.send_params(encoded_model)
                 else:
                     logging.info("[NODE.__gossip_model] Model returned by model_function is None")
             # Wait to guarantee the frequency of gossipping
@@ -808,6 +869,17 @@ class Node(BaseNode):
             if time_sleep > 0:
                 time.sleep(time_sleep)
 
+    def __select_by_link(self, nei, samples, need_function=None):
+        """
+        Selects the gossip targets weighted by what they need and by the expected time to send them the model.
+        With ``GOSSIP_ADAPTIVE_FANOUT``, more targets are selected while their transfers fit in a gossip period.
+        """
+        by_name = {nc.get_name(): nc for nc in nei}
+        needs = [need_function(nc) for nc in by_name.values()] if need_function is not None else None
+        budget = 1 / self.config.participant["GOSSIP_MODELS_FREC"] if self.config.participant.get("GOSSIP_ADAPTIVE_FANOUT", False) else None
+        names = self.links.select(list(by_name), samples, size=self.__gossip_payload_size, needs=needs, budget=budget)
+        return [by_name[name] for name in names]
+
     ###########################
     #     Observer Events     #
     ###########################
@@ -891,7 +963,6 @@ class Node(BaseNode):
         elif event == Events.REPORT_STATUS_TO_CONTROLLER_EVENT:
             self.__report_status_to_controller()
             # self.__report_logs_to_controller()
-            self.__report_resources()
 
         elif event == Events.STORE_MODEL_PARAMETERS_EVENT:
             if obj is not None:
@@ -910,6 +981,9 @@ class Node(BaseNode):
             except threading.ThreadError:
                 pass
 
+        elif event == Events.END_CONNECTION_EVENT and self.links is not None:
+            self.links.forget(obj.get_name())
+
         # Execute BaseNode update
         super().update(event, obj)
 
@@ -917,84 +991,27 @@ class Node(BaseNode):
         """
         Report the status of the node to the controller.
         The configuration is the one that the node has at the memory.
+        It does not block, the reporter sends it in background (only the latest status is sent).
 
         Returns:
 
         """
-        # Set the URL for the POST request
-        url = f'http://{self.config.participant["scenario_args"]["controller"]}/scenario/{self.config.participant["scenario_args"]["name"]}/node/update'
-
-        # Send the POST request if the controller is available
-        try:
-            response = requests.post(url, data=json.dumps(self.config.participant), headers={'Content-Type': 'application/json'})
-        except requests.exceptions.ConnectionError:
-            logging.error(f'Error connecting to the controller at {url}')
-            return
-
-        # If endpoint is not available, log the error
-        if response.status_code != 200:
-            logging.error(f'Error received from controller: {response.status_code}')
-            logging.error(response.text)
+        self.reporter.report(dict(self.config.participant, status_args=self.__runtime_status()))
 
-    def __report_resources(self):
+    def __runtime_status(self):
         """
-        Report node resources to the controller.
+        Round and last resources sample of the node (streamed by the monitoring of the controller).
 
         Returns:
-
+            dict: Runtime status.
         """
-        step = int((datetime.now() - datetime.strptime(self.config.participant["scenario_args"]["start_time"], "%d/%m/%Y %H:%M:%S")).total_seconds())
-        import sys
-        import psutil
-        # Gather CPU usage information
-        cpu_percent = psutil.cpu_percent()
-        # Gather CPU temperature information
-        cpu_temp = 0
-        try:
-            if sys.platform == "linux":
-                cpu_temp = psutil.sensors_temperatures()['coretemp'][0].current
-        except Exception as e:
-            pass
-            # logging.error(f'Error getting CPU temperature: {e}')
-        # Gather RAM usage information
-        ram_percent = psutil.virtual_memory().percent
-        # Gather disk usage information
-        disk_percent = psutil.disk_usage("/").percent
-
-        # Gather network usage information
-        net_io_counters = psutil.net_io_counters()
-        bytes_sent = net_io_counters.bytes_sent
-        bytes_recv = net_io_counters.bytes_recv
-        packets_sent = net_io_counters.packets_sent
-        packets_recv = net_io_counters.packets_recv
-
-        # Log uptime information
-        uptime = psutil.boot_time()
-
-        # Logging and reporting
-        # logging.info(f'Resources: CPU {cpu_percent}%, CPU temp {cpu_temp}C, RAM {ram_percent}%, Disk {disk_percent}%')
-        self.learner.logger.log_metrics({"Resources/CPU_percent": cpu_percent, "Resources/CPU_temp": cpu_temp, "Resources/RAM_percent": ram_percent, "Resources/Disk_percent": disk_percent}, step=step)
-        # logging.info(f'Resources: Bytes sent {bytes_sent}, Bytes recv {bytes_recv}, Packets sent {packets_sent}, Packets recv {packets_recv}')
-        self.learner.logger.log_metrics({"Resources/Bytes_sent": bytes_sent, "Resources/Bytes_recv": bytes_recv, "Resources/Packets_sent": packets_sent, "Resources/Packets_recv": packets_recv}, step=step)
-        # logging.info(f'Resources: Uptime {uptime}')
-        self.learner.logger.log_metrics({"Resources/Uptime": uptime}, step=step)
-
-        # Check if pynvml is available
-        try:
-            import pynvml
-            pynvml.nvmlInit()
-            devices = pynvml.nvmlDeviceGetCount()
-            for i in range(devices):
-                handle = pynvml.nvmlDeviceGetHandleByIndex(i)
-                gpu_percent = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
-                gpu_temp = pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
-                gpu_mem = pynvml.nvmlDeviceGetMemoryInfo(handle)
-                gpu_mem_percent = gpu_mem.used / gpu_mem.total * 100
-                # logging.info(f'Resources: GPU-{i} {gpu_percent}%, GPU temp {gpu_temp}C, GPU mem {gpu_mem_percent}%')
-                self.learner.logger.log_metrics({f"Resources/GPU{i}_percent": gpu_percent, f"Resources/GPU{i}_temp": gpu_temp, f"Resources/GPU{i}_mem_percent": gpu_mem_percent}, step=step)
-        except ModuleNotFoundError:
-            pass
-            # logging.info(f'pynvml not found, skipping GPU usage')
+        telemetry = getattr(self, "telemetry", None)  # The first report is sent before the sampler exists
+        resources = telemetry.last_metrics if telemetry is not None else {}
+        return {
+            "round": getattr(self, "round", None),
+            "total_rounds": getattr(self, "totalrounds", None),
+            "resources": {name.split("/", 1)[-1]: round(value, 2) for name, value in resources.items()},
+        }
 
     def __store_model_parameters(self, obj):
         """
@@ -16,13 +16,19 @@
 #
 
 
+import collections
 import logging
 import socket
 import threading
+import time
 
 from fedstellar.command import *
 from fedstellar.communication_protocol import CommunicationProtocol
 from fedstellar.config.config import Config
+from fedstellar.link_estimator import get_link_estimator, tcp_rtt
+from fedstellar.lossless import decompress, get_codec, is_frame
+from fedstellar.shm_transport import POOL, attach_segment, read_header
+from fedstellar.utils.instrumentation import get_instrumentation
 from fedstellar.utils.observer import Events, Observable
 
 
@@ -68,7 +74,7 @@ class NodeConnection(threading.Thread, Observable):
         )
         Observable.__init__(self)
         # Connection Loop
-        self.__terminate_flag = threading.Event()
+        self._terminate_flag = threading.Event()
         self.__socket = s
         self.__socket_lock = threading.Lock()
 
@@ -83,6 +89,8 @@ class NodeConnection(threading.Thread, Observable):
             )
 
         self.config = config
+        self.instrumentation = get_instrumentation(parent_node_name)
+        self.links = get_link_estimator(parent_node_name)
 
         # Atributes
         self.__addr = addr
@@ -91,6 +99,9 @@ class NodeConnection(threading.Thread, Observable):
         self.__aes_cipher = aes_cipher
         self.__model_initialized = False
         self.__models_aggregated = []
+        self.__reference = None
+        # Models sent and not acknowledged yet (time the transfer began, size), oldest first
+        self.__unacknowledged = collections.deque(maxlen=16)
         # Communication Protocol
         self.comm_protocol = CommunicationProtocol(
             {
@@ -106,7 +117,11 @@ class NodeConnection(threading.Thread, Observable):
                 CommunicationProtocol.VOTE_TRAIN_SET: Vote_train_set_cmd(self),
                 CommunicationProtocol.MODELS_AGGREGATED: Models_aggregated_cmd(self),
                 CommunicationProtocol.MODEL_INITIALIZED: Model_initialized_cmd(self),
+                CommunicationProtocol.MODEL_RECEIVED: Model_received_cmd(self),
                 CommunicationProtocol.TRANSFER_LEADERSHIP: Transfer_leadership_cmd(self),
+                CommunicationProtocol.SHM_MODEL: Shm_model_cmd(self),
+                CommunicationProtocol.SHM_RELEASE: Shm_release_cmd(self),
+                CommunicationProtocol.REFERENCE: Reference_cmd(self),
             },
             self.config,
         )
@@ -150,7 +165,7 @@ class NodeConnection(threading.Thread, Observable):
         self.__socket.settimeout(self.config.participant["NODE_TIMEOUT"])
         amount_pending_params = 0
         param_buffer = b""
-        while not self.__terminate_flag.is_set():
+        while not self._terminate_flag.is_set():
             try:
                 # Receive message
                 og_msg = b""
@@ -179,6 +194,7 @@ class NodeConnection(threading.Thread, Observable):
 
                 # Process messages
                 if msg != b"":
+                    self.instrumentation.count_message("received", msg, len(og_msg))
                     # Check if fragments are incomplete (collapse / TCP stream slow)
                     overflow = CommunicationProtocol.check_collapse(msg)
                     if overflow > 0:
@@ -209,7 +225,8 @@ class NodeConnection(threading.Thread, Observable):
                     #    logging.info(
                     #        "[NODE_CONNECTION] Processing message: {}".format(msg)
                     #    )
-                    exec_msgs, error = self.comm_protocol.process_message(msg)
+                    with self.instrumentation.timer("process_message"):
+                        exec_msgs, error = self.comm_protocol.process_message(msg)
                     if len(exec_msgs) > 0:
                         self.notify(
                             Events.PROCESSED_MESSAGES_EVENT, (self, exec_msgs)
@@ -217,7 +234,7 @@ class NodeConnection(threading.Thread, Observable):
 
                     # Error happened
                     if error:
-                        self.__terminate_flag.set()
+                        self._terminate_flag.set()
                         logging.info(
                             "[NODE_CONNECTION] An error happened. Last error: {}".format(msg)
                         )
@@ -226,14 +243,14 @@ class NodeConnection(threading.Thread, Observable):
                 logging.info(
                     "[NODE_CONNECTION] (NodeConnection Loop) Timeout"
                 )
-                self.__terminate_flag.set()
+                self._terminate_flag.set()
                 break
 
             except Exception as e:
                 logging.info(
                     "[NODE_CONNECTION] (NodeConnection Loop) Exception: {}".format(str(e))
                 )
-                self.__terminate_flag.set()
+                self._terminate_flag.set()
                 break
 
         # Down Connection
@@ -250,7 +267,7 @@ class NodeConnection(threading.Thread, Observable):
         """
         if not local:
             self.send(CommunicationProtocol.build_stop_msg())
-        self.__terminate_flag.set()
+        self._terminate_flag.set()
 
     ############################
     #    Processed Messages    #
@@ -308,6 +325,26 @@ class NodeConnection(threading.Thread, Observable):
         """
         return self.__model_initialized
 
+    #########################
+    #    Reference Model    #
+    #########################
+
+    def set_reference(self, reference):
+        """
+        Set the id of the reference model of the other node (compressed updates are only sent if it is the own one).
+
+        Args:
+            reference: Id of the reference model.
+        """
+        self.__reference = reference
+
+    def get_reference(self):
+        """
+        Returns:
+            The id of the reference model of the other node (None if unknown).
+        """
+        return self.__reference
+
     ##########################
     #    Models Aggregated    #
     ##########################
@@ -376,8 +413,9 @@ class NodeConnection(threading.Thread, Observable):
 
         """
         # Check if the connection is still alive
-        if not self.__terminate_flag.is_set():
+        if not self._terminate_flag.is_set():
             try:
+                plain_data = data
                 # Encrypt message
                 if self.__aes_cipher is not None:
                     data = self.__aes_cipher.add_padding(
@@ -385,18 +423,131 @@ class NodeConnection(threading.Thread, Observable):
                     )  # -> It cant broke the model because it fills all the block space
                     data = self.__aes_cipher.encrypt(data)
                 # Send message
-                self.__socket_lock.acquire()
-                self.__socket.sendall(data)
-                self.__socket_lock.release()
+                with self.instrumentation.timer("send"):
+                    self.__socket_lock.acquire()
+                    self.__socket.sendall(data)
+                    self.__socket_lock.release()
+                self.instrumentation.count_message("sent", plain_data, len(data))
                 return True
 
             except Exception as e:
                 # If some error happened, the connection is closed
-                self.__terminate_flag.set()
+                self._terminate_flag.set()
                 return False
         else:
             return False
 
+    def send_params(self, data):
+        """
+        Sends encoded model parameters to the other node. If the other node is in the same host, the parameters are
+        written in shared memory and only their handle is sent, otherwise they are fragmented in ``BLOCK_SIZE`` params messages.
+
+        Args:
+            data: The encoded parameters.
+
+        Returns:
+            True if all the fragments (or the handle) were sent, False otherwise.
+        """
+        size = len(data)
+        if self.__use_shared_memory():
+            try:
+                name, offset, size, version = POOL.publish(data)
+            except (OSError, ValueError) as e:
+                logging.error("[NODE_CONNECTION] Error writing the parameters in shared memory: {}".format(e))
+            else:
+                # Nothing crosses the link, so the transfer is not observed
+                if self.send(CommunicationProtocol.build_shm_model_msg(name, offset, size, version)):
+                    self.instrumentation.count_message("sent", CommunicationProtocol.PARAMS.encode("utf-8"), size)
+                    return True
+                POOL.release(name, version)
+                return False
+
+        # Optional lossless stage (the frame is decoded by the receiver before notifying the parameters)
+        codec = get_codec(self.config)
+        if codec is not None:
+            with self.instrumentation.timer("lossless_compress"):
+                data = codec.compress(data)
+
+        # The transfer is observed when the other node acknowledges it (sendall only fills the socket buffer)
+        if self.links is not None:
+            self.__unacknowledged.append((time.monotonic(), size))
+        for msg in CommunicationProtocol.build_params_msg(data, self.config.participant["BLOCK_SIZE"]):
+            if not self.send(msg):
+                return False
+        return True
+
+    def acknowledge_params(self):
+        """
+        Acknowledges the params messages of a model received from the other node.
+        """
+        self.send(CommunicationProtocol.build_model_received_msg())
+
+    def params_received(self):
+        """
+        The other node acknowledged the oldest model sent: observes the throughput of the link (encoded parameters,
+        before the lossless stage, by second until the last byte arrived).
+        """
+        if self.links is None or not self.__unacknowledged:
+            return
+        begin, size = self.__unacknowledged.popleft()
+        rtt = tcp_rtt(self.__socket) or 0
+        elapsed = time.monotonic() - begin
+        self.links.observe_transfer(self.get_name(), size, max(elapsed - rtt, elapsed / 2))
+
+    def __use_shared_memory(self):
+        """
+        Returns:
+            True if the parameters can be sent through shared memory (same host and no encryption).
+        """
+        if self.__aes_cipher is not None or not self.config.participant.get("SHARED_MEMORY_TRANSPORT", False):
+            return False
+        host = self.__addr[0]
+        return host == self.config.participant["network_args"]["ip"] or host in ("127.0.0.1", "localhost")
+
+    #######################
+    #    Shared Memory    #
+    #######################
+
+    def receive_shared_params(self, name, offset, size, version):
+        """
+        Reads parameters written in shared memory by the other node, notifies them and releases the segment.
+
+        Args:
+            name: Name of the segment.
+            offset: Position of the parameters in the segment.
+            size: Length of the parameters.
+            version: Version of the segment.
+        """
+        try:
+            segment = attach_segment(name)
+        except FileNotFoundError:
+            logging.error("[NODE_CONNECTION] Segment {} not found (expired)".format(name))
+            return
+        try:
+            segment_version, segment_size = read_header(segment)
+            if segment_version != version or segment_size != size:
+                logging.error("[NODE_CONNECTION] Segment {} was overwritten (version {})".format(name, segment_version))
+                return
+            self.instrumentation.count_message("received", CommunicationProtocol.PARAMS.encode("utf-8"), size)
+            # The parameters are decoded (copied) while they are notified, so the segment is not copied before
+            params = segment.buf[offset:offset + size]
+            try:
+                self.notify_params(params)
+            finally:
+                params.release()
+        finally:
+            try:
+                segment.close()
+            except BufferError as e:
+                logging.error("[NODE_CONNECTION] Segment {} still in use: {}".format(name, e))
+            self.send(CommunicationProtocol.build_shm_release_msg(name, version))
+
+    def release_shared_params(self, name, version):
+        """
+        The other node read the parameters of a segment.
+        """
+        POOL.release(name, version)
+
     ###########################
     #    Command Callbacks    #
     ###########################
@@ -405,6 +556,9 @@ class NodeConnection(threading.Thread, Observable):
         """
         Notify that a heartbeat was received.
         """
+        # Beats of the neighbor itself keep its RTT estimate updated
+        if self.links is not None and self.__socket is not None and node == self.get_name():
+            self.links.observe_rtt(node, tcp_rtt(self.__socket))
         self.notify(Events.BEAT_RECEIVED_EVENT, node)
 
     def notify_role(self, node, role):
@@ -435,6 +589,12 @@ class NodeConnection(threading.Thread, Observable):
         """
         Notify to the parent node that `PARAMS` has been received.
         """
+        if is_frame(params):
+            try:
+                params = decompress(params)
+            except ValueError as e:
+                logging.error("[NODE_CONNECTION] Error decompressing parameters: {}".format(e))
+                return
         self.notify(Events.PARAMS_RECEIVED_EVENT, (params))
 
     def notify_metrics(self, node, round, loss, metric):
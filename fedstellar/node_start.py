@@ -5,117 +5,137 @@ import time
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))  # Parent directory where is the fedml_api module
 
-from fedstellar.learning.pytorch.mnist.mnist import MNISTDataModule
-from fedstellar.learning.pytorch.femnist.femnist import FEMNISTDataModule
-from fedstellar.learning.pytorch.syscall.syscall import SYSCALLDataModule
-from fedstellar.learning.pytorch.cifar10.cifar10 import CIFAR10DataModule
+from fedstellar.learning.pytorch.tensorloader import cap_num_workers
+from fedstellar.learning.partitioning import CONTIGUOUS, load_partition
 
 from fedstellar.config.config import Config
-from fedstellar.learning.pytorch.mnist.models.mlp import MNISTModelMLP
-from fedstellar.learning.pytorch.mnist.models.cnn import MNISTModelCNN
-from fedstellar.learning.pytorch.femnist.models.cnn import FEMNISTModelCNN
-from fedstellar.learning.pytorch.syscall.models.mlp import SyscallModelMLP
-from fedstellar.learning.pytorch.syscall.models.autoencoder import SyscallModelAutoencoder
-from fedstellar.learning.pytorch.cifar10.models.resnet import CIFAR10ModelResNet
-from fedstellar.learning.pytorch.cifar10.models.fastermobilenet import FasterMobileNet
-from fedstellar.learning.pytorch.cifar10.models.simplemobilenet import SimpleMobileNetV1
-from fedstellar.learning.pytorch.syscall.models.svm import SyscallModelSGDOneClassSVM
+from fedstellar.launcher import CONNECT, LISTENING, READY, START, ControlChannel
 from fedstellar.node import Node
+# Datasets, models and aggregators are imported when selected
+from fedstellar.registry import AGGREGATORS, DATASETS, MODELS, model_name
 
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
 
+# Directory of the datasets (next to this script)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
-def main():
-    config_path = str(sys.argv[1])
-    config = Config(entity="participant", participant_config_file=config_path)
 
+def build_data(config, num_workers=None, data_dir=DATA_DIR):
+    """
+    Builds the data module of a participant.
+
+    Args:
+        config: Configuration of the participant.
+        num_workers: DataLoader workers (capped by the participants sharing the host if None).
+        data_dir: Directory of the datasets.
+
+    Returns:
+        LightningDataModule: Data of the participant.
+    """
     n_nodes = config.participant["scenario_args"]["n_nodes"]
-    experiment_name = config.participant["scenario_args"]["name"]
-    model_name = config.participant["model_args"]["model"]
     idx = config.participant["device_args"]["idx"]
-    hostdemo = config.participant["network_args"]["ipdemo"]
-    host = config.participant["network_args"]["ip"]
-    port = config.participant["network_args"]["port"]
-    neighbors = config.participant["network_args"]["neighbors"].split()
 
-    rounds = config.participant["scenario_args"]["rounds"]
-    epochs = config.participant["training_args"]["epochs"]
+    # Participants of a simulation share the host cores, cap the DataLoader workers accordingly
+    if num_workers is None:
+        num_workers = cap_num_workers(4, n_nodes if config.participant["scenario_args"]["simulation"] else 1)
+
+    # Data partition precomputed by the controller (contiguous ranges otherwise)
+    partition = None
+    if config.participant["data_args"].get("partition", CONTIGUOUS) != CONTIGUOUS:
+        partition = load_partition(os.path.join(config.participant["tracking_args"]["config_dir"], "partitions"), idx)
+        if partition is None:
+            logging.warning("Partition of node {} not found, using contiguous ranges".format(idx))
+
+    # Only the module of the dataset selected is imported
+    return DATASETS.create(
+        config.participant["data_args"]["dataset"],
+        sub_id=idx, number_sub=n_nodes, num_workers=num_workers, root_dir=data_dir, partition=partition,
+    )
 
-    aggregation_algorithm = config.participant["aggregator_args"]["algorithm"]
 
-    dataset = config.participant["data_args"]["dataset"]
-    model = None
-    if dataset == "MNIST":
-        dataset = MNISTDataModule(sub_id=idx, number_sub=n_nodes, iid=True)
-        if model_name == "MLP":
-            model = MNISTModelMLP()
-        elif model_name == "CNN":
-            model = MNISTModelCNN()
-        else:
-            raise ValueError(f"Model {model} not supported")
-    elif dataset == "FEMNIST":
-        dataset = FEMNISTDataModule(sub_id=idx, number_sub=n_nodes, root_dir=f"{sys.path[0]}/data")
-        if model_name == "CNN":
-            model = FEMNISTModelCNN()
-        else:
-            raise ValueError(f"Model {model} not supported")
-    elif dataset == "SYSCALL":
-        dataset = SYSCALLDataModule(sub_id=idx, number_sub=n_nodes, root_dir=f"{sys.path[0]}/data")
-        if model_name == "MLP":
-            model = SyscallModelMLP()
-        elif model_name == "SVM":
-            model = SyscallModelSGDOneClassSVM()
-        elif model_name == "Autoencoder":
-            model = SyscallModelAutoencoder()
-        else:
-            raise ValueError(f"Model {model} not supported")
-    elif dataset == "CIFAR10":
-        dataset = CIFAR10DataModule(sub_id=idx, number_sub=n_nodes, root_dir=f"{sys.path[0]}/data")
-        if model_name == "ResNet9":
-            model = CIFAR10ModelResNet(classifier="resnet9")
-        elif model_name == "ResNet18":
-            model = CIFAR10ModelResNet(classifier="resnet18")
-        elif model_name == "fastermobilenet":
-            model = FasterMobileNet()
-        elif model_name == "simplemobilenet":
-            model = SimpleMobileNetV1()
-        else:
-            raise ValueError(f"Model {model} not supported")
-    else:
-        raise ValueError(f"Dataset {dataset} not supported")
+def build_model(config):
+    """
+    Builds the model of a participant.
 
-    if aggregation_algorithm == "FedAvg":
-        pass
-    else:
+    Args:
+        config: Configuration of the participant.
+
+    Returns:
+        LightningModule: Model of the participant.
+    """
+    return MODELS.create(model_name(config.participant["data_args"]["dataset"], config.participant["model_args"]["model"]))
+
+
+def build_node(config, transport=None, num_workers=None, data_dir=DATA_DIR):
+    """
+    Builds the node of a participant (not started).
+
+    Args:
+        config: Configuration of the participant.
+        transport: In-memory transport shared with the nodes of the same process (None to only use TCP).
+        num_workers: DataLoader workers (capped by the participants sharing the host if None).
+        data_dir: Directory of the datasets.
+
+    Returns:
+        Node: Node of the participant.
+    """
+    aggregation_algorithm = config.participant["aggregator_args"]["algorithm"]
+    if aggregation_algorithm not in AGGREGATORS:
         raise ValueError(f"Aggregation algorithm {aggregation_algorithm} not supported")
 
-    node = Node(
-        idx=idx,
-        experiment_name=experiment_name,
-        model=model,
-        data=dataset,
-        hostdemo=hostdemo,
-        host=host,
-        port=port,
+    return Node(
+        idx=config.participant["device_args"]["idx"],
+        experiment_name=config.participant["scenario_args"]["name"],
+        model=build_model(config),
+        data=build_data(config, num_workers, data_dir),
+        hostdemo=config.participant["network_args"]["ipdemo"],
+        host=config.participant["network_args"]["ip"],
+        port=config.participant["network_args"]["port"],
         config=config,
-        encrypt=False
+        encrypt=False,
+        transport=transport,
     )
 
+
+def main(config_path=None, data_dir=DATA_DIR):
+    config_path = config_path or str(sys.argv[1])
+    config = Config(entity="participant", participant_config_file=config_path)
+
+    neighbors = config.participant["network_args"]["neighbors"].split()
+    rounds = config.participant["scenario_args"]["rounds"]
+    epochs = config.participant["training_args"]["epochs"]
+
+    # Started by fedstellar.launcher: the phases are synchronized with the other participants instead of waiting
+    control = ControlChannel.from_env()
+
+    node = build_node(config, data_dir=data_dir)
+
     node.start()
-    print("Node started, grace time for network start-up (30s)")
-    time.sleep(30)  # Wait for the participant to start and register in the network
+    if control is not None:
+        control.report(LISTENING)
+        print("Node started, waiting for all the participants to listen")
+        control.wait(CONNECT)
+    else:
+        print("Node started, grace time for network start-up (30s)")
+        time.sleep(30)  # Wait for the participant to start and register in the network
 
     # Node Connection to the neighbors
     for i in neighbors:
         print(f"Connecting to {i}")
         node.connect_to(i.split(':')[0], int(i.split(':')[1]), full=False)
-        time.sleep(5)
+        if control is None:
+            time.sleep(5)
 
     logging.info(f"Neighbors: {node.get_neighbors()}")
     logging.info(f"Network nodes: {node.get_network_nodes()}")
 
     start_node = config.participant["device_args"]["start"]
 
+    if control is not None:
+        control.report(READY)
+        if start_node:
+            control.wait(START)
+
     if start_node:
         node.set_start_learning(rounds=rounds, epochs=epochs)  # rounds=10, epochs=5
 
@@ -0,0 +1,116 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Registries of the components selected by name in ``participant.json``: datasets, models, aggregators and loggers.
+
+Components are registered with the path of their implementation (``"module:attribute"``), and the module is only
+imported when the component is used, so a participant only imports the dataset, model, aggregator and logger it
+selects. Other components can be registered the same way (or with the object itself).
+"""
+import importlib
+import threading
+
+
+class Registry:
+    """
+    Args:
+        kind: Kind of the components (used in the errors).
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.__entries = {}  # Name: (path or object, default keyword arguments)
+        self.__lock = threading.Lock()
+
+    def register(self, name, target, **defaults):
+        """
+        Args:
+            name: Name of the component in the configuration.
+            target: ``"module:attribute"`` of the implementation (imported on use) or the implementation itself.
+            defaults: Keyword arguments passed when the component is created.
+        """
+        with self.__lock:
+            self.__entries[name] = (target, defaults)
+
+    def names(self):
+        with self.__lock:
+            return list(self.__entries)
+
+    def modules(self):
+        """
+        Returns:
+            list: Modules of the components not imported yet.
+        """
+        with self.__lock:
+            return sorted({target.partition(":")[0] for target, _ in self.__entries.values() if isinstance(target, str)})
+
+    def __contains__(self, name):
+        with self.__lock:
+            return name in self.__entries
+
+    def load(self, name):
+        """
+        Returns:
+            Implementation of the component (its module is imported the first time).
+        """
+        with self.__lock:
+            entry = self.__entries.get(name)
+        if entry is None:
+            raise ValueError(f"{self.kind} {name} not supported")
+        target, defaults = entry
+        if isinstance(target, str):
+            module, _, attribute = target.partition(":")
+            target = getattr(importlib.import_module(module), attribute)
+            with self.__lock:
+                self.__entries[name] = (target, defaults)
+        return target
+
+    def create(self, name, *args, **kwargs):
+        """
+        Returns:
+            Instance of the component (with the defaults of its registration).
+        """
+        target = self.load(name)
+        with self.__lock:
+            defaults = self.__entries[name][1]
+        return target(*args, **dict(defaults, **kwargs))
+
+
+def model_name(dataset, model):
+    """
+    Returns:
+        str: Name of a model in ``MODELS`` (models are registered by dataset).
+    """
+    return f"{dataset}/{model}"
+
+
+DATASETS = Registry("Dataset")
+DATASETS.register("MNIST", "fedstellar.learning.pytorch.mnist.mnist:MNISTDataModule", iid=True)
+DATASETS.register("FEMNIST", "fedstellar.learning.pytorch.femnist.femnist:FEMNISTDataModule")
+DATASETS.register("SYSCALL", "fedstellar.learning.pytorch.syscall.syscall:SYSCALLDataModule")
+DATASETS.register("CIFAR10", "fedstellar.learning.pytorch.cifar10.cifar10:CIFAR10DataModule")
+
+MODELS = Registry("Model")
+MODELS.register(model_name("MNIST", "MLP"), "fedstellar.learning.pytorch.mnist.models.mlp:MNISTModelMLP")
+MODELS.register(model_name("MNIST", "CNN"), "fedstellar.learning.pytorch.mnist.models.cnn:MNISTModelCNN")
+MODELS.register(model_name("FEMNIST", "CNN"), "fedstellar.learning.pytorch.femnist.models.cnn:FEMNISTModelCNN")
+MODELS.register(model_name("SYSCALL", "MLP"), "fedstellar.learning.pytorch.syscall.models.mlp:SyscallModelMLP")
+MODELS.register(model_name("SYSCALL", "SVM"), "fedstellar.learning.pytorch.syscall.models.svm:SyscallModelSGDOneClassSVM")
+MODELS.register(model_name("SYSCALL", "Autoencoder"), "fedstellar.learning.pytorch.syscall.models.autoencoder:SyscallModelAutoencoder")
+MODELS.register(model_name("CIFAR10", "ResNet9"), "fedstellar.learning.pytorch.cifar10.models.resnet:CIFAR10ModelResNet", classifier="resnet9")
+MODELS.register(model_name("CIFAR10", "ResNet18"), "fedstellar.learning.pytorch.cifar10.models.resnet:CIFAR10ModelResNet", classifier="resnet18")
+MODELS.register(model_name("CIFAR10", "fastermobilenet"), "fedstellar.learning.pytorch.cifar10.models.fastermobilenet:FasterMobileNet")
+MODELS.register(model_name("CIFAR10", "simplemobilenet"), "fedstellar.learning.pytorch.cifar10.models.simplemobilenet:SimpleMobileNetV1")
+
+AGGREGATORS = Registry("Aggregation algorithm")
+AGGREGATORS.register("FedAvg", "fedstellar.learning.aggregators.fedavg:FedAvg")
+
+# Loggers of the learner: remote tracking (W&B) and local tracking (``tracking_args.local_tracking``)
+LOGGERS = Registry("Logger")
+LOGGERS.register("wandb", "fedstellar.learning.pytorch.remotelogger:FedstellarWBLogger")
+LOGGERS.register("csv", "lightning.pytorch.loggers:CSVLogger")
+LOGGERS.register("web", "fedstellar.learning.pytorch.statisticslogger:FedstellarLogger")
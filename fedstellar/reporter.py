@@ -0,0 +1,181 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+import collections
+import copy
+import json
+import logging
+import threading
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Header used to mark a status update that only contains the fields changed since a status written by the controller
+# (its value is the sequence number of that status)
+DELTA_HEADER = "Fedstellar-Status-Delta"
+# Sequence number of the status sent (unique to the reporter, increased with every report of the node)
+SEQUENCE_HEADER = "Fedstellar-Status-Sequence"
+# Header of the responses of the controller with the sequence number of the last status of the node it has written
+# (readable by all its workers, the base of the next deltas)
+BASE_HEADER = "Fedstellar-Status-Base"
+
+# Fields always included in a delta, used by the controller to identify the node
+IDENTITY_FIELDS = {
+    "device_args": ["idx", "uid"],
+    "scenario_args": ["name"],
+}
+
+
+def diff_status(old, new):
+    """
+    Nested difference between two status dictionaries.
+
+    Args:
+        old: Status acknowledged by the controller.
+        new: Current status.
+
+    Returns:
+        dict: Fields of ``new`` that are missing or different in ``old`` (removed fields are not reported).
+    """
+    delta = {}
+    for key, value in new.items():
+        if key not in old:
+            delta[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested = diff_status(old[key], value)
+            if nested:
+                delta[key] = nested
+        elif old[key] != value:
+            delta[key] = value
+    return delta
+
+
+def merge_status(base, delta):
+    """
+    Applies a delta generated by diff_status to a status dictionary (in place).
+
+    Returns:
+        dict: The updated status.
+    """
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge_status(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+
+##################
+#    Reporter    #
+##################
+
+
+class Reporter(threading.Thread):
+    """
+    Thread based reporter that sends the status of the node to the controller.
+
+    Reports never block the caller (e.g. the heartbeater): ``report`` only stores a snapshot of the status,
+    and the reporter thread sends the latest one (intermediate snapshots are coalesced) using a keep-alive
+    session with bounded timeouts. Once the controller has written a status of the node, only the fields changed
+    since that status are sent.
+
+    Args:
+        node_name (str): Name of the node.
+        config (Config): Configuration of the node.
+        timeout (tuple): Connect and read timeouts (seconds) of the requests.
+        max_unwritten (int): Statuses sent and not written by the controller yet that are kept (possible bases).
+    """
+
+    def __init__(self, node_name, config, timeout=(3, 10), max_unwritten=32):
+        threading.Thread.__init__(self, name="reporter-" + node_name, daemon=True)
+        self.config = config
+        self.__timeout = timeout
+        self.__terminate_flag = threading.Event()
+        self.__pending = threading.Event()
+        self.__lock = threading.Lock()
+        self.__latest = None
+        self.__base = None  # (sequence, status) written by the controller
+        self.__unwritten = collections.OrderedDict()  # Sequence: status acknowledged, not written yet
+        self.__max_unwritten = max_unwritten
+        self.__reporter_id = uuid.uuid4().hex[:8]  # Sequences of a restarted node are not the ones written before
+        self.__sequence = 0
+
+        # Single pooled connection to the controller, retries are handled by the next reports
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+
+    def report(self, status):
+        """
+        Schedule the status to be sent to the controller (replaces any status not sent yet).
+
+        Args:
+            status (dict): Status of the node (it is copied).
+        """
+        snapshot = copy.deepcopy(status)
+        with self.__lock:
+            self.__latest = snapshot
+        self.__pending.set()
+
+    def run(self):
+        while not self.__terminate_flag.is_set():
+            self.__pending.wait()
+            self.__pending.clear()
+            with self.__lock:
+                status, self.__latest = self.__latest, None
+            if status is not None and not self.__terminate_flag.is_set():
+                self.__send(status)
+        self.__session.close()
+
+    def stop(self):
+        """
+        Stop the reporter.
+        """
+        self.__terminate_flag.set()
+        self.__pending.set()
+
+    def __send(self, status):
+        url = f'http://{status["scenario_args"]["controller"]}/scenario/{status["scenario_args"]["name"]}/node/update'
+        self.__sequence += 1
+        sequence = f'{self.__reporter_id}-{self.__sequence}'
+        headers = {'Content-Type': 'application/json', SEQUENCE_HEADER: sequence}
+        if self.__base is None:
+            body = status
+        else:
+            # Empty deltas are also sent, they refresh the timestamp of the node in the controller
+            body = diff_status(self.__base[1], status)
+            for section, fields in IDENTITY_FIELDS.items():
+                body.setdefault(section, {}).update({f: status[section][f] for f in fields})
+            headers[DELTA_HEADER] = self.__base[0]
+
+        try:
+            response = self.__session.post(url, data=json.dumps(body), headers=headers, timeout=self.__timeout)
+        except requests.exceptions.RequestException as e:
+            logging.error(f'Error connecting to the controller at {url}: {e}')
+            return
+
+        if response.status_code == 200:
+            self.__unwritten[sequence] = status
+            written = response.headers.get(BASE_HEADER)
+            if written in self.__unwritten:
+                # The statuses sent before the one written are not needed anymore
+                while True:
+                    unwritten_sequence, unwritten_status = self.__unwritten.popitem(last=False)
+                    if unwritten_sequence == written:
+                        self.__base = (written, unwritten_status)
+                        break
+            while len(self.__unwritten) > self.__max_unwritten:
+                self.__unwritten.popitem(last=False)
+        elif response.status_code == 409:
+            # The base of the delta is not the last status written anymore (e.g. a newer one was written), the next
+            # report is complete
+            logging.debug(f'Status delta rejected by the controller: {response.text}')
+            self.__base = None
+        else:
+            # The controller could not apply the report (e.g. it was restarted), the next report is complete
+            logging.error(f'Error received from controller: {response.status_code}')
+            logging.error(response.text)
+            self.__base = None
@@ -0,0 +1,159 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Shared-memory transport of model parameters between the nodes of the same host.
+
+The sender writes the encoded parameters once in a shared-memory segment and only sends a handle
+(name, offset, size, version) through the connection. The receiver maps the segment and decodes the parameters
+from it, then releases the handle. The segment is unlinked when every receiver released it (or it expired).
+
+Segment layout: version (8 bytes) | size (8 bytes) | encoded parameters.
+"""
+import atexit
+import logging
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+HEADER = struct.Struct("<QQ")
+
+# Segments not released by all the receivers after this time (seconds) are unlinked
+SEGMENT_TTL = 120
+
+
+def attach_segment(name):
+    """
+    Maps an existing segment (only its creator unlinks it).
+
+    Args:
+        name: Name of the segment.
+
+    Returns:
+        SharedMemory: The segment.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python < 3.13 registers attached segments in the resource tracker, which would unlink them at exit. Segments of
+    # the process itself keep the registration of their creator.
+    segment = shared_memory.SharedMemory(name=name)
+    if not POOL.owns(name):
+        resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def read_header(segment):
+    """
+    Returns:
+        tuple: (version, size) of the parameters stored in the segment.
+    """
+    return HEADER.unpack_from(segment.buf, 0)
+
+
+class _Entry:
+    __slots__ = ("segment", "version", "refs", "created", "data")
+
+    def __init__(self, segment, version, data):
+        self.segment = segment
+        self.version = version
+        self.refs = 0
+        self.created = time.monotonic()
+        self.data = data
+
+
+#########################
+#    SharedModelPool    #
+#########################
+
+
+class SharedModelPool:
+    """
+    Segments published by the nodes of a process, with the number of receivers that did not release them yet.
+    """
+
+    def __init__(self, ttl=SEGMENT_TTL):
+        self.ttl = ttl
+        self.__entries = {}
+        self.__version = 0
+        self.__lock = threading.Lock()
+
+    def publish(self, data):
+        """
+        Writes the encoded parameters in a segment (reused if the same buffer was just published) for one more receiver.
+
+        Args:
+            data: Encoded parameters.
+
+        Returns:
+            tuple: Handle (name, offset, size, version) of the parameters.
+        """
+        with self.__lock:
+            self.__collect()
+            # The same encoded buffer sent to several neighbors is written once
+            for name, entry in self.__entries.items():
+                if entry.data is data:
+                    entry.refs += 1
+                    return name, HEADER.size, len(data), entry.version
+
+            self.__version += 1
+            segment = shared_memory.SharedMemory(create=True, size=HEADER.size + len(data))
+            HEADER.pack_into(segment.buf, 0, self.__version, len(data))
+            segment.buf[HEADER.size:HEADER.size + len(data)] = data
+            entry = _Entry(segment, self.__version, data)
+            entry.refs = 1
+            self.__entries[segment.name] = entry
+            return segment.name, HEADER.size, len(data), entry.version
+
+    def owns(self, name):
+        """
+        Returns:
+            True if the segment was published by the pool.
+        """
+        with self.__lock:
+            return name in self.__entries
+
+    def release(self, name, version):
+        """
+        A receiver finished reading the segment (or could not send the handle).
+        """
+        with self.__lock:
+            entry = self.__entries.get(name)
+            if entry is None or entry.version != version:
+                return
+            entry.refs -= 1
+            if entry.refs <= 0:
+                self.__unlink(name)
+
+    def __collect(self):
+        now = time.monotonic()
+        for name in [n for n, e in self.__entries.items() if now - e.created > self.ttl]:
+            logging.info("[SharedModelPool] Segment {} expired with {} receivers".format(name, self.__entries[name].refs))
+            self.__unlink(name)
+
+    def __unlink(self, name):
+        entry = self.__entries.pop(name)
+        entry.data = None
+        try:
+            entry.segment.close()
+            entry.segment.unlink()
+        except (FileNotFoundError, BufferError) as e:
+            logging.error("[SharedModelPool] Error unlinking segment {}: {}".format(name, e))
+
+    def close(self):
+        """
+        Unlinks all the segments.
+        """
+        with self.__lock:
+            for name in list(self.__entries):
+                self.__unlink(name)
+
+
+# Pool of the process (segment names are unique in the host)
+POOL = SharedModelPool()
+atexit.register(POOL.close)
@@ -0,0 +1,21 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+import argparse
+import logging
+
+from fedstellar.node_start import DATA_DIR
+from fedstellar.simulator.simulator import Simulator
+
+argparser = argparse.ArgumentParser(description='In-process simulator of Fedstellar scenarios')
+argparser.add_argument('config', help='Directory with the configuration files of the participants of the scenario')
+argparser.add_argument('-w', '--workers', dest='workers', type=int, default=None,
+                       help='Number of worker processes (default: up to 4, one per core)')
+argparser.add_argument('-d', '--data', dest='data_dir', default=DATA_DIR,
+                       help='Directory of the datasets (default: the one of the participants, fedstellar/data)')
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    Simulator(args.config, workers=args.workers, data_dir=args.data_dir).run()
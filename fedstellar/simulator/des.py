@@ -0,0 +1,794 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Deterministic discrete-event simulation of the communication of a federation.
+
+The protocol classes of the nodes (``CommunicationProtocol`` and the commands, ``Gossiper`` and ``Aggregator``) are
+driven by a virtual clock instead of threads and sleeps: the periodic loops (``GOSSIP_MESSAGES_FREC``,
+``GOSSIP_MODELS_FREC``) and the timeouts (``AGGREGATION_TIMEOUT``) are events of a queue, and messages are delivered
+after the time that the link needs to transmit them.
+
+Links are modelled after the ``network_args`` applied with ``tcset`` (rate, delay, delay-distro and loss of the
+egress interface of each node). Models are scalars (the average of the scalars measures how the models of the
+nodes converge) sent with the size of the real model (``model_size``), the training takes ``train_time`` seconds.
+
+Heartbeats (``BEAT`` every ``HEARTBEAT_PERIOD`` and ``ROLE`` every two periods, gossiped to every node) are not
+simulated message by message, they would be most of the events of large networks: the messages every node sends in
+a period are computed from the topology (every node forwards every beat of its component to its other neighbors),
+and they take the egress of the node right after every beat as a single burst, delaying its commands. Runs are
+deterministic for a seed.
+
+Usage:
+    python -m fedstellar.simulator.des --nodes 1000 --rounds 50 --topology random --degree 4
+"""
+import argparse
+import copy
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+
+from fedstellar.communication_protocol import CommunicationProtocol
+from fedstellar.config.config import Config
+from fedstellar.gossiper import Gossiper
+from fedstellar.learning.aggregators.aggregator import Aggregator
+from fedstellar.node_connection import NodeConnection
+from fedstellar.utils.instrumentation import message_type
+from fedstellar.utils.observer import Events
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "participant.json.example")
+
+# Payload of a TCP segment (bytes) and minimum retransmission timeout (seconds) of Linux
+MSS = 1448
+MIN_RTO = 0.2
+# Characters of the hash of the gossiped messages (a 64-bit integer, see CommunicationProtocol.generate_hased_message)
+HASH_SIZE = 20
+
+
+##############################
+#    Network configuration   #
+##############################
+
+
+def parse_rate(rate):
+    """
+    Args:
+        rate: Rate with the format of tcset (e.g. 1Mbps, 100Kbps) or bits per second.
+
+    Returns:
+        float: Bits per second.
+    """
+    if isinstance(rate, (int, float)):
+        return float(rate)
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kKmMgG]?)(bps|bit/s)?\s*", rate)
+    if match is None:
+        raise ValueError("Invalid rate: {}".format(rate))
+    return float(match.group(1)) * {"": 1, "k": 1e3, "m": 1e6, "g": 1e9}[match.group(2).lower()]
+
+
+def parse_delay(delay):
+    """
+    Args:
+        delay: Delay with the format of tcset (e.g. 100ms, 1s) or milliseconds.
+
+    Returns:
+        float: Seconds.
+    """
+    if isinstance(delay, (int, float)):
+        return delay / 1000
+    match = re.fullmatch(r"\s*([\d.]+)\s*(us|ms|s|sec)?\s*", delay)
+    if match is None:
+        raise ValueError("Invalid delay: {}".format(delay))
+    return float(match.group(1)) * {"us": 1e-6, "ms": 1e-3, "s": 1, "sec": 1, None: 1e-3}[match.group(2)]
+
+
+def parse_loss(loss):
+    """
+    Args:
+        loss: Loss with the format of tcset (e.g. 0.1%) or percentage.
+
+    Returns:
+        float: Probability of losing a packet.
+    """
+    if isinstance(loss, (int, float)):
+        return loss / 100
+    return float(loss.strip().rstrip("%")) / 100
+
+
+class Link:
+    """
+    Transmission parameters of the egress of a node (to a neighbor).
+
+    Args:
+        rate (float): Bits per second.
+        delay (float): Seconds.
+        jitter (float): Standard deviation of the delay (seconds).
+        loss (float): Probability of losing a packet.
+    """
+
+    __slots__ = ("rate", "delay", "jitter", "loss")
+
+    def __init__(self, rate, delay, jitter=0.0, loss=0.0):
+        self.rate = rate
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+
+    @classmethod
+    def from_network_args(cls, network_args):
+        return cls(
+            parse_rate(network_args.get("rate", "1Gbps")),
+            parse_delay(network_args.get("delay", 0)),
+            parse_delay(network_args.get("delay-distro", 0)),
+            parse_loss(network_args.get("loss", 0)),
+        )
+
+    def lost_packets(self, packets, rng):
+        """
+        Returns:
+            int: Number of lost packets of a message (geometric gaps between losses).
+        """
+        if self.loss <= 0:
+            return 0
+        if self.loss >= 1:
+            raise ValueError("Loss must be lower than 100%")
+        lost = 0
+        position = 0
+        log_success = math.log(1 - self.loss)
+        while True:
+            position += int(math.log(1 - rng.random()) / log_success) + 1
+            if position > packets:
+                return lost
+            lost += 1
+
+
+def params_wire_size(size, block_size):
+    """
+    Returns:
+        int: Bytes sent for encoded parameters of ``size`` bytes (see ``CommunicationProtocol.build_params_msg``).
+    """
+    header = len(CommunicationProtocol.PARAMS)
+    end = len(CommunicationProtocol.PARAMS_CLOSE)
+    fragments = max(math.ceil(size / (block_size - header)), 1)
+    last = header + size - (fragments - 1) * (block_size - header)
+    if last + end <= block_size:
+        return fragments * block_size
+    return (fragments - 1) * block_size + last + header + end
+
+
+def ring_topology(n):
+    """
+    Returns:
+        list: Adjacency matrix of a ring of n nodes.
+    """
+    matrix = [[0] * n for _ in range(n)]
+    for i in range(n):
+        if n > 1:
+            matrix[i][(i + 1) % n] = matrix[(i + 1) % n][i] = 1
+    return matrix
+
+
+def random_topology(n, degree, seed=0):
+    """
+    Returns:
+        list: Adjacency matrix of a connected random topology (a ring plus random links) with about ``degree`` neighbors per node.
+    """
+    rng = random.Random(seed)
+    matrix = ring_topology(n)
+    for i in range(n):
+        while sum(matrix[i]) < degree and n > degree:
+            j = rng.randrange(n)
+            if j != i:
+                matrix[i][j] = matrix[j][i] = 1
+    return matrix
+
+
+####################
+#    Event loop    #
+####################
+
+
+class EventLoop:
+    """
+    Queue of events ordered by virtual time (events at the same time run in the order they were scheduled).
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.events = 0
+        self.__queue = []
+        self.__sequence = itertools.count()
+        self.__stopped = False
+
+    def schedule(self, delay, callback, *args):
+        self.schedule_at(self.now + delay, callback, *args)
+
+    def schedule_at(self, when, callback, *args):
+        heapq.heappush(self.__queue, (when, next(self.__sequence), callback, args))
+
+    def stop(self):
+        self.__stopped = True
+
+    def run(self, until=None):
+        """
+        Runs the events until the queue is empty, ``stop`` is called or the virtual time ``until`` is reached.
+        """
+        while self.__queue and not self.__stopped:
+            if until is not None and self.__queue[0][0] > until:
+                self.now = until
+                break
+            self.now, _, callback, args = heapq.heappop(self.__queue)
+            self.events += 1
+            callback(*args)
+
+
+########################
+#    SimConnection    #
+########################
+
+
+class SimConnection(NodeConnection):
+    """
+    Connection of a simulated node. Messages are delivered to the connection of the other side after the
+    transmission time of the link (the egress of the node is shared by its connections, and the commands are
+    interleaved with the fragments of the models).
+
+    Args:
+        node: Simulated node that owns the connection.
+        addr: Address of the other node.
+        link: Link to the other node.
+    """
+
+    def __init__(self, node, addr, link):
+        NodeConnection.__init__(self, node.get_name(), None, addr, None, config=node.config)
+        self.node = node
+        self.link = link
+        self.params_size = params_wire_size(node.simulation.model_size, self.config.participant["BLOCK_SIZE"])
+        self.peer = None
+        self.__last_arrival = [0.0, 0.0]
+
+    def __transmit(self, begin, size, stream, deliver, *args):
+        """
+        Schedules the delivery of a message whose transmission starts at ``begin``.
+
+        Args:
+            stream (int): 0 for commands, 1 for models (each one is delivered in order).
+
+        Returns:
+            float: Time when the transmission ends.
+        """
+        simulation = self.node.simulation
+        end = begin + size * 8 / self.link.rate
+        arrival = end + self.link.delay
+        if self.link.jitter > 0:
+            arrival += max(simulation.rng.gauss(0, self.link.jitter), -self.link.delay)
+        # TCP retransmits the lost segments after a timeout
+        lost = self.link.lost_packets(math.ceil(size / MSS), simulation.rng)
+        if lost:
+            arrival += lost * max(MIN_RTO, 4 * self.link.delay)
+        # TCP delivers in order (commands are interleaved with the fragments of the models)
+        arrival = max(arrival, self.__last_arrival[stream])
+        self.__last_arrival[stream] = arrival
+        simulation.loop.schedule_at(arrival, deliver, *args)
+        return end
+
+    def send(self, data):
+        if self._terminate_flag.is_set():
+            return False
+        node = self.node
+        node.simulation.count_message(data, len(data))
+        # Commands are sent between the fragments of the models (a burst of commands waits for one fragment)
+        now = node.simulation.loop.now
+        if node.simulation.heartbeats:
+            node.send_heartbeats(now)
+        begin = max(now, node.control_free_at)
+        if node.control_free_at <= now < node.tx_free_at:
+            begin += min(self.config.participant["BLOCK_SIZE"] * 8 / self.link.rate, node.tx_free_at - now)
+        node.control_free_at = self.__transmit(begin, len(data), 0, self.peer.receive, data)
+        return True
+
+    def send_params(self, data):
+        """
+        Args:
+            data: Parameters (model, contributors, weight), sent with the size of the encoded model.
+        """
+        if self._terminate_flag.is_set():
+            return False
+        node = self.node
+        node.simulation.count_message_type("PARAMS", self.params_size)
+        # Models share the egress of the node one after the other
+        begin = max(node.simulation.loop.now, node.tx_free_at)
+        node.tx_free_at = self.__transmit(begin, self.params_size, 1, self.peer.notify_params, data)
+        return True
+
+    def receive(self, data):
+        """
+        Processes a message delivered by the other side.
+        """
+        exec_msgs, error = self.comm_protocol.process_message(data)
+        if len(exec_msgs) > 0:
+            self.notify(Events.PROCESSED_MESSAGES_EVENT, (self, exec_msgs))
+        if error:
+            self.node.simulation.errors += 1
+            logging.info("[SimConnection] Error processing message: {}".format(data))
+
+    def stop(self, local=False):
+        self._terminate_flag.set()
+
+
+########################
+#    SimAggregator    #
+########################
+
+
+class SimAggregator(Aggregator):
+    """
+    Aggregator whose timeout is an event of the simulation. Models are scalars.
+    """
+
+    def __init__(self, node_name="unknown", config=None, loop=None):
+        super().__init__(node_name, config)
+        self.loop = loop
+        self.timed_out = False
+        self.__token = object()
+        self.__started = False
+        self.__finished = False
+
+    def start(self):
+        if not self.__started:
+            self.__started = True
+            self.loop.schedule(self.config.participant["AGGREGATION_TIMEOUT"], self.__timeout, self.__token)
+
+    def __timeout(self, token):
+        # Timeouts of previous rounds are ignored (clear creates a new token)
+        if token is self.__token and not self.__finished:
+            self.timed_out = True
+            self.__finish()
+
+    def release_aggregation(self):
+        self.loop.schedule(0, self.__release, self.__token)
+
+    def __release(self, token):
+        if token is self.__token:
+            self.__finish()
+
+    def __finish(self):
+        if not self.__finished:
+            self.__finished = True
+            self.finish_aggregation()
+
+    def aggregate(self, models):
+        models = list(models.values())
+        total = sum(w for _, w in models)
+        return sum(m * w for m, w in models) / total
+
+    def clear(self):
+        loop = self.loop
+        super().clear()
+        self.loop = loop
+
+
+##################
+#    SimNode     #
+##################
+
+
+class SimNode:
+    """
+    Node of the simulation (observer of its connections, gossiper and aggregator), following the rounds of ``Node``
+    with the role aggregator: train, add the own model, gossip partial aggregations to the neighbors until they have
+    the models of the train set, and wait for the aggregation.
+
+    Args:
+        simulation: Simulation of the node.
+        idx: Index of the node.
+        config: Configuration of the node.
+        model: Initial model (scalar).
+    """
+
+    def __init__(self, simulation, idx, config, model):
+        self.simulation = simulation
+        self.idx = idx
+        self.addr = ("127.0.0.1", 45000 + idx)
+        self.config = config
+        self.model = model
+        self.weight = 1
+        self.neighbors = []
+        self.tx_free_at = 0.0
+        self.control_free_at = 0.0
+        self.round = None
+        self.train_set = []
+        self.round_ends = []
+        self.timeouts = 0
+        # Heartbeats of a period (see NetworkSimulator): beats (and roles) sent, their (beat, role) sizes and the
+        # seconds of egress they take
+        self.heartbeat_messages = 0
+        self.heartbeat_sizes = (0, 0)
+        self.heartbeat_time = (0.0, 0.0)
+
+        self.gossiper = Gossiper(self.get_name(), self.neighbors, config)
+        self.gossiper.add_observer(self)
+        self.aggregator = SimAggregator(self.get_name(), config, simulation.loop)
+        self.aggregator.add_observer(self)
+
+        self.__gossip_scheduled = False
+        self.__aggregated = False
+        self.__models_gossiped = False
+        self.__last_status = []
+        self.__next_beat = 0
+
+    def get_name(self):
+        return self.addr[0] + ":" + str(self.addr[1])
+
+    def get_addr(self):
+        return self.addr
+
+    def add_neighbor(self, nc):
+        nc.add_observer(self)
+        self.neighbors.append(nc)
+
+    def broadcast(self, msg, exc=[]):
+        for nc in self.neighbors:
+            if nc not in exc:
+                nc.send(msg)
+
+    ###############
+    #    Loops    #
+    ###############
+
+    def send_heartbeats(self, now):
+        """
+        Takes the egress for the heartbeats sent until ``now`` (called before a command is sent). The beats of every
+        period, and the roles of every two periods, are sent right after the beat of the node.
+        """
+        period = self.config.participant["HEARTBEAT_PERIOD"]
+        beat_time, role_time = self.heartbeat_time
+        last = int(now // period)
+        k = self.__next_beat
+        while k <= last:
+            begin = k * period
+            # If the egress is free at a beat, it is free at the next ones (the heartbeats take less than a period)
+            if self.control_free_at <= begin and beat_time + role_time < period:
+                k = last
+                begin = k * period
+            self.control_free_at = max(self.control_free_at, begin) + beat_time + (role_time if k % 2 else 0)
+            k += 1
+        self.__next_beat = k
+
+    def __gossip_messages(self):
+        pending = self.gossiper.gossip_step()
+        if pending > 0:
+            self.simulation.loop.schedule(1 / self.config.participant["GOSSIP_MESSAGES_FREC"], self.__gossip_messages)
+        else:
+            self.__gossip_scheduled = False
+
+    ################
+    #    Rounds    #
+    ################
+
+    def start_learning(self):
+        self.round = 0
+        self.__train_step()
+
+    def __train_step(self):
+        self.train_set = [nc.get_name() for nc in self.neighbors] + [self.get_name()]
+        self.aggregator.set_nodes_to_aggregate(self.train_set)
+        self.__aggregated = False
+        self.__models_gossiped = False
+        self.__last_status = []
+        self.simulation.loop.schedule(self.simulation.train_time, self.__on_trained, self.round)
+
+    def __on_trained(self, round):
+        if self.round != round:
+            return
+        models_added = self.aggregator.add_model(self.model, [self.get_name()], self.weight)
+        if models_added is not None:
+            self.broadcast(CommunicationProtocol.build_models_aggregated_msg([self.get_name()]))
+        self.__gossip_models(round)
+
+    def __gossip_models(self, round):
+        """
+        One iteration of ``Node.__gossip_model`` (aggregation), every 1 / ``GOSSIP_MODELS_FREC`` seconds.
+        """
+        if self.round != round:
+            return
+        train_set_size = len(self.train_set)
+        nei = [nc for nc in self.neighbors if len(nc.get_models_aggregated()) < train_set_size]
+        if not nei:
+            self.__finish_gossip()
+            return
+
+        # Exit if the neighbors did not change in the last iterations
+        exit_rounds = self.config.participant["GOSSIP_EXIT_ON_X_EQUAL_ROUNDS"]
+        self.__last_status.append([(nc.get_name(), len(nc.get_models_aggregated())) for nc in nei])
+        self.__last_status = self.__last_status[-exit_rounds:]
+        if len(self.__last_status) == exit_rounds and all(s == self.__last_status[0] for s in self.__last_status):
+            self.__finish_gossip()
+            return
+
+        samples = min(self.config.participant["GOSSIP_MODELS_PER_ROUND"], len(nei))
+        for nc in self.simulation.rng.sample(nei, samples):
+            model, contributors, weight = self.aggregator.get_partial_aggregation(nc.get_models_aggregated())
+            if model is not None:
+                nc.send_params((model, contributors, weight))
+
+        # Sends block the loop until the models are transmitted
+        loop = self.simulation.loop
+        next_iteration = max(loop.now + 1 / self.config.participant["GOSSIP_MODELS_FREC"], self.tx_free_at)
+        loop.schedule_at(next_iteration, self.__gossip_models, round)
+
+    def __finish_gossip(self):
+        self.__models_gossiped = True
+        self.__check_round_finished()
+
+    def __check_round_finished(self):
+        if self.__models_gossiped and self.__aggregated:
+            self.__on_round_finished()
+
+    def __on_round_finished(self):
+        self.aggregator.clear()
+        self.round_ends.append((self.simulation.loop.now, self.model))
+        self.round = self.round + 1
+        for nc in self.neighbors:
+            nc.clear_models_aggregated()
+        if self.round < self.simulation.rounds:
+            self.__train_step()
+        else:
+            self.round = None
+            self.simulation.node_finished(self)
+
+    def add_model(self, params):
+        if self.round is None:
+            return
+        model, contributors, weight = params
+        models_added = self.aggregator.add_model(model, contributors, weight)
+        if models_added is not None:
+            self.broadcast(CommunicationProtocol.build_models_aggregated_msg(models_added))
+
+    ##################
+    #    Observer    #
+    ##################
+
+    def update(self, event, obj):
+        if event == Events.GOSSIP_BROADCAST_EVENT:
+            self.broadcast(obj[0], exc=obj[1])
+
+        elif event == Events.PROCESSED_MESSAGES_EVENT:
+            node, msgs = obj
+            for nc in self.neighbors:
+                if nc != node:
+                    nc.add_processed_messages(list(msgs.keys()))
+            self.gossiper.add_messages(list(msgs.values()), node)
+            if not self.__gossip_scheduled:
+                self.__gossip_scheduled = True
+                self.simulation.loop.schedule(0, self.__gossip_messages)
+
+        elif event == Events.PARAMS_RECEIVED_EVENT:
+            self.add_model(obj)
+
+        elif event == Events.AGGREGATION_FINISHED_EVENT:
+            if obj is not None:
+                self.model = obj
+                self.broadcast(CommunicationProtocol.build_models_ready_msg(self.round))
+            if self.aggregator.timed_out:
+                self.timeouts += 1
+            self.__aggregated = True
+            self.__check_round_finished()
+
+
+#########################
+#    NetworkSimulator   #
+#########################
+
+
+class NetworkSimulator:
+    """
+    Simulates the rounds of a federation with a virtual clock.
+
+    Args:
+        topology: Adjacency matrix of the nodes.
+        config (dict): Configuration of the participants (``participant.json.example`` if None).
+        rounds (int): Rounds of the federation.
+        model_size (int): Bytes of the encoded model.
+        train_time (float): Seconds of training of each round.
+        heartbeats (bool): Account the heartbeats (and roles) gossiped to every node: their messages and the egress
+            they take.
+        network (dict): Network arguments of some nodes (index -> network_args), applied over the configuration.
+        links (dict): Network arguments of some links ((index, index) -> network_args), applied over the node ones.
+        seed (int): Seed of the simulation.
+    """
+
+    def __init__(self, topology, config=None, rounds=10, model_size=1_000_000, train_time=10.0, heartbeats=True, network=None, links=None, seed=0):
+        if config is None:
+            with open(DEFAULT_CONFIG) as f:
+                config = json.load(f)
+        self.rounds = rounds
+        self.model_size = model_size
+        self.train_time = train_time
+        self.heartbeats = heartbeats
+        self.rng = random.Random(seed)
+        self.loop = EventLoop()
+        self.running = False
+        self.errors = 0
+        self.messages = {}
+        self.__finished = 0
+
+        network = network or {}
+        links = links or {}
+        n = len(topology)
+        self.nodes = []
+        for i in range(n):
+            participant = copy.deepcopy(config)
+            participant["network_args"].update(network.get(i, {}))
+            participant["device_args"]["idx"] = i
+            node_config = Config(entity="participant")
+            node_config.participant = participant
+            self.nodes.append(SimNode(self, i, node_config, self.rng.random()))
+
+        for i in range(n):
+            for j in range(i + 1, n):
+                if topology[i][j] or topology[j][i]:
+                    a, b = self.nodes[i], self.nodes[j]
+                    nc_a = SimConnection(a, b.get_addr(), self.__link(a, j, links))
+                    nc_b = SimConnection(b, a.get_addr(), self.__link(b, i, links))
+                    nc_a.peer, nc_b.peer = nc_b, nc_a
+                    a.add_neighbor(nc_a)
+                    b.add_neighbor(nc_b)
+        if heartbeats:
+            self.__plan_heartbeats()
+
+    def __plan_heartbeats(self):
+        """
+        Messages and egress time of the heartbeats of every node in a period: a node sends its beat to its neighbors
+        and forwards the beats of the other nodes of its component to its other neighbors (to the ones it did not
+        receive them from first, about (degree - 1) / degree of them on each link).
+        """
+        component = [None] * len(self.nodes)
+        for node in self.nodes:
+            if component[node.idx] is not None:
+                continue
+            members, stack = [node.idx], [node]
+            component[node.idx] = members
+            while stack:
+                for nc in stack.pop().neighbors:
+                    other = nc.peer.node
+                    if component[other.idx] is None:
+                        component[other.idx] = members
+                        members.append(other.idx)
+                        stack.append(other)
+        for node in self.nodes:
+            degree = len(node.neighbors)
+            if degree == 0:
+                continue
+            others = len(component[node.idx]) - 1
+            # Size of the messages with their hash (the names of the nodes have the same length)
+            beat_size = len(CommunicationProtocol.BEAT + " " + node.get_name()) + HASH_SIZE + 2
+            role_size = len(CommunicationProtocol.ROLE + " " + node.get_name() + " " + node.config.participant["device_args"]["role"]) + HASH_SIZE + 2
+            per_link = 1 + others * (degree - 1) / degree
+            seconds_per_byte = sum(8 / nc.link.rate for nc in node.neighbors)
+            node.heartbeat_messages = degree + others * (degree - 1)
+            node.heartbeat_sizes = (beat_size, role_size)
+            node.heartbeat_time = (per_link * beat_size * seconds_per_byte, per_link * role_size * seconds_per_byte)
+
+    def __count_heartbeats(self):
+        period = self.nodes[0].config.participant["HEARTBEAT_PERIOD"] if self.nodes else 1
+        beats = int(self.loop.now // period) + 1  # From time 0, while the nodes are running
+        roles = beats // 2
+        for node in self.nodes:
+            if node.heartbeat_messages == 0:
+                continue
+            beat_size, role_size = node.heartbeat_sizes
+            self.count_message_type(CommunicationProtocol.BEAT, beat_size * node.heartbeat_messages * beats, node.heartbeat_messages * beats)
+            self.count_message_type(CommunicationProtocol.ROLE, role_size * node.heartbeat_messages * roles, node.heartbeat_messages * roles)
+
+    @staticmethod
+    def __link(node, other, links):
+        network_args = dict(node.config.participant["network_args"])
+        network_args.update(links.get((node.idx, other), {}))
+        return Link.from_network_args(network_args)
+
+    def count_message(self, data, size):
+        self.count_message_type(message_type(data), size)
+
+    def count_message_type(self, message, size, count=1):
+        stats = self.messages.get(message)
+        if stats is None:
+            stats = self.messages[message] = {"count": 0, "bytes": 0}
+        stats["count"] += count
+        stats["bytes"] += size
+
+    def node_finished(self, node):
+        self.__finished += 1
+        if self.__finished == len(self.nodes):
+            self.running = False
+            self.loop.stop()
+
+    def run(self, until=None):
+        """
+        Runs the federation until every node finished the rounds (or the virtual time ``until``).
+
+        Returns:
+            dict: Report of the simulation.
+        """
+        begin = time.perf_counter()
+        self.running = True
+        for node in self.nodes:
+            node.start_learning()
+        self.loop.run(until)
+        self.running = False
+        if self.heartbeats:
+            self.__count_heartbeats()
+        return self.report(time.perf_counter() - begin)
+
+    def report(self, wall_time=None):
+        """
+        Returns:
+            dict: Virtual and wall time, events, messages and bytes sent, finish time and model spread of each round.
+        """
+        rounds = []
+        for r in range(self.rounds):
+            ends = [node.round_ends[r] for node in self.nodes if len(node.round_ends) > r]
+            if len(ends) < len(self.nodes):
+                break
+            times = [t for t, _ in ends]
+            models = [m for _, m in ends]
+            rounds.append({
+                "round": r,
+                "first": min(times),
+                "last": max(times),
+                "mean": sum(times) / len(times),
+                "spread": max(models) - min(models),
+            })
+        return {
+            "nodes": len(self.nodes),
+            "rounds_finished": len(rounds),
+            "virtual_time": self.loop.now,
+            "wall_time": wall_time,
+            "events": self.loop.events,
+            "convergence_time": rounds[-1]["last"] if len(rounds) == self.rounds else None,
+            "bytes": sum(stats["bytes"] for stats in self.messages.values()),
+            "messages": self.messages,
+            "aggregation_timeouts": sum(node.timeouts for node in self.nodes),
+            "errors": self.errors,
+            "rounds": rounds,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Discrete-event simulation of the communication of a federation")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="Participant configuration (network_args and protocol parameters)")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--topology", choices=["ring", "random", "fully"], default="random")
+    parser.add_argument("--degree", type=int, default=4, help="Neighbors per node (random topology)")
+    parser.add_argument("--model-size", type=int, default=1_000_000, help="Bytes of the encoded model")
+    parser.add_argument("--train-time", type=float, default=10.0, help="Seconds of training per round")
+    parser.add_argument("--no-heartbeats", action="store_true", help="Do not account the heartbeats (gossiped to every node)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    if args.topology == "ring":
+        topology = ring_topology(args.nodes)
+    elif args.topology == "random":
+        topology = random_topology(args.nodes, args.degree, args.seed)
+    else:
+        topology = [[int(i != j) for j in range(args.nodes)] for i in range(args.nodes)]
+
+    logging.basicConfig(level=logging.WARNING)
+    simulator = NetworkSimulator(topology, config, rounds=args.rounds, model_size=args.model_size, train_time=args.train_time, heartbeats=not args.no_heartbeats, seed=args.seed)
+    print(json.dumps(simulator.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
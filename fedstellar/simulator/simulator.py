@@ -0,0 +1,130 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+In-process simulator: runs the participants of a scenario as ``Node`` instances inside a small pool of worker processes.
+
+Each worker builds its nodes once (torch, Lightning and the datasets are imported and loaded once per worker,
+and the datasets are loaded in the parent before forking so the workers share them). Nodes of the same worker
+are connected through an ``InMemoryTransport``, nodes of different workers through TCP as usual.
+"""
+import glob
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import torch
+
+from fedstellar.config.config import Config
+from fedstellar.node_start import DATA_DIR, build_data, build_node
+from fedstellar.simulator.transport import InMemoryTransport
+
+
+def participant_files(config_dir):
+    """
+    Returns:
+        list: Configuration files of the participants of a scenario, sorted by index.
+    """
+    files = glob.glob(os.path.join(config_dir, "participant_*.json"))
+    return sorted(files, key=lambda f: int(os.path.splitext(os.path.basename(f))[0].split("_")[-1]))
+
+
+def run_worker(worker_id, config_files, barrier, torch_threads, data_dir=DATA_DIR):
+    """
+    Builds, connects and runs the nodes of a worker.
+
+    Args:
+        worker_id: Index of the worker.
+        config_files: Configuration files of the participants of the worker.
+        barrier: Barrier shared by the workers (all the nodes listen before connecting, and are connected before the learning starts).
+        torch_threads: Intra-op threads of torch in the worker.
+        data_dir: Directory of the datasets.
+    """
+    torch.set_num_threads(torch_threads)
+    configs = [Config(entity="participant", participant_config_file=f) for f in config_files]
+
+    # One console for the worker, the nodes add their own log files (filtered by thread)
+    level = logging.DEBUG if configs[0].participant["scenario_args"]["debug"] else logging.WARNING
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter("[%(levelname)s] - %(asctime)s - %(threadName)s\n%(message)s"))
+    logging.basicConfig(level=level, handlers=[console_handler], force=True)
+
+    transport = InMemoryTransport()
+    nodes = [build_node(config, transport=transport, num_workers=0, data_dir=data_dir) for config in configs]
+    for node in nodes:
+        node.start()
+    logging.info("[Simulator] Worker {} started {} nodes".format(worker_id, len(nodes)))
+    barrier.wait()
+
+    # Nodes of this worker are connected in memory, the rest through TCP
+    for node, config in zip(nodes, configs):
+        for neighbor in config.participant["network_args"]["neighbors"].split():
+            h, p = neighbor.split(":")
+            node.connect_to(h, int(p), full=False)
+    barrier.wait()
+
+    for node, config in zip(nodes, configs):
+        if config.participant["device_args"]["start"]:
+            node.set_start_learning(rounds=config.participant["scenario_args"]["rounds"], epochs=config.participant["training_args"]["epochs"])
+
+    for node in nodes:
+        node.join()
+
+
+class Simulator:
+    """
+    Runs all the participants of a scenario in a pool of worker processes.
+
+    Args:
+        config_dir: Directory with the configuration files of the participants (participant_<idx>.json).
+        workers: Number of worker processes (None to use up to 4, one per core).
+        data_dir: Directory of the datasets.
+    """
+
+    def __init__(self, config_dir, workers=None, data_dir=DATA_DIR):
+        self.config_dir = config_dir
+        self.data_dir = data_dir
+        self.config_files = participant_files(config_dir)
+        if not self.config_files:
+            raise ValueError("No participant files found in {}".format(config_dir))
+        cores = os.cpu_count() or 1
+        self.workers = min(workers or min(4, cores), len(self.config_files))
+        self.torch_threads = max(cores // self.workers, 1)
+
+    def partition_nodes(self):
+        """
+        Returns:
+            list: Configuration files of each worker (contiguous indices, neighbors in most topologies).
+        """
+        size = math.ceil(len(self.config_files) / self.workers)
+        return [self.config_files[i:i + size] for i in range(0, len(self.config_files), size)]
+
+    def run(self):
+        """
+        Starts the workers and waits for them.
+        """
+        groups = self.partition_nodes()
+        logging.info("[Simulator] Running {} nodes in {} workers".format(len(self.config_files), len(groups)))
+
+        # Load the dataset before forking, the workers share it
+        build_data(Config(entity="participant", participant_config_file=self.config_files[0]), num_workers=0, data_dir=self.data_dir)
+
+        context = multiprocessing.get_context("fork" if sys.platform == "linux" else "spawn")
+        barrier = context.Barrier(len(groups))
+        processes = [
+            context.Process(target=run_worker, args=(i, group, barrier, self.torch_threads, self.data_dir), name="simulator-worker-{}".format(i))
+            for i, group in enumerate(groups)
+        ]
+        begin = time.time()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        logging.info("[Simulator] Workers finished after {:.1f} seconds".format(time.time() - begin))
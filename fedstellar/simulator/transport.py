@@ -0,0 +1,180 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+In-memory transport between the nodes that share a process.
+
+Connections keep the contract of ``NodeConnection`` (send, send_params, stop and the notifications to the node),
+but messages are delivered to a queue of the other side instead of a socket. Model parameters are delivered
+as a single reference to the encoded buffer, without fragmentation or copies.
+"""
+import logging
+import queue
+import threading
+
+from fedstellar.node_connection import NodeConnection
+from fedstellar.utils.observer import Events
+
+
+class _Params:
+    """
+    Encoded model parameters delivered to a connection (shared by reference).
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+##############################
+#    InMemoryConnection     #
+##############################
+
+
+class InMemoryConnection(NodeConnection):
+    """
+    Connection with a node of the same process.
+
+    Args:
+        parent_node_name: Name of the node that owns the connection.
+        addr: Address of the other node.
+        config: Configuration of the node that owns the connection.
+    """
+
+    def __init__(self, parent_node_name, addr, config=None):
+        NodeConnection.__init__(self, parent_node_name, None, addr, None, config=config)
+        self.daemon = True
+        self.peer = None
+        self.__inbox = queue.SimpleQueue()
+
+    def deliver(self, msg):
+        """
+        Puts a message in the inbox of the connection (called by the other side).
+        """
+        self.__inbox.put(msg)
+
+    def run(self):
+        """
+        Connection loop. Process the messages delivered by the other side.
+        """
+        timeout = self.config.participant["NODE_TIMEOUT"]
+        while not self._terminate_flag.is_set():
+            try:
+                msg = self.__inbox.get(timeout=timeout)
+            except queue.Empty:
+                logging.info("[NODE_CONNECTION] (InMemoryConnection Loop) Timeout")
+                break
+            if msg is None:
+                continue
+
+            try:
+                if isinstance(msg, _Params):
+                    self.instrumentation.count_message("received", b"PARAMS", len(msg.data))
+                    self.notify_params(msg.data)
+                    continue
+
+                self.instrumentation.count_message("received", msg)
+                with self.instrumentation.timer("process_message"):
+                    exec_msgs, error = self.comm_protocol.process_message(msg)
+                if len(exec_msgs) > 0:
+                    self.notify(Events.PROCESSED_MESSAGES_EVENT, (self, exec_msgs))
+                if error:
+                    logging.info("[NODE_CONNECTION] An error happened. Last error: {}".format(msg))
+                    break
+            except Exception as e:
+                logging.info("[NODE_CONNECTION] (InMemoryConnection Loop) Exception: {}".format(str(e)))
+                break
+
+        # Down Connection (the other side is closed too, as with a socket)
+        self._terminate_flag.set()
+        logging.info("[NODE_CONNECTION] Closed connection: {}".format(self.get_name()))
+        self.notify(Events.END_CONNECTION_EVENT, self)
+        if self.peer is not None:
+            self.peer.close()
+
+    def close(self):
+        """
+        Closes the connection without sending any message.
+        """
+        self._terminate_flag.set()
+        self.__inbox.put(None)
+
+    def stop(self, local=False):
+        super().stop(local)
+        self.__inbox.put(None)
+
+    def send(self, data):
+        if self._terminate_flag.is_set() or self.peer is None:
+            return False
+        self.peer.deliver(data)
+        self.instrumentation.count_message("sent", data)
+        return True
+
+    def send_params(self, data):
+        if self._terminate_flag.is_set() or self.peer is None:
+            return False
+        self.peer.deliver(_Params(data))
+        self.instrumentation.count_message("sent", b"PARAMS", len(data))
+        return True
+
+
+###########################
+#    InMemoryTransport    #
+###########################
+
+
+class InMemoryTransport:
+    """
+    Registry of the nodes of a process. Connections between registered nodes are made in memory, the nodes
+    keep using TCP for the rest (e.g. nodes of other processes).
+    """
+
+    def __init__(self):
+        self.__nodes = {}
+        self.__lock = threading.Lock()
+
+    def register(self, node):
+        with self.__lock:
+            self.__nodes[node.get_addr()] = node
+
+    def unregister(self, node):
+        with self.__lock:
+            self.__nodes.pop(node.get_addr(), None)
+
+    def is_local(self, h, p):
+        """
+        Returns:
+            bool: True if the node (h, p) is registered in this transport.
+        """
+        with self.__lock:
+            return (h, p) in self.__nodes
+
+    def connect(self, node, h, p, full=False, force=False):
+        """
+        Connects a node with the node (h, p) of the same process.
+
+        Args:
+            node: Node that requests the connection.
+            h: Host of the other node.
+            p: Port of the other node.
+            full: If True, the other node will broadcast the connection to its neighbors.
+            force: If True, the connection will be kept even though it should not be.
+
+        Returns:
+            InMemoryConnection: Connection of ``node`` (not started) or None if it was rejected.
+        """
+        with self.__lock:
+            other = self.__nodes.get((h, p))
+        if other is None:
+            return None
+
+        nc = InMemoryConnection(node.get_name(), (h, p), config=node.config)
+        other_nc = InMemoryConnection(other.get_name(), node.get_addr(), config=other.config)
+        nc.peer, other_nc.peer = other_nc, nc
+        if not other.accept_connection(other_nc, full, force):
+            return None
+        return nc
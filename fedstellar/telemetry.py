@@ -0,0 +1,166 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+
+import psutil
+
+# Threads whose CPU usage is reported, grouped by the prefix of their name
+THREAD_GROUPS = ["learning_thread", "gossiper", "node_connection", "heartbeater", "aggregator"]
+
+
+###########################
+#    TelemetrySampler     #
+###########################
+
+
+class TelemetrySampler(threading.Thread):
+    """
+    Thread based sampler of the resources used by the host and by the node process.
+
+    Probes (psutil process, NVML handles) are initialized once. Every ``TELEMETRY_PERIOD`` seconds a sample is
+    taken and logged with a single ``log_metrics`` call. Network counters are reported as rates (per second)
+    and the CPU usage of the learning, gossip and connection threads of the process is reported per group.
+    Slow probes (disk usage, temperatures) are only refreshed every ``slow_probes_every`` samples.
+
+    Args:
+        node_name (str): Name of the node.
+        logger: Logger of the learner.
+        config (Config): Configuration of the node.
+        slow_probes_every (int): Number of samples between refreshes of the slow probes.
+    """
+
+    def __init__(self, node_name, logger, config, slow_probes_every=10):
+        threading.Thread.__init__(self, name="telemetry-" + node_name, daemon=True)
+        self.logger = logger
+        self.config = config
+        self.__period = config.participant.get("TELEMETRY_PERIOD", 2 * config.participant["HEARTBEAT_PERIOD"])
+        self.__slow_probes_every = slow_probes_every
+        self.__terminate_flag = threading.Event()
+        self.__start_time = datetime.strptime(config.participant["scenario_args"]["start_time"], "%d/%m/%Y %H:%M:%S")
+        self.__samples = 0
+        self.__slow_metrics = {}
+        # Last sample, reported to the controller with the status of the node
+        self.last_metrics = {}
+
+        # Probes
+        self.__process = psutil.Process()
+        self.__boot_time = psutil.boot_time()
+        self.__gpus = self.__init_gpus()
+        # First calls of the CPU counters only set the reference for the next ones
+        psutil.cpu_percent(interval=None)
+        self.__process.cpu_percent(interval=None)
+        self.__last_time = time.monotonic()
+        self.__last_net = psutil.net_io_counters()
+        self.__last_threads = self.__thread_times()
+
+    @staticmethod
+    def __init_gpus():
+        try:
+            import pynvml
+            pynvml.nvmlInit()
+            return pynvml, [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+        except Exception:
+            # pynvml not installed or no NVIDIA driver
+            return None, []
+
+    def __thread_times(self):
+        try:
+            return {t.id: t.user_time + t.system_time for t in self.__process.threads()}
+        except (psutil.Error, NotImplementedError):
+            return {}
+
+    def run(self):
+        while not self.__terminate_flag.wait(self.__period):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error("[TelemetrySampler] Error sampling resources: {}".format(e))
+        pynvml, _ = self.__gpus
+        if pynvml is not None:
+            try:
+                pynvml.nvmlShutdown()
+            except Exception:
+                pass
+
+    def stop(self):
+        """
+        Stop the sampler.
+        """
+        self.__terminate_flag.set()
+
+    def sample(self):
+        """
+        Take a sample of the resources and log it.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.__last_time, 1e-6)
+        self.__last_time = now
+        metrics = {}
+
+        # Host
+        metrics["Resources/CPU_percent"] = psutil.cpu_percent(interval=None)
+        metrics["Resources/RAM_percent"] = psutil.virtual_memory().percent
+        metrics["Resources/Uptime"] = time.time() - self.__boot_time
+        if self.__samples % self.__slow_probes_every == 0:
+            self.__slow_metrics = self.__slow_probes()
+        metrics.update(self.__slow_metrics)
+        self.__samples += 1
+
+        # Network rates
+        net = psutil.net_io_counters()
+        last = self.__last_net
+        self.__last_net = net
+        metrics["Resources/Bytes_sent_per_s"] = (net.bytes_sent - last.bytes_sent) / elapsed
+        metrics["Resources/Bytes_recv_per_s"] = (net.bytes_recv - last.bytes_recv) / elapsed
+        metrics["Resources/Packets_sent_per_s"] = (net.packets_sent - last.packets_sent) / elapsed
+        metrics["Resources/Packets_recv_per_s"] = (net.packets_recv - last.packets_recv) / elapsed
+
+        # Process
+        with self.__process.oneshot():
+            metrics["Resources/Process_CPU_percent"] = self.__process.cpu_percent(interval=None)
+            metrics["Resources/Process_RSS_MB"] = self.__process.memory_info().rss / (1024 * 1024)
+            metrics["Resources/Process_threads"] = self.__process.num_threads()
+
+        # CPU of the threads of the node, grouped by role
+        thread_times = self.__thread_times()
+        names = {t.native_id: t.name for t in threading.enumerate() if t.native_id is not None}
+        groups = {group: 0.0 for group in THREAD_GROUPS}
+        for tid, cpu_time in thread_times.items():
+            group = names.get(tid, "").split("-")[0]
+            if group in groups:
+                groups[group] += cpu_time - self.__last_threads.get(tid, cpu_time)
+        self.__last_threads = thread_times
+        for group, cpu_time in groups.items():
+            metrics[f"Resources/Thread_{group}_CPU_percent"] = 100 * cpu_time / elapsed
+
+        # GPUs
+        pynvml, handles = self.__gpus
+        for i, handle in enumerate(handles):
+            try:
+                gpu_mem = pynvml.nvmlDeviceGetMemoryInfo(handle)
+                metrics[f"Resources/GPU{i}_percent"] = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+                metrics[f"Resources/GPU{i}_temp"] = pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
+                metrics[f"Resources/GPU{i}_mem_percent"] = gpu_mem.used / gpu_mem.total * 100
+            except Exception:
+                pass
+
+        step = int((datetime.now() - self.__start_time).total_seconds())
+        self.logger.log_metrics(metrics, step=step)
+        self.last_metrics = metrics
+        return metrics
+
+    @staticmethod
+    def __slow_probes():
+        metrics = {"Resources/Disk_percent": psutil.disk_usage("/").percent, "Resources/CPU_temp": 0}
+        try:
+            if sys.platform == "linux":
+                metrics["Resources/CPU_temp"] = psutil.sensors_temperatures()['coretemp'][0].current
+        except Exception:
+            pass
+        return metrics
@@ -0,0 +1,266 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Module that implements the per-round instrumentation of the nodes.
+
+Components of a node (learner, aggregator, connections, gossiper) get the instrumentation of their node with
+``get_instrumentation(node_name)``. When the instrumentation is disabled (or the node did not register one) they
+get ``NULL_INSTRUMENTATION``, whose methods do nothing, so the hot paths keep the same cost.
+"""
+import json
+import logging
+import threading
+import time
+
+# Header of the binary (params) messages, see CommunicationProtocol.PARAMS
+PARAMS_HEADER = b"PARAMS"
+
+
+def message_type(data):
+    """
+    Args:
+        data: Encoded message (or fragment of a params message).
+
+    Returns:
+        str: Command of the message (e.g. BEAT, PARAMS).
+    """
+    if data.startswith(PARAMS_HEADER):
+        return "PARAMS"
+    end = data.find(b" ", 0, 32)
+    if end <= 0:
+        return "UNKNOWN"
+    return data[:end].decode("utf-8", errors="replace")
+
+
+class _Timer:
+    """
+    Context manager that adds the time spent inside it to a phase of the instrumentation.
+    """
+
+    __slots__ = ("instrumentation", "phase", "begin")
+
+    def __init__(self, instrumentation, phase):
+        self.instrumentation = instrumentation
+        self.phase = phase
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add_duration(self.phase, time.perf_counter() - self.begin)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+#########################
+#    Instrumentation    #
+#########################
+
+
+class Instrumentation:
+    """
+    Collects the durations of the phases of a round, the messages (count and bytes per type) sent and received,
+    the maximum depth of the queues and other values (e.g. models aggregated) of a node.
+
+    At the end of each round, a record is appended as a JSON line to ``path`` and logged through ``logger``.
+
+    Args:
+        node_name (str): Name of the node.
+        path (str): JSON lines file of the records (None to not write them).
+        logger: Logger of the learner (None to not log them).
+    """
+
+    enabled = True
+
+    def __init__(self, node_name, path=None, logger=None):
+        self.node_name = node_name
+        self.path = path
+        self.logger = logger
+        self.__lock = threading.Lock()
+        self.__round_begin = time.time()
+        self.__reset()
+
+    def __reset(self):
+        self.__phases = {}
+        self.__messages = {"sent": {}, "received": {}}
+        self.__queues = {}
+        self.__values = {}
+
+    def timer(self, phase):
+        """
+        Args:
+            phase (str): Name of the phase.
+
+        Returns:
+            Context manager that measures the phase.
+        """
+        return _Timer(self, phase)
+
+    def add_duration(self, phase, seconds):
+        with self.__lock:
+            stats = self.__phases.get(phase)
+            if stats is None:
+                self.__phases[phase] = {"total": seconds, "count": 1, "max": seconds}
+            else:
+                stats["total"] += seconds
+                stats["count"] += 1
+                if seconds > stats["max"]:
+                    stats["max"] = seconds
+
+    def count_message(self, direction, data, size=None):
+        """
+        Args:
+            direction (str): "sent" or "received".
+            data: Message (its type is taken from the plain message).
+            size (int): Bytes in the wire (the length of data if None).
+        """
+        msg_type = message_type(data)
+        size = len(data) if size is None else size
+        with self.__lock:
+            stats = self.__messages[direction].setdefault(msg_type, {"count": 0, "bytes": 0})
+            stats["count"] += 1
+            stats["bytes"] += size
+
+    def gauge(self, queue, depth):
+        """
+        Keeps the maximum depth of a queue during the round.
+        """
+        with self.__lock:
+            if depth > self.__queues.get(queue, -1):
+                self.__queues[queue] = depth
+
+    def set_value(self, name, value):
+        with self.__lock:
+            self.__values[name] = value
+
+    def start_round(self):
+        """
+        Marks the beginning of a round (the records measure the time since the last start or end of a round).
+        """
+        with self.__lock:
+            self.__round_begin = time.time()
+
+    def end_round(self, round):
+        """
+        Builds the record of the round, writes and logs it and resets the counters.
+
+        Args:
+            round (int): Round finished.
+
+        Returns:
+            dict: Record of the round.
+        """
+        now = time.time()
+        with self.__lock:
+            record = {
+                "node": self.node_name,
+                "round": round,
+                "timestamp": now,
+                "duration": now - self.__round_begin,
+                "phases": self.__phases,
+                "messages": self.__messages,
+                "queues": self.__queues,
+                "values": self.__values,
+            }
+            self.__round_begin = now
+            self.__reset()
+
+        if self.path is not None:
+            try:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logging.error("[Instrumentation] Error writing the record of round {}: {}".format(round, e))
+        if self.logger is not None:
+            self.logger.log_metrics(self.flatten(record), step=round)
+        return record
+
+    @staticmethod
+    def flatten(record):
+        """
+        Returns:
+            dict: Scalars of a record, named as the metrics of the logger.
+        """
+        metrics = {"Instrumentation/Round_duration": record["duration"]}
+        for phase, stats in record["phases"].items():
+            metrics[f"Instrumentation/Time_{phase}"] = stats["total"]
+        for direction, types in record["messages"].items():
+            metrics[f"Instrumentation/Bytes_{direction}"] = sum(stats["bytes"] for stats in types.values())
+            for msg_type, stats in types.items():
+                metrics[f"Instrumentation/Bytes_{direction}_{msg_type}"] = stats["bytes"]
+        for queue, depth in record["queues"].items():
+            metrics[f"Instrumentation/Queue_{queue}"] = depth
+        for name, value in record["values"].items():
+            metrics[f"Instrumentation/{name}"] = value
+        return metrics
+
+
+class NullInstrumentation:
+    """
+    Instrumentation that does nothing (used when it is disabled).
+    """
+
+    enabled = False
+
+    def timer(self, phase):
+        return _NULL_TIMER
+
+    def add_duration(self, phase, seconds):
+        pass
+
+    def count_message(self, direction, data, size=None):
+        pass
+
+    def gauge(self, queue, depth):
+        pass
+
+    def set_value(self, name, value):
+        pass
+
+    def start_round(self):
+        pass
+
+    def end_round(self, round):
+        return None
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+_instrumentations = {}
+
+
+def register_instrumentation(node_name, instrumentation):
+    """
+    Makes the instrumentation of a node available to its components.
+    """
+    _instrumentations[node_name] = instrumentation
+
+
+def unregister_instrumentation(node_name):
+    _instrumentations.pop(node_name, None)
+
+
+def get_instrumentation(node_name):
+    """
+    Returns:
+        Instrumentation of the node or NULL_INSTRUMENTATION if it has none.
+    """
+    return _instrumentations.get(node_name, NULL_INSTRUMENTATION)
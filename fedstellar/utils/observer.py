@@ -130,10 +130,12 @@ class Observable:
             event: The event to notify.
             obj: The object to pass to the observer. For each event, the object is different (check it at the ``Event`` class).
         """
-        if len(str(obj)) > 300:
-            logging.debug("[OBSERVABLE.notify] Observable: {} | Notifying event: ".format(self) + str(event) + " | Transmitted Obj: " + "Too long [...]" + " --> to observers: " + str(self.__observers))
-        else:
-            logging.debug("[OBSERVABLE.notify] Observable: {} | Notifying event: ".format(self) + str(event) + " | Transmitted Obj: " + str(obj) + " --> to observers: " + str(self.__observers))
+        # The messages are only built if they are going to be logged (notify is called for every message)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            if len(str(obj)) > 300:
+                logging.debug("[OBSERVABLE.notify] Observable: {} | Notifying event: ".format(self) + str(event) + " | Transmitted Obj: " + "Too long [...]" + " --> to observers: " + str(self.__observers))
+            else:
+                logging.debug("[OBSERVABLE.notify] Observable: {} | Notifying event: ".format(self) + str(event) + " | Transmitted Obj: " + str(obj) + " --> to observers: " + str(self.__observers))
         [o.update(event, obj) for o in self.__observers]
 
 
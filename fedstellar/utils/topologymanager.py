@@ -1,29 +1,176 @@
 import json
+import logging
 import random
 
-import matplotlib
-import matplotlib.pyplot as plt
-
-matplotlib.use('Agg')
-plt.switch_backend('Agg')
-
-import networkx as nx
 import numpy as np
 
 from fedstellar.role import Role
 
 
+###################
+#   Generators    #
+###################
+# Links are (rows, cols) arrays of node indexes, symmetric topologies contain both directions of every link
+
+
+def _both_directions(i, j):
+    keep = i != j
+    i, j = i[keep], j[keep]
+    return np.concatenate([i, j]), np.concatenate([j, i])
+
+
+def ring_links(n):
+    i = np.arange(n)
+    return _both_directions(i, (i + 1) % n)
+
+
+def lattice_links(n, k):
+    """
+    Every node linked to its ``k // 2`` nearest nodes on each side (Watts-Strogatz without rewiring).
+    """
+    i = np.repeat(np.arange(n), k // 2)
+    offsets = np.tile(np.arange(1, k // 2 + 1), n)
+    return _both_directions(i, (i + offsets) % n)
+
+
+def _connected(n, rows, cols):
+    # Every node takes the lowest label of its neighbors until nothing changes (rounds grow with the diameter)
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, rows, labels[cols])
+        np.minimum.at(new, cols, labels[rows])
+        if np.array_equal(new, labels):
+            return bool((labels == 0).all())
+        labels = new
+
+
+def _repair_pairs(a, b, n, rng, max_rounds=1000):
+    """
+    Replaces the self-loops and duplicated links of a pairing by switching them with random links,
+    ``(a, b), (c, d) -> (a, c), (b, d)`` (the degrees do not change).
+
+    Returns:
+        bool: True if the pairing has no invalid links left.
+    """
+    for _ in range(max_rounds):
+        codes = np.minimum(a, b) * n + np.maximum(a, b)
+        _, first = np.unique(codes, return_index=True)
+        bad = a == b
+        duplicated = np.ones(a.size, dtype=bool)
+        duplicated[first] = False
+        bad_pairs = np.flatnonzero(bad | duplicated)
+        if bad_pairs.size == 0:
+            return True
+        for i, j in zip(bad_pairs, rng.integers(0, a.size, bad_pairs.size)):
+            if i != j:
+                a[i], b[i], a[j], b[j] = a[i], a[j], b[i], b[j]
+    return False
+
+
+def random_links(n, k, rng, attempts=100):
+    """
+    Connected random k-regular topology: configuration model (random pairing of ``k`` stubs per node) whose
+    self-loops and duplicated links are repaired with switches. If ``n * k`` is odd, one node has ``k - 1``
+    neighbors. With ``k <= 2``, a random cycle.
+    """
+    if n < 3:
+        return fully_connected_links(n)
+    k = min(max(k, 2), n - 1)
+    if k == n - 1:
+        return fully_connected_links(n)
+    if k == 2:
+        cycle = rng.permutation(n)
+        return _both_directions(cycle, np.roll(cycle, -1))
+    for _ in range(attempts):
+        stubs = np.repeat(np.arange(n), k)
+        if stubs.size % 2:
+            stubs = stubs[:-1]
+        rng.shuffle(stubs)
+        a, b = stubs[0::2].copy(), stubs[1::2].copy()
+        if _repair_pairs(a, b, n, rng) and _connected(n, a, b):
+            return _both_directions(a, b)
+    raise ValueError("Could not generate a connected {}-regular topology of {} nodes".format(k, n))
+
+
+def small_world_links(n, k, p, rng):
+    """
+    Watts-Strogatz topology: ``k`` nearest neighbors lattice whose links are rewired to a random node with
+    probability ``p``.
+    """
+    i = np.repeat(np.arange(n), k // 2)
+    j = (i + np.tile(np.arange(1, k // 2 + 1), n)) % n
+    rewired = rng.random(i.size) < p
+    j[rewired] = rng.integers(0, n, rewired.sum())
+    return _both_directions(i, j)
+
+
+def scale_free_links(n, m, rng):
+    """
+    Barabási-Albert topology: every new node is linked to ``m`` existing nodes chosen by degree.
+    """
+    m = max(1, min(m, n - 1))
+    # Every node appears in the targets once per link, sampling it is sampling by degree
+    targets = np.empty(2 * m * n, dtype=np.int64)
+    size = 0
+    rows, cols = [], []
+    for new in range(m, n):
+        if size == 0:
+            chosen = np.arange(m)
+        else:
+            # First m distinct candidates in the order they were sampled (np.unique sorts them)
+            candidates = targets[rng.integers(0, size, 4 * m)]
+            _, first = np.unique(candidates, return_index=True)
+            chosen = candidates[np.sort(first)][:m]
+            if chosen.size < m:
+                others = rng.permutation(new)
+                chosen = np.concatenate([chosen, others[~np.isin(others, chosen)][:m - chosen.size]])
+        rows.append(np.full(chosen.size, new))
+        cols.append(chosen)
+        targets[size:size + chosen.size] = chosen
+        targets[size + chosen.size:size + 2 * chosen.size] = new
+        size += 2 * chosen.size
+    if not rows:
+        return ring_links(n)
+    return _both_directions(np.concatenate(rows), np.concatenate(cols))
+
+
+def star_links(n, center=0):
+    others = np.delete(np.arange(n), center)
+    return _both_directions(np.full(others.size, center), others)
+
+
+def fully_connected_links(n):
+    return np.nonzero(~np.eye(n, dtype=bool))
+
+
+def links_to_csr(n, rows, cols):
+    """
+    Returns:
+        tuple: (indptr, indices) of the sparse adjacency (duplicated links and self-loops removed).
+    """
+    rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    keep = rows != cols
+    codes = np.unique(rows[keep] * n + cols[keep])
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes // n, minlength=n), out=indptr[1:])
+    return indptr, codes % n
+
+
 class TopologyManager:
+    # Larger topologies are not drawn (the layout and the rendering grow quadratically)
+    MAX_DRAWN_NODES = 200
+
     def __init__(
-            self, scenario_name=None, n_nodes=5, b_symmetric=True, undirected_neighbor_num=5, topology=None
+            self, scenario_name=None, n_nodes=5, b_symmetric=True, undirected_neighbor_num=5, topology=None, seed=None
     ):
         self.scenario_name = scenario_name
-        if topology is None:
-            topology = []
         self.n_nodes = n_nodes
         self.b_symmetric = b_symmetric
         self.undirected_neighbor_num = undirected_neighbor_num
-        self.topology = topology
+        self.rng = np.random.default_rng(seed)
+        # Adjacency stored sparse (CSR), the dense matrix is only built if it is requested
+        self.topology = topology if topology is not None else []
         # Inicialize nodes with array of tuples (0,0,0) with size n_nodes
         self.nodes = np.zeros((n_nodes, 3), dtype=np.int32)
 
@@ -34,19 +181,74 @@ class TopologyManager:
         if self.undirected_neighbor_num >= self.n_nodes - 1 and self.b_symmetric:
             self.b_fully_connected = True
 
+    @property
+    def topology(self):
+        """
+        Dense adjacency matrix (float32), built from the sparse one on first access.
+        """
+        if self.__dense is None:
+            dense = np.zeros((self.n_nodes, self.n_nodes), dtype=np.float32)
+            dense[np.repeat(np.arange(self.n_nodes), np.diff(self.indptr)), self.indices] = 1
+            self.__dense = dense
+        return self.__dense
+
+    @topology.setter
+    def topology(self, matrix):
+        matrix = np.asarray(matrix)
+        if matrix.size == 0:
+            self.set_links([], [])
+        else:
+            self.set_links(*np.nonzero(matrix))
+
+    def set_links(self, rows, cols):
+        """
+        Sets the topology from its links.
+
+        Args:
+            rows: Source node of every link.
+            cols: Target node of every link.
+        """
+        self.indptr, self.indices = links_to_csr(self.n_nodes, rows, cols)
+        self.__dense = None
+
+    def get_links(self):
+        """
+        Returns:
+            tuple: (rows, cols) arrays of the links.
+        """
+        return np.repeat(np.arange(self.n_nodes), np.diff(self.indptr)), self.indices
+
     def __getstate__(self):
         # Return the attributes of the class that should be serialized
-        return {'scenario_name': self.scenario_name, 'n_nodes': self.n_nodes, 'topology': self.topology, 'nodes': self.nodes}
+        return {'scenario_name': self.scenario_name, 'n_nodes': self.n_nodes, 'links': self.get_links(), 'nodes': self.nodes}
 
     def __setstate__(self, state):
         # Set the attributes of the class from the serialized state
         self.scenario_name = state['scenario_name']
         self.n_nodes = state['n_nodes']
-        self.topology = state['topology']
+        if 'links' in state:
+            self.set_links(*state['links'])
+        else:
+            self.topology = state['topology']
         self.nodes = state['nodes']
 
     def draw_graph(self, plot=False, path=None):
-        g = nx.from_numpy_array(self.topology)
+        """
+        Returns:
+            bool: True if the topology was drawn, False if it has too many nodes (nothing is written).
+        """
+        if self.n_nodes > self.MAX_DRAWN_NODES:
+            logging.info("Topology of {} nodes not drawn (more than {})".format(self.n_nodes, self.MAX_DRAWN_NODES))
+            return False
+        # The plotting stack is only imported to draw (not by the controller and the nodes generating topologies)
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import networkx as nx
+
+        g = nx.Graph()
+        g.add_nodes_from(range(self.n_nodes))
+        g.add_edges_from(zip(*[a.tolist() for a in self.get_links()]))
         # pos = nx.layout.spectral_layout(g)
         # pos = nx.spring_layout(g, pos=pos, iterations=50)
         pos = nx.spring_layout(g, k=0.15, iterations=20, seed=42)
@@ -107,6 +309,9 @@ class TopologyManager:
         # plt.gcf().canvas.draw()
         if plot:
             plt.show()
+        else:
+            plt.close(fig)  # The figure is reused by name, otherwise every drawing is added to the previous ones
+        return True
 
     def generate_topology(self):
         if self.b_fully_connected:
@@ -119,24 +324,26 @@ class TopologyManager:
             self.__randomly_pick_neighbors_asymmetric()
 
     def generate_server_topology(self):
-        self.topology = np.zeros((self.n_nodes, self.n_nodes), dtype=np.float32)
-        self.topology[0, :] = 1
-        self.topology[:, 0] = 1
-        np.fill_diagonal(self.topology, 0)
+        self.set_links(*star_links(self.n_nodes))
 
     def generate_ring_topology(self, increase_convergence=False):
         self.__ring_topology(increase_convergence=increase_convergence)
 
+    def generate_small_world_topology(self, probability=0.1):
+        self.set_links(*small_world_links(self.n_nodes, max(2, int(self.undirected_neighbor_num)), probability, self.rng))
+
+    def generate_scale_free_topology(self):
+        self.set_links(*scale_free_links(self.n_nodes, max(1, int(self.undirected_neighbor_num) // 2), self.rng))
+
     def generate_custom_topology(self, topology):
         self.topology = topology
 
-    # TODO: fix this
     def get_matrix_adjacency_from_neighbors(self, neighbors):
+        # matrix[i, j] = 1 if i is a neighbor of j
+        lengths = [len(n) for n in neighbors]
         matrix_adjacency = np.zeros((self.n_nodes, self.n_nodes), dtype=np.float32)
-        for i in range(self.n_nodes):
-            for j in range(self.n_nodes):
-                if i in neighbors[j]:
-                    matrix_adjacency[i, j] = 1
+        if sum(lengths):
+            matrix_adjacency[np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbors]), np.repeat(np.arange(len(neighbors)), lengths)] = 1
         return matrix_adjacency
 
     def get_topology(self):
@@ -186,136 +393,40 @@ class TopologyManager:
 
     # Get neighbors of a node
     def get_neighbors(self, node_idx):
-        neighbors_index = []
-        neighbors_data = []
-        for i in range(self.n_nodes):
-            if self.topology[node_idx][i] == 1:
-                neighbors_index.append(i)
-                neighbors_data.append(self.nodes[i])
-
+        neighbors_index = self.indices[self.indptr[node_idx]:self.indptr[node_idx + 1]].tolist()
+        neighbors_data = [self.nodes[i] for i in neighbors_index]
         return neighbors_index, neighbors_data
 
     def get_neighbors_string(self, node_idx):
-        neighbors_index = []
-        neighbors_data = []
-        for i in range(self.n_nodes):
-            print(node_idx, i)
-            if self.topology[node_idx][i] == 1:
-                neighbors_index.append(i)
-                neighbors_data.append(self.nodes[i])
-        neighbors_data_string = ""
-        for i in neighbors_data:
-            neighbors_data_string += str(i[0]) + ":" + str(i[1])
-            if neighbors_data[-1] != i:
-                neighbors_data_string += " "
-        return neighbors_data_string
+        _, neighbors_data = self.get_neighbors(node_idx)
+        return " ".join(str(i[0]) + ":" + str(i[1]) for i in neighbors_data)
 
     def __ring_topology(self, increase_convergence=False):
-        topology_ring = np.array(
-            nx.to_numpy_matrix(nx.watts_strogatz_graph(self.n_nodes, 2, 0)), dtype=np.float32
-        )
-
+        rows, cols = ring_links(self.n_nodes)
         if increase_convergence:
-            # Create random links between nodes in topology_ring
-            for i in range(self.n_nodes):
-                for j in range(self.n_nodes):
-                    if topology_ring[i][j] == 0:
-                        if random.random() < 0.1:
-                            topology_ring[i][j] = 1
-                            topology_ring[j][i] = 1
-
-        np.fill_diagonal(topology_ring, 0)
-        self.topology = topology_ring
+            # Random links between about 10% of the pairs of nodes
+            pairs = self.n_nodes * (self.n_nodes - 1) // 2
+            extra = self.rng.binomial(pairs, 0.1) if pairs else 0
+            r, c = _both_directions(self.rng.integers(0, self.n_nodes, extra), self.rng.integers(0, self.n_nodes, extra))
+            rows, cols = np.concatenate([rows, r]), np.concatenate([cols, c])
+        self.set_links(rows, cols)
 
     def __randomly_pick_neighbors_symmetric(self):
-        # First generate a ring topology
-        topology_ring = np.array(
-            nx.to_numpy_matrix(nx.watts_strogatz_graph(self.n_nodes, 2, 0)), dtype=np.float32
-        )
-
-        np.fill_diagonal(topology_ring, 0)
-
-        # After, randomly add some links for each node (symmetric)
-        # If undericted_neighbor_num is X, then each node has X links to other nodes
-        k = int(self.undirected_neighbor_num)
-        topology_random_link = np.array(
-            nx.to_numpy_matrix(nx.watts_strogatz_graph(self.n_nodes, k, 0)), dtype=np.float32
-        )
-
-        # generate symmetric topology
-        topology_symmetric = topology_ring.copy()
-        for i in range(self.n_nodes):
-            for j in range(self.n_nodes):
-                if topology_symmetric[i][j] == 0 and topology_random_link[i][j] == 1:
-                    topology_symmetric[i][j] = topology_random_link[i][j]
-
-        np.fill_diagonal(topology_symmetric, 0)
-
-        self.topology = topology_symmetric
+        # Connected random topology where each node has undirected_neighbor_num neighbors
+        self.set_links(*random_links(self.n_nodes, int(self.undirected_neighbor_num), self.rng))
 
     def __randomly_pick_neighbors_asymmetric(self):
-        # randomly add some links for each node (symmetric)
-        k = self.undirected_neighbor_num
-        topology_random_link = np.array(
-            nx.to_numpy_matrix(nx.watts_strogatz_graph(self.n_nodes, k, 0)), dtype=np.float32
-        )
-
-        np.fill_diagonal(topology_random_link, 0)
-
-        # first generate a ring topology
-        topology_ring = np.array(
-            nx.to_numpy_matrix(nx.watts_strogatz_graph(self.n_nodes, 2, 0)), dtype=np.float32
-        )
-
-        np.fill_diagonal(topology_ring, 0)
-
-        for i in range(self.n_nodes):
-            for j in range(self.n_nodes):
-                if topology_ring[i][j] == 0 and topology_random_link[i][j] == 1:
-                    topology_ring[i][j] = topology_random_link[i][j]
-
-        np.fill_diagonal(topology_ring, 0)
-
-        # randomly delete some links
-        out_link_set = set()
-        for i in range(self.n_nodes):
-            len_row_zero = 0
-            for j in range(self.n_nodes):
-                if topology_ring[i][j] == 0:
-                    len_row_zero += 1
-            random_selection = np.random.randint(2, size=len_row_zero)
-            index_of_zero = 0
-            for j in range(self.n_nodes):
-                out_link = j * self.n_nodes + i
-                if topology_ring[i][j] == 0:
-                    if (
-                            random_selection[index_of_zero] == 1
-                            and out_link not in out_link_set
-                    ):
-                        topology_ring[i][j] = 1
-                        out_link_set.add(i * self.n_nodes + j)
-                    index_of_zero += 1
-
-        np.fill_diagonal(topology_ring, 0)
-
-        self.topology = topology_ring
+        # Random regular topology, then every missing link is added with probability 0.5 in a single direction
+        self.set_links(*random_links(self.n_nodes, int(self.undirected_neighbor_num), self.rng))
+        topology = self.topology.astype(bool)
+        added = ~topology & (self.rng.random((self.n_nodes, self.n_nodes)) < 0.5)
+        np.fill_diagonal(added, False)
+        # If both directions are picked, only the one from the lower index is kept
+        added &= ~np.tril(added.T, -1)
+        self.set_links(*np.nonzero(topology | added))
 
     def __fully_connected(self):
-        topology_fully_connected = np.array(
-            nx.to_numpy_matrix(nx.watts_strogatz_graph(self.n_nodes, self.n_nodes - 1, 0)),
-            dtype=np.float32,
-        )
-
-        np.fill_diagonal(topology_fully_connected, 0)
-
-        for i in range(self.n_nodes):
-            for j in range(self.n_nodes):
-                if topology_fully_connected[i][j] != 1:
-                    topology_fully_connected[i][j] = 1
-
-        np.fill_diagonal(topology_fully_connected, 0)
-
-        self.topology = topology_fully_connected
+        self.set_links(*fully_connected_links(self.n_nodes))
 
     @staticmethod
     def update_topology_3d_json(participants, path):
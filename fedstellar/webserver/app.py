@@ -1,8 +1,10 @@
 import argparse
+import copy
 import datetime
 import hashlib
 import json
 import os
+import queue
 import shutil
 import signal
 import sys
@@ -11,16 +13,19 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # Add the path two directories up to the system path
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 
-from ansi2html import Ansi2HTMLConverter
-
 from fedstellar.controller import Controller
+from fedstellar.reporter import BASE_HEADER, DELTA_HEADER, SEQUENCE_HEADER, merge_status
 
-from flask import Flask, session, url_for, redirect, render_template, request, abort, flash, send_file, make_response, jsonify, Response
+from flask import Flask, session, url_for, redirect, render_template, request, abort, flash, send_file, make_response, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from fedstellar.webserver.database import list_users, verify, delete_user_from_db, add_user, scenario_update_record, scenario_set_all_status_to_finished, get_running_scenario, get_user_info, get_scenario_by_name, list_nodes_by_scenario_name, get_all_scenarios, remove_nodes_by_scenario_name, \
     remove_scenario_by_name, scenario_set_status_to_finished
 from fedstellar.webserver.database import read_note_from_db, write_note_into_db, delete_note_from_db, match_user_id_with_note_id
-from fedstellar.webserver.database import image_upload_record, list_images_for_user, match_user_id_with_image_uid, delete_image_from_db, get_image_file_name, update_node_record, list_nodes
+from fedstellar.webserver.database import image_upload_record, list_images_for_user, match_user_id_with_image_uid, delete_image_from_db, get_image_file_name, list_nodes
+from fedstellar.webserver.state import NodeStateStore
+from fedstellar.webserver.events import MonitoringStream
+from fedstellar.webserver.logtail import LogTailer
+from fedstellar.webserver.topology import TopologyRenderer
 
 app = Flask(__name__)
 app.config.from_object('config')
@@ -29,10 +34,17 @@ app.config['config_dir'] = os.environ.get('FEDSTELLAR_CONFIG_DIR')
 app.config['python_path'] = os.environ.get('FEDSTELLAR_PYTHON_PATH')
 app.config['statistics_port'] = os.environ.get('FEDSTELLAR_STATISTICS_PORT')
 
+# Status reported by the nodes (written to disk in the background)
+node_states = NodeStateStore(app.config['config_dir'], flush_interval=app.config['NODE_STATE_FLUSH_INTERVAL'])
+topology_renderer = TopologyRenderer(app.config['config_dir'], debounce=app.config['TOPOLOGY_RENDER_DEBOUNCE'])
+log_tailer = LogTailer()
+monitoring_stream = MonitoringStream(node_states)
+
 
 # Detect CTRL+C from parent process
 def signal_handler(signal, frame):
     print('You pressed Ctrl+C [webserver]!')
+    node_states.flush()
     scenario_set_all_status_to_finished()
     # remove_all_nodes()
     sys.exit(0)
@@ -294,7 +306,7 @@ def fedstellar_scenario_monitoring(scenario_name):
     if "user" in session.keys():
         scenario = get_scenario_by_name(scenario_name)
         if scenario:
-            nodes_list = list_nodes_by_scenario_name(scenario_name)
+            nodes_list = node_states.nodes(scenario_name)
             if nodes_list:
                 # Get json data from each node configuration file
                 nodes_config = []
@@ -302,8 +314,7 @@ def fedstellar_scenario_monitoring(scenario_name):
                 nodes_status = []
                 nodes_offline = []
                 for i, node in enumerate(nodes_list):
-                    with open(os.path.join(app.config['config_dir'], scenario_name, f'participant_{node[1]}.json')) as f:
-                        nodes_config.append(json.load(f))
+                    nodes_config.append(node_states.get_config(scenario_name, node[1]))
                     if datetime.datetime.now() - datetime.datetime.strptime(node[8], "%Y-%m-%d %H:%M:%S.%f") > datetime.timedelta(seconds=20):
                         nodes_status.append(False)
                         nodes_offline.append(node[2] + ':' + str(node[3]))
@@ -331,12 +342,8 @@ def fedstellar_scenario_monitoring(scenario_name):
                 # print(nodes_list)
                 # print(nodes_config)
                 # print("--------------------------------------------------------------------------------")
-                if os.path.exists(os.path.join(app.config['config_dir'], scenario_name, 'topology.png')):
-                    if os.path.getmtime(os.path.join(app.config['config_dir'], scenario_name, 'topology.png')) < max([os.path.getmtime(os.path.join(app.config['config_dir'], scenario_name, f'participant_{node[1]}.json')) for node in nodes_list]):
-                        # Update the 3D topology and image
-                        update_topology(scenario[0], nodes_list, nodes_config)
-                else:
-                    update_topology(scenario[0], nodes_list, nodes_config)
+                # The image is rendered in the background when the topology changes
+                topology_renderer.update(scenario[0], nodes_list, nodes_config)
 
                 if request.path == "/scenario/" + scenario_name + "/monitoring":
                     return render_template("monitoring.html", scenario_name=scenario_name, scenario=scenario, nodes=nodes_table)
@@ -364,23 +371,28 @@ def fedstellar_scenario_monitoring(scenario_name):
         return abort(401)
 
 
-def update_topology(scenario_name, nodes_list, nodes_config):
-    print("Updating topology (3D and image)... Num. nodes: " + str(len(nodes_config)))
-    import numpy as np
-    nodes = []
-    for node in nodes_list:
-        nodes.append(node[2] + ':' + str(node[3]))
-    matrix = np.zeros((len(nodes), len(nodes)))
-    for node in nodes_list:
-        for neighbour in node[5].split(" "):
-            if neighbour != '':
-                matrix[nodes.index(node[2] + ':' + str(node[3])), nodes.index(neighbour)] = 1
-    from fedstellar.utils.topologymanager import TopologyManager
-    tm = TopologyManager(n_nodes=len(nodes_list), topology=matrix, scenario_name=scenario_name)
-    tm.update_nodes(nodes_config)
-    tm.draw_graph(path=os.path.join(app.config['config_dir'], scenario_name, f'topology.png'))  # TODO: Improve this
+@app.route("/api/scenario/<scenario_name>/monitoring/stream", methods=["GET"])
+def fedstellar_scenario_monitoring_stream(scenario_name):
+    # Server-sent events: snapshot of the nodes of the scenario, then the nodes that change (status, round, resources)
+    if "user" in session.keys():
+        events = monitoring_stream.subscribe(scenario_name)
 
-    # tm.update_topology_3d_json(participants=nodes_config, path=os.path.join(app.config['config_dir'], f'topology.json'))
+        def stream():
+            try:
+                yield "retry: 2000\n\n"
+                deadline = datetime.datetime.now() + datetime.timedelta(seconds=app.config['MONITORING_STREAM_DURATION'])
+                # Streams are closed periodically (the browser reconnects), so they do not hold a thread forever
+                while datetime.datetime.now() < deadline and monitoring_stream.subscribed(scenario_name, events):
+                    try:
+                        yield events.get(timeout=app.config['MONITORING_STREAM_KEEPALIVE'])
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+            finally:
+                monitoring_stream.unsubscribe(scenario_name, events)
+
+        return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    else:
+        return abort(401)
 
 
 @app.route("/scenario/<scenario_name>/node/update", methods=['POST'])
@@ -390,16 +402,27 @@ def fedstellar_update_node(scenario_name):
         if request.is_json:
             config = request.get_json()
             timestamp = datetime.datetime.now()
-            # Update file in the local directory
-            with open(os.path.join(app.config['config_dir'], scenario_name, f'participant_{config["device_args"]["idx"]}.json'), "w") as f:
-                json.dump(config, f, sort_keys=False, indent=2)
-
-            # Update the node in database
-            update_node_record(str(config['device_args']['uid']), str(config['device_args']['idx']), str(config['network_args']['ip']), str(config['network_args']['port']), str(config['device_args']['role']), str(config['network_args']['neighbors']), str(config['geo_args']['latitude']),
-                               str(config['geo_args']['longitude']),
-                               str(timestamp), str(config['scenario_args']['federation']), str(config['scenario_args']['name']))
-
-            return make_response("Node updated successfully", 200)
+            sequence = request.headers.get(SEQUENCE_HEADER)
+            idx = config["device_args"]["idx"]
+            if request.headers.get(DELTA_HEADER):
+                # Only the changed fields are received, merge them with the status they were computed from (the last
+                # one written, readable by every worker, or one received by this worker)
+                last_config = node_states.get_reported(scenario_name, idx, request.headers[DELTA_HEADER])
+                if last_config is None:
+                    # The node will send its full status in the next report
+                    return make_response("Unknown node status, full status required", 409)
+                config = merge_status(copy.deepcopy(last_config), config)
+
+            # The file and the database are updated in the background
+            node_states.update(scenario_name, config, timestamp, sequence=sequence)
+            monitoring_stream.notify()
+
+            response = make_response("Node updated successfully", 200)
+            # Base of the next deltas of the node
+            written = node_states.written_sequence(scenario_name, idx)
+            if written is not None:
+                response.headers[BASE_HEADER] = written
+            return response
         else:
             return abort(400)
 
@@ -458,17 +481,8 @@ def fedstellar_monitoring_log_x(scenario_name, id, number):
         # Send file (is not a json file) with the log
         logs = os.path.join(app.config['log_dir'], scenario_name, f'participant_{id}.log')
         if os.path.exists(logs):
-            # Open file maintaining the file format (for example, new lines)
-            with open(logs, 'r') as f:
-                # Read the last n lines of the file
-                lines = f.readlines()[-int(number):]
-                # Join the lines in a single string
-                lines = ''.join(lines)
-                # Convert the ANSI escape codes to HTML
-                converter = Ansi2HTMLConverter()
-                html_text = converter.convert(lines, full=False)
-                # Return the string
-                return Response(html_text, mimetype='text/plain')
+            # Only the end of the file is read, the HTML is cached until the log changes
+            return Response(log_tailer.last_lines(logs, int(number)), mimetype='text/plain')
         else:
             return Response("No logs available", mimetype='text/plain')
 
@@ -476,6 +490,20 @@ def fedstellar_monitoring_log_x(scenario_name, id, number):
         make_response("You are not authorized to access this page.", 401)
 
 
+@app.route("/api/scenario/<scenario_name>/node/<id>/infolog/tail", methods=["GET"])
+def fedstellar_monitoring_log_tail(scenario_name, id):
+    # Lines written since the cursor of the previous request (the last ``lines`` lines if there is no cursor)
+    if "user" in session.keys():
+        logs = os.path.join(app.config['log_dir'], scenario_name, f'participant_{id}.log')
+        if os.path.exists(logs):
+            cursor = request.args.get('cursor', type=int)
+            return jsonify(log_tailer.read(logs, cursor, lines=request.args.get('lines', 10, type=int))), 200
+        else:
+            return jsonify({'html': 'No logs available', 'cursor': None, 'reset': True}), 200
+    else:
+        return abort(401)
+
+
 @app.route("/scenario/<scenario_name>/node/<id>/debuglog", methods=["GET"])
 def fedstellar_monitoring_log_debug(scenario_name, id):
     if "user" in session.keys():
@@ -512,6 +540,17 @@ def fedstellar_monitoring_image(scenario_name):
         make_response("You are not authorized to access this page.", 401)
 
 
+@app.route("/api/scenario/<scenario_name>/topology", methods=["GET"])
+def fedstellar_monitoring_topology(scenario_name):
+    if "user" in session.keys():
+        snapshot = topology_renderer.snapshot(scenario_name)
+        if snapshot is None:
+            return abort(404)
+        return jsonify(snapshot), 200
+    else:
+        return abort(401)
+
+
 def stop_scenario(scenario_name):
     from fedstellar.controller import Controller
     Controller.killdockers()
@@ -540,6 +579,8 @@ def fedstellar_stop_scenario(scenario_name):
 
 
 def remove_scenario(scenario_name=None):
+    node_states.forget(scenario_name)
+    topology_renderer.forget(scenario_name)
     remove_nodes_by_scenario_name(scenario_name)
     remove_scenario_by_name(scenario_name)
     Controller.remove_files_by_scenario(scenario_name)
@@ -630,6 +671,9 @@ def fedstellar_scenario_deployment_run():
                 "topology": data["topology"],
                 "simulation": data["simulation"],
                 "docker": data["docker"],
+                "launcher": data.get("launcher", "cmd"),
+                "workers": data.get("workers"),
+                "launcher_concurrency": data.get("launcher_concurrency"),
                 "env": None,
                 "webserver": True,
                 "webport": request.host.split(":")[1] if ":" in request.host else 80,  # Get the port of the webserver, if not specified, use 80
@@ -665,6 +709,7 @@ def fedstellar_scenario_deployment_run():
                 # The following parameters have to be same for all nodes (for now)
                 participant_config["scenario_args"]["rounds"] = int(data["rounds"])
                 participant_config["data_args"]["dataset"] = data["dataset"]
+                participant_config["data_args"]["partition"] = data.get("partition", participant_config["data_args"].get("partition", "contiguous"))
                 participant_config["model_args"]["model"] = data["model"]
                 participant_config["training_args"]["epochs"] = int(data["epochs"])
                 participant_config["device_args"]["accelerator"] = data["accelerator"]  # same for all nodes
@@ -3,4 +3,8 @@ DEBUG = True
 UPLOAD_FOLDER = "images"
 LOG_FOLDER_WEBSERVER = "logs"
 CONFIG_FOLDER_WEBSERVER = "config"
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024
\ No newline at end of file
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+NODE_STATE_FLUSH_INTERVAL = 5  # Seconds between writes of the status reported by the nodes
+TOPOLOGY_RENDER_DEBOUNCE = 2  # Minimum seconds between two renders of the topology of a scenario
+MONITORING_STREAM_DURATION = 300  # Seconds before a monitoring stream is closed (the browser reconnects)
+MONITORING_STREAM_KEEPALIVE = 15  # Seconds between keep-alive comments of an idle monitoring stream
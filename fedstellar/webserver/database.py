@@ -1,6 +1,8 @@
 import sqlite3
 import hashlib
 import datetime
+import os
+import threading
 
 user_db_file_location = "database_file/users.db"
 note_db_file_location = "database_file/notes.db"
@@ -8,83 +10,142 @@ image_db_file_location = "database_file/images.db"
 node_db_file_location = "database_file/nodes.db"
 scenario_db_file_location = "database_file/scenarios.db"
 
+"""
+    Connections
+"""
+
+# Tables and indexes of every database (created if they do not exist)
+SCHEMAS = {
+    user_db_file_location: [
+        "CREATE TABLE IF NOT EXISTS users (user text primary key, password text, role text)",
+    ],
+    note_db_file_location: [
+        "CREATE TABLE IF NOT EXISTS notes (user text, timestamp text, note text, note_id text)",
+        "CREATE INDEX IF NOT EXISTS notes_user ON notes (user)",
+    ],
+    image_db_file_location: [
+        "CREATE TABLE IF NOT EXISTS images (uid text unique, owner text, name text, timestamp text)",
+    ],
+    node_db_file_location: [
+        "CREATE TABLE IF NOT EXISTS nodes (uid text unique, idx text, ip text, port text, role text, neighbors text, latitude text, longitude text, timestamp text, federation text, scenario text)",
+        # Target of the node upserts, also serves the queries by scenario
+        "CREATE UNIQUE INDEX IF NOT EXISTS nodes_scenario_uid ON nodes (scenario, uid)",
+        # Last statuses of every node written, the bases of its status deltas in every worker
+        "CREATE TABLE IF NOT EXISTS node_status (scenario text, idx text, sequence text, config text)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS node_status_scenario_idx_sequence ON node_status (scenario, idx, sequence)",
+    ],
+    scenario_db_file_location: [
+        "CREATE TABLE IF NOT EXISTS scenarios (name text unique, start_time text, end_time text, title text, description text, status text, network_subnet text)",
+        "CREATE INDEX IF NOT EXISTS scenarios_status ON scenarios (status)",
+    ],
+}
+
+# Columns accepted to sort the listings (ORDER BY can not be a parameter)
+NODE_COLUMNS = ("uid", "idx", "ip", "port", "role", "neighbors", "latitude", "longitude", "timestamp", "federation", "scenario")
+SCENARIO_COLUMNS = ("name", "start_time", "end_time", "title", "description", "status", "network_subnet")
+
+_local = threading.local()
+_schemas_lock = threading.Lock()
+_schemas_ready = set()
+
+
+def _connection(path):
+    """
+    Returns the connection of the calling thread to a database, opened on first use (one per thread and process,
+    gunicorn workers are forked). Statements are parameterized, so sqlite3 reuses their compiled form.
+
+    Args:
+        path: Location of the database.
+
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=10, cached_statements=256)
+        # WAL: readers do not block the writer (and the other way around)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=10000")
+        _ensure_schema(conn, path)
+        connections[path] = conn
+    return conn
+
+
+def _ensure_schema(conn, path):
+    with _schemas_lock:
+        if (os.getpid(), path) in _schemas_ready:
+            return
+        with conn:
+            for statement in SCHEMAS.get(path, []):
+                conn.execute(statement)
+        _schemas_ready.add((os.getpid(), path))
+
+
+def _fetchall(path, query, params=()):
+    return _connection(path).execute(query, params).fetchall()
+
+
+def _fetchone(path, query, params=()):
+    return _connection(path).execute(query, params).fetchone()
+
+
+def _write(path, query, params=()):
+    conn = _connection(path)
+    with conn:  # Transaction, committed (or rolled back) at the end
+        conn.execute(query, params)
+
+
+def close_connections():
+    """
+    Closes the connections of the calling thread.
+    """
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
 """
     User Management
 """
 
 
 def list_users(all_info=False):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
-    result = _c.execute("SELECT * FROM users")
-    result = result.fetchall()
+    result = _fetchall(user_db_file_location, "SELECT * FROM users")
 
     if not all_info:
         result = [user[0] for user in result]
 
-    _conn.close()
-
     return result
 
 
 def get_user_info(user):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
-
-    command = f"SELECT * FROM users WHERE user = '{user}'"
-    _c.execute(command)
-    result = _c.fetchone()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    return _fetchone(user_db_file_location, "SELECT * FROM users WHERE user = ?", (user,))
 
 
 def verify(user, password):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
-
-    _c.execute("SELECT password FROM users WHERE user = '" + user + "';")
-    result = _c.fetchone()[0] == hashlib.sha256(password.encode()).hexdigest()
-
-    _conn.close()
-
-    return result
+    result = _fetchone(user_db_file_location, "SELECT password FROM users WHERE user = ?", (user,))
+    return result[0] == hashlib.sha256(password.encode()).hexdigest()
 
 
 def delete_user_from_db(user):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
-    _c.execute("DELETE FROM users WHERE user = '" + user + "';")
-    _conn.commit()
-    _conn.close()
+    _write(user_db_file_location, "DELETE FROM users WHERE user = ?", (user,))
 
     # when we delete a user FROM database USERS, we also need to delete all his or her notes data FROM database NOTES
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-    _c.execute("DELETE FROM notes WHERE user = '" + user + "';")
-    _conn.commit()
-    _conn.close()
+    _write(note_db_file_location, "DELETE FROM notes WHERE user = ?", (user,))
 
-    # when we delete a user FROM database USERS, we also need to 
+    # when we delete a user FROM database USERS, we also need to
     # [1] delete all his or her images FROM image pool (done in app.py)
     # [2] delete all his or her images records FROM database IMAGES
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-    _c.execute("DELETE FROM images WHERE owner = '" + user + "';")
-    _conn.commit()
-    _conn.close()
+    _write(image_db_file_location, "DELETE FROM images WHERE owner = ?", (user,))
 
 
 def add_user(user, password, role):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
-
-    _c.execute("INSERT INTO users values(?, ?, ?)", (user.upper(), hashlib.sha256(password.encode()).hexdigest(), role))
-
-    _conn.commit()
-    _conn.close()
+    _write(user_db_file_location, "INSERT INTO users values(?, ?, ?)", (user.upper(), hashlib.sha256(password.encode()).hexdigest(), role))
 
 
 """
@@ -93,54 +154,21 @@ def add_user(user, password, role):
 
 
 def read_note_from_db(id):
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT note_id, timestamp, note FROM notes WHERE user = '" + id.upper() + "';"
-    _c.execute(command)
-    result = _c.fetchall()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    return _fetchall(note_db_file_location, "SELECT note_id, timestamp, note FROM notes WHERE user = ?", (id.upper(),))
 
 
 def match_user_id_with_note_id(note_id):
     # Given the note id, confirm if the current user is the owner of the note which is being operated.
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT user FROM notes WHERE note_id = '" + note_id + "';"
-    _c.execute(command)
-    result = _c.fetchone()[0]
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    return _fetchone(note_db_file_location, "SELECT user FROM notes WHERE note_id = ?", (note_id,))[0]
 
 
 def write_note_into_db(id, note_to_write):
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
     current_timestamp = str(datetime.datetime.now())
-    _c.execute("INSERT INTO notes values(?, ?, ?, ?)", (id.upper(), current_timestamp, note_to_write, hashlib.sha1((id.upper() + current_timestamp).encode()).hexdigest()))
-
-    _conn.commit()
-    _conn.close()
+    _write(note_db_file_location, "INSERT INTO notes values(?, ?, ?, ?)", (id.upper(), current_timestamp, note_to_write, hashlib.sha1((id.upper() + current_timestamp).encode()).hexdigest()))
 
 
 def delete_note_from_db(note_id):
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
-    command = "DELETE FROM notes WHERE note_id = '" + note_id + "';"
-    _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(note_db_file_location, "DELETE FROM notes WHERE note_id = ?", (note_id,))
 
 
 """
@@ -149,151 +177,117 @@ def delete_note_from_db(note_id):
 
 
 def image_upload_record(uid, owner, image_name, timestamp):
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    _c.execute("INSERT INTO images VALUES (?, ?, ?, ?)", (uid, owner, image_name, timestamp))
-
-    _conn.commit()
-    _conn.close()
+    _write(image_db_file_location, "INSERT INTO images VALUES (?, ?, ?, ?)", (uid, owner, image_name, timestamp))
 
 
 # get uid and name from imagen where uid = image_uid
 # store the uid and name in a tuple
 def get_image_file_name(image_uid):
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT uid, name FROM images WHERE uid = '" + image_uid + "';"
-    _c.execute(command)
-    result = _c.fetchone()
-
-    _conn.commit()
-    _conn.close()
-
+    result = _fetchone(image_db_file_location, "SELECT uid, name FROM images WHERE uid = ?", (image_uid,))
     return result[0] + "-" + result[1]
 
 
 def list_images_for_user(owner):
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT uid, timestamp, name FROM images WHERE owner = '{0}'".format(owner)
-    _c.execute(command)
-    result = _c.fetchall()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    return _fetchall(image_db_file_location, "SELECT uid, timestamp, name FROM images WHERE owner = ?", (owner,))
 
 
 def match_user_id_with_image_uid(image_uid):
     # Given the note id, confirm if the current user is the owner of the note which is being operated.
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT owner FROM images WHERE uid = '" + image_uid + "';"
-    _c.execute(command)
-    result = _c.fetchone()[0]
-    print(result)
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    return _fetchone(image_db_file_location, "SELECT owner FROM images WHERE uid = ?", (image_uid,))[0]
 
 
 def delete_image_from_db(image_uid):
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    command = "DELETE FROM images WHERE uid = '" + image_uid + "';"
-    _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(image_db_file_location, "DELETE FROM images WHERE uid = ?", (image_uid,))
 
 
 """
     Nodes Management
 """
 
+# Insert the node or update it if it is already in the scenario (single statement, no previous SELECT)
+NODE_UPSERT = (
+    "INSERT INTO nodes (uid, idx, ip, port, role, neighbors, latitude, longitude, timestamp, federation, scenario) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (scenario, uid) DO UPDATE SET idx = excluded.idx, ip = excluded.ip, port = excluded.port, role = excluded.role, "
+    "neighbors = excluded.neighbors, latitude = excluded.latitude, longitude = excluded.longitude, timestamp = excluded.timestamp, "
+    "federation = excluded.federation"
+)
 
-def list_nodes(sort_by="idx"):
-    # list all nodes in the database
-    _conn = sqlite3.connect(node_db_file_location)
-    _c = _conn.cursor()
-    # Get all nodes and decently sort them by idx
-    command = "SELECT * FROM nodes ORDER BY " + sort_by + ";"
-    _c.execute(command)
-    result = _c.fetchall()
+NODE_STATUS_INSERT = "INSERT OR REPLACE INTO node_status (scenario, idx, sequence, config) VALUES (?, ?, ?, ?)"
+# Statuses kept by node: deltas computed from a status still apply when the next ones are written
+NODE_STATUS_KEPT = 8
+NODE_STATUS_PRUNE = (
+    "DELETE FROM node_status WHERE scenario = ?1 AND idx = ?2 AND rowid NOT IN "
+    "(SELECT rowid FROM node_status WHERE scenario = ?1 AND idx = ?2 ORDER BY rowid DESC LIMIT ?3)"
+)
 
-    _conn.commit()
-    _conn.close()
-
-    return result
 
-
-def list_nodes_by_scenario_name(scenario_name):
+def list_nodes(sort_by="idx"):
     # list all nodes in the database
-    _conn = sqlite3.connect(node_db_file_location)
-    _c = _conn.cursor()
+    if sort_by not in NODE_COLUMNS:
+        raise ValueError("Invalid sort column: {}".format(sort_by))
     # Get all nodes and decently sort them by idx
-    command = "SELECT * FROM nodes WHERE scenario = '" + scenario_name + "' ORDER BY idx;"
-    _c.execute(command)
-    result = _c.fetchall()
+    return _fetchall(node_db_file_location, "SELECT * FROM nodes ORDER BY " + sort_by)
 
-    _conn.commit()
-    _conn.close()
 
-    return result
+def list_nodes_by_scenario_name(scenario_name):
+    # Get all nodes of the scenario and decently sort them by idx
+    return _fetchall(node_db_file_location, "SELECT * FROM nodes WHERE scenario = ? ORDER BY idx", (scenario_name,))
 
 
 def update_node_record(node_uid, idx, ip, port, role, neighbors, latitude, longitude, timestamp, federation, scenario):
-    # Check if the node record with node_uid and scenario already exists in the database
-    # If it does, update the record
-    # If it does not, create a new record
-    _conn = sqlite3.connect(node_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT * FROM nodes WHERE uid = '" + node_uid + "' AND scenario = '" + scenario + "';"
-    _c.execute(command)
-    result = _c.fetchone()
-    print("Update Node Record Result:")
-    print(result)
-    if result is None:
-        # Create a new record
-        _c.execute("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (node_uid, idx, ip, port, role, neighbors, latitude, longitude, timestamp, federation, scenario))
-    else:
-        # Update the record
-        command = "UPDATE nodes SET idx = '" + idx + "', ip = '" + ip + "', port = '" + port + "', role = '" + role + "', neighbors = '" + neighbors + "', latitude = '" + latitude + "', longitude = '" + longitude + "', timestamp = '" + timestamp + "', federation = '" + federation + "' WHERE uid = '" + node_uid + "' AND scenario = '" + scenario + "';"
-        _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    # Create the node record with node_uid and scenario, or update it if it already exists
+    _write(node_db_file_location, NODE_UPSERT, (node_uid, idx, ip, port, role, neighbors, latitude, longitude, timestamp, federation, scenario))
+
+
+def update_node_records(records, newer_only=False, statuses=None):
+    """
+    Creates or updates several nodes in a single write transaction.
+
+    Args:
+        records: Iterable of (uid, idx, ip, port, role, neighbors, latitude, longitude, timestamp, federation, scenario).
+        newer_only: Skip the records older than the stored ones (by timestamp).
+        statuses: (sequence, JSON status) of every record, written with the records (None to skip a record).
+
+    Returns:
+        list: The records written.
+    """
+    records = list(records)
+    conn = _connection(node_db_file_location)
+    with conn:
+        if not newer_only:
+            conn.executemany(NODE_UPSERT, records)
+            written = records
+        else:
+            # Reports of a node may be received by different workers, the last one must win
+            written = [record for record in records if conn.execute(NODE_UPSERT + " WHERE excluded.timestamp > nodes.timestamp", record).rowcount]
+        if statuses is not None:
+            written_ids = set(map(id, written))
+            rows = [(record[10], record[1], status[0], status[1]) for record, status in zip(records, statuses) if status is not None and id(record) in written_ids]
+            conn.executemany(NODE_STATUS_INSERT, rows)
+            conn.executemany(NODE_STATUS_PRUNE, [(scenario, idx, NODE_STATUS_KEPT) for scenario, idx in {row[:2] for row in rows}])
+    return written
+
+
+def get_node_status(scenario_name, idx, sequence=None):
+    """
+    Returns:
+        tuple: (sequence, JSON status) of a status of the node written, the last one if ``sequence`` is None (None if
+        there is none).
+    """
+    if sequence is None:
+        return _fetchone(node_db_file_location, "SELECT sequence, config FROM node_status WHERE scenario = ? AND idx = ? ORDER BY rowid DESC LIMIT 1", (scenario_name, str(idx)))
+    return _fetchone(node_db_file_location, "SELECT sequence, config FROM node_status WHERE scenario = ? AND idx = ? AND sequence = ?", (scenario_name, str(idx), sequence))
 
 
 def remove_all_nodes():
-    _conn = sqlite3.connect(node_db_file_location)
-    _c = _conn.cursor()
-
-    command = "DELETE FROM nodes;"
-    _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(node_db_file_location, "DELETE FROM nodes")
+    _write(node_db_file_location, "DELETE FROM node_status")
 
 
 def remove_nodes_by_scenario_name(scenario_name):
-    _conn = sqlite3.connect(node_db_file_location)
-    _c = _conn.cursor()
-
-    command = "DELETE FROM nodes WHERE scenario = '" + scenario_name + "';"
-    _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(node_db_file_location, "DELETE FROM nodes WHERE scenario = ?", (scenario_name,))
+    _write(node_db_file_location, "DELETE FROM node_status WHERE scenario = ?", (scenario_name,))
 
 
 """
@@ -302,96 +296,40 @@ def remove_nodes_by_scenario_name(scenario_name):
 
 
 def get_all_scenarios(sort_by="start_time"):
-    _conn = sqlite3.connect(scenario_db_file_location)
-    _c = _conn.cursor()
-    command = "SELECT * FROM scenarios ORDER BY " + sort_by + ";"
-    _c.execute(command)
-    result = _c.fetchall()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    if sort_by not in SCENARIO_COLUMNS:
+        raise ValueError("Invalid sort column: {}".format(sort_by))
+    return _fetchall(scenario_db_file_location, "SELECT * FROM scenarios ORDER BY " + sort_by)
 
 
 def scenario_update_record(scenario_name, start_time, end_time, title, description, status, network_subnet):
-    _conn = sqlite3.connect(scenario_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT * FROM scenarios WHERE name = '" + scenario_name + "';"
-    _c.execute(command)
-    result = _c.fetchone()
-
-    if result is None:
-        # Create a new record
-        _c.execute("INSERT INTO scenarios VALUES (?, ?, ?, ?, ?, ?, ?)", (scenario_name, start_time, end_time, title, description, status, network_subnet))
-    else:
-        # Update the record
-        command = "UPDATE scenarios SET start_time = '" + start_time + "', end_time = '" + end_time + "', title = '" + title + "', description = '" + description + "', status = '" + status + "', network_subnet = '" + network_subnet + "' WHERE name = '" + scenario_name + "';"
-        _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(
+        scenario_db_file_location,
+        "INSERT INTO scenarios (name, start_time, end_time, title, description, status, network_subnet) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET start_time = excluded.start_time, end_time = excluded.end_time, title = excluded.title, "
+        "description = excluded.description, status = excluded.status, network_subnet = excluded.network_subnet",
+        (scenario_name, start_time, end_time, title, description, status, network_subnet),
+    )
 
 
 def scenario_set_all_status_to_finished():
     # Set all scenarios to finished and update the end_time to current time
-    _conn = sqlite3.connect(scenario_db_file_location)
-    _c = _conn.cursor()
-
-    command = "UPDATE scenarios SET status = 'finished', end_time = '" + str(datetime.datetime.now()) + "';"
-    _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(scenario_db_file_location, "UPDATE scenarios SET status = 'finished', end_time = ?", (str(datetime.datetime.now()),))
 
 
 def scenario_set_status_to_finished(scenario_name):
-    _conn = sqlite3.connect(scenario_db_file_location)
-    _c = _conn.cursor()
-
-    command = "UPDATE scenarios SET status = 'finished', end_time = '" + str(datetime.datetime.now()) + "' WHERE name = '" + scenario_name + "';"
-    _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(scenario_db_file_location, "UPDATE scenarios SET status = 'finished', end_time = ? WHERE name = ?", (str(datetime.datetime.now()), scenario_name))
 
 
 def get_running_scenario():
-    _conn = sqlite3.connect(scenario_db_file_location)
-    _c = _conn.cursor()
-    command = "SELECT * FROM scenarios WHERE status = 'running';"
-    _c.execute(command)
-    result = _c.fetchone()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    return _fetchone(scenario_db_file_location, "SELECT * FROM scenarios WHERE status = 'running'")
 
 
 def get_scenario_by_name(scenario_name):
-    _conn = sqlite3.connect(scenario_db_file_location)
-    _c = _conn.cursor()
-    command = "SELECT * FROM scenarios WHERE name = '" + scenario_name + "';"
-    _c.execute(command)
-    result = _c.fetchone()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    return _fetchone(scenario_db_file_location, "SELECT * FROM scenarios WHERE name = ?", (scenario_name,))
 
 
 def remove_scenario_by_name(scenario_name):
-    _conn = sqlite3.connect(scenario_db_file_location)
-    _c = _conn.cursor()
-
-    command = "DELETE FROM scenarios WHERE name = '" + scenario_name + "';"
-    _c.execute(command)
-
-    _conn.commit()
-    _conn.close()
+    _write(scenario_db_file_location, "DELETE FROM scenarios WHERE name = ?", (scenario_name,))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Server-sent events of the monitoring of the scenarios.
+
+A single thread per worker builds the state of the scenarios with open streams from the node state store, when
+a report is received (a few reports received together are published at once) or every ``interval`` seconds (nodes
+going offline, reports received by other workers once written). Streams receive a snapshot of the scenario when
+they open and then only the nodes that changed, so the cost does not depend on the number of dashboards. The
+timestamp of the reports is not a change: a node that only reported again is sent when its online status flips.
+"""
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from fedstellar.webserver.state import TIMESTAMP_FORMAT
+
+# Nodes without reports for longer are shown offline
+NODE_OFFLINE_AFTER = datetime.timedelta(seconds=20)
+
+# Column of the timestamp of the last report in the rows of the nodes
+TIMESTAMP_COLUMN = 8
+
+
+def node_entry(row, config, now):
+    """
+    Returns:
+        dict: Row of the node in the monitoring table (with its online status) and its round and resources.
+    """
+    try:
+        online = now - datetime.datetime.strptime(row[TIMESTAMP_COLUMN], TIMESTAMP_FORMAT) <= NODE_OFFLINE_AFTER
+    except ValueError:
+        online = False
+    status = (config or {}).get("status_args", {})
+    return {
+        "row": list(row) + [online],
+        "round": status.get("round"),
+        "total_rounds": status.get("total_rounds"),
+        "resources": status.get("resources", {}),
+    }
+
+
+def entry_changed(entry, last):
+    """
+    Returns:
+        bool: True if the entry of a node differs from the last one published, besides the timestamp of its report.
+    """
+    if last is None:
+        return True
+    row, last_row = entry["row"], last["row"]
+    return (
+        row[:TIMESTAMP_COLUMN] != last_row[:TIMESTAMP_COLUMN]
+        or row[TIMESTAMP_COLUMN + 1:] != last_row[TIMESTAMP_COLUMN + 1:]
+        or any(entry[key] != last[key] for key in entry if key != "row")
+    )
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append("id: {}".format(event_id))
+    lines.append("event: {}".format(event))
+    lines.append("data: {}".format(json.dumps(data)))
+    return "\n".join(lines) + "\n\n"
+
+
+class MonitoringStream:
+    """
+    Args:
+        node_states: Node state store of the worker.
+        interval: Seconds between two updates of the scenarios without reports.
+        coalesce: Seconds waited after a report, so the reports received together are published at once.
+        queue_size: Events buffered by stream (slow streams are dropped and reconnect).
+    """
+
+    def __init__(self, node_states, interval=1, coalesce=0.25, queue_size=100):
+        self.node_states = node_states
+        self.interval = interval
+        self.coalesce = coalesce
+        self.queue_size = queue_size
+        self.__subscribers = {}  # Scenario: set of queues
+        self.__states = {}  # Scenario: last state published (uid: entry)
+        self.__sequence = 0
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__pid = None
+
+    def __start(self):
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            threading.Thread(target=self.__run, name="monitoring-stream", daemon=True).start()
+
+    def __state(self, scenario_name):
+        now = datetime.datetime.now()
+        return {
+            row[0]: node_entry(row, self.node_states.get_config(scenario_name, row[1]), now)
+            for row in self.node_states.nodes(scenario_name)
+        }
+
+    def subscribe(self, scenario_name):
+        """
+        Returns:
+            queue.Queue: Events of the scenario, starting with its snapshot.
+        """
+        events = queue.Queue(maxsize=self.queue_size)
+        state = self.__state(scenario_name)
+        with self.__lock:
+            self.__start()
+            # New streams of a scenario already streamed start from the state the others have
+            state = self.__states.setdefault(scenario_name, state)
+            self.__sequence += 1
+            events.put(format_event("snapshot", {"nodes": list(state.values())}, self.__sequence))
+            self.__subscribers.setdefault(scenario_name, set()).add(events)
+        return events
+
+    def unsubscribe(self, scenario_name, events):
+        with self.__lock:
+            subscribers = self.__subscribers.get(scenario_name)
+            if subscribers is not None:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self.__subscribers[scenario_name]
+                    self.__states.pop(scenario_name, None)
+
+    def subscribed(self, scenario_name, events):
+        with self.__lock:
+            return events in self.__subscribers.get(scenario_name, ())
+
+    def notify(self):
+        """
+        Wakes the publisher up (a node report has been received).
+        """
+        self.__wakeup.set()
+
+    def __run(self):
+        while True:
+            if self.__wakeup.wait(self.interval):
+                time.sleep(self.coalesce)
+            self.__wakeup.clear()
+            with self.__lock:
+                scenarios = list(self.__subscribers)
+            for scenario_name in scenarios:
+                try:
+                    self.publish(scenario_name)
+                except Exception as e:
+                    logging.error("[MonitoringStream] Error publishing the monitoring of {}: {}".format(scenario_name, e))
+
+    def publish(self, scenario_name):
+        """
+        Sends the nodes of the scenario that changed since the last event to its streams.
+        """
+        state = self.__state(scenario_name)
+        with self.__lock:
+            last = self.__states.get(scenario_name, {})
+            changed = [entry for uid, entry in state.items() if entry_changed(entry, last.get(uid))]
+            removed = [uid for uid in last if uid not in state]
+            if not changed and not removed:
+                return
+            self.__states[scenario_name] = state
+            self.__sequence += 1
+            event = format_event("delta", {"nodes": changed, "removed": removed}, self.__sequence)
+            for events in list(self.__subscribers.get(scenario_name, ())):
+                try:
+                    events.put_nowait(event)
+                except queue.Full:
+                    # The stream is dropped, the client reconnects and gets a new snapshot
+                    self.__subscribers[scenario_name].discard(events)
@@ -0,0 +1,130 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Incremental reading of the logs of the participants.
+
+The last lines are read seeking from the end of the file in blocks, and clients poll with the byte offset returned
+by the previous read (cursor), so the cost of a poll depends on the new content, not on the size of the log. Only
+complete lines are returned. The HTML of every chunk read (byte range of a file) is cached.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from ansi2html import Ansi2HTMLConverter
+
+BLOCK_SIZE = 64 * 1024
+
+
+def tail(path, lines, block_size=BLOCK_SIZE):
+    """
+    Args:
+        path: Log file.
+        lines: Number of lines.
+
+    Returns:
+        tuple: (start, end) byte offsets of the last complete lines of the file.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        position = end
+        found = 0
+        data = b""
+        complete = False
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+            if not complete:
+                # A line still being written is not returned
+                last = data.rfind(b"\n")
+                if last == -1:
+                    continue
+                complete = True
+                end = position + last + 1
+                data = data[:last + 1]
+            found = data.count(b"\n")
+            if found > lines:
+                break
+        if not complete:
+            return 0, 0
+        if found <= lines:
+            return 0, end
+        # Skip the newlines of the lines not returned
+        index = len(data)
+        for _ in range(lines + 1):
+            index = data.rfind(b"\n", 0, index)
+        return position + index + 1, end
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8', errors='replace')
+
+
+class LogTailer:
+    """
+    Args:
+        max_bytes: Maximum bytes returned by a read (clients further behind restart from the tail).
+        cache_size: Chunks whose HTML is cached.
+    """
+
+    def __init__(self, max_bytes=256 * 1024, cache_size=256):
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __html(self, path, inode, start, end, text=None):
+        if end <= start:
+            return ""
+        key = (path, inode, start, end)
+        with self.__lock:
+            if key in self.__cache:
+                self.__cache.move_to_end(key)
+                return self.__cache[key]
+        html = Ansi2HTMLConverter().convert(read_range(path, start, end) if text is None else text, full=False)
+        with self.__lock:
+            self.__cache[key] = html
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+        return html
+
+    def last_lines(self, path, lines):
+        """
+        Returns:
+            str: HTML of the last lines of the log.
+        """
+        start, end = tail(path, lines)
+        return self.__html(path, os.stat(path).st_ino, start, end)
+
+    def read(self, path, cursor=None, lines=10):
+        """
+        Reads the lines written since the cursor.
+
+        Args:
+            path: Log file.
+            cursor: Byte offset returned by the previous read (None for the first read).
+            lines: Lines returned by the first read (or if the cursor is not valid anymore).
+
+        Returns:
+            dict: HTML of the lines (``html``), next cursor (``cursor``) and whether the previous content must be
+            replaced (``reset``, the first read or the log was truncated or is too far ahead).
+        """
+        st = os.stat(path)
+        if cursor is None or cursor > st.st_size or st.st_size - cursor > self.max_bytes:
+            start, end = tail(path, lines)
+            return {"html": self.__html(path, st.st_ino, start, end), "cursor": end, "reset": True}
+        with open(path, 'rb') as f:
+            f.seek(cursor)
+            data = f.read(st.st_size - cursor)
+        end = cursor + data.rfind(b"\n") + 1
+        text = data[:end - cursor].decode('utf-8', errors='replace')
+        return {"html": self.__html(path, st.st_ino, cursor, end, text), "cursor": end, "reset": False}
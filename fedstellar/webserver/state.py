@@ -0,0 +1,229 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Write-behind store of the status reported by the nodes.
+
+The reports are kept in memory and acknowledged immediately. A background thread writes the latest status of every
+node (``participant_<idx>.json`` and its row in the nodes database) every ``flush_interval`` seconds, or as soon as
+a node joins or changes something other than its timestamp (role, neighbors, location...).
+
+Gunicorn runs several workers and every worker has its own store: the database decides which report of a node is
+the last one (older reports are not written), and the monitoring merges the database with the reports of the worker
+that are not written yet. Every report has a sequence number, written with the status of the node (``node_status``
+table, the last few statuses of every node) so every worker can read it: nodes compute their deltas from a status
+written (the sequence of the last one is sent back in the responses), and a delta is only applied to that status,
+never to the files.
+"""
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+
+from fedstellar.webserver.database import get_node_status, list_nodes_by_scenario_name, update_node_records
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def node_record(config, timestamp):
+    """
+    Returns:
+        tuple: Row of the node in the nodes database.
+    """
+    return (
+        str(config['device_args']['uid']), str(config['device_args']['idx']), str(config['network_args']['ip']), str(config['network_args']['port']),
+        str(config['device_args']['role']), str(config['network_args']['neighbors']), str(config['geo_args']['latitude']), str(config['geo_args']['longitude']),
+        timestamp.strftime(TIMESTAMP_FORMAT), str(config['scenario_args']['federation']), str(config['scenario_args']['name'])
+    )
+
+
+class _NodeState:
+    __slots__ = ("config", "record", "dirty", "written_mtime", "sequence")
+
+    def __init__(self, config, record, sequence=None):
+        self.config = config
+        self.record = record
+        self.dirty = True
+        self.written_mtime = None
+        self.sequence = sequence
+
+
+class NodeStateStore:
+    """
+    Args:
+        config_dir: Directory with the configuration of the scenarios (``<scenario>/participant_<idx>.json``).
+        flush_interval: Seconds between writes of the reports received.
+    """
+
+    def __init__(self, config_dir, flush_interval=5):
+        self.config_dir = config_dir
+        self.flush_interval = flush_interval
+        self.__states = {}
+        self.__files = {}  # Configurations read from disk by path: (mtime, config)
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__pid = None
+        atexit.register(self.flush)
+
+    def __path(self, scenario_name, idx):
+        return os.path.join(self.config_dir, scenario_name, f'participant_{idx}.json')
+
+    def __start(self):
+        # Gunicorn forks the workers, every process needs its own flusher
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            threading.Thread(target=self.__run, name="node-state-flusher", daemon=True).start()
+
+    def __run(self):
+        while True:
+            self.__wakeup.wait(self.flush_interval)
+            self.__wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("[NodeStateStore] Error writing the status of the nodes: {}".format(e))
+
+    def update(self, scenario_name, config, timestamp=None, sequence=None):
+        """
+        Stores the last status reported by a node.
+
+        Args:
+            scenario_name: Scenario of the node.
+            config: Complete status (participant configuration) of the node.
+            timestamp: Time of the report (now by default).
+            sequence: Sequence number of the report (the base of the next delta of the node).
+        """
+        record = node_record(config, timestamp or datetime.datetime.now())
+        key = (scenario_name, record[1])
+        with self.__lock:
+            self.__start()
+            state = self.__states.get(key)
+            # Joins and topology/role/location changes are written right away, heartbeats wait for the interval
+            material = state is None or state.record[:8] != record[:8] or state.record[9:] != record[9:]
+            if state is None:
+                state = self.__states[key] = _NodeState(config, record, sequence)
+            else:
+                state.config, state.record, state.dirty, state.sequence = config, record, True, sequence
+        if material:
+            self.__wakeup.set()
+
+    def get_reported(self, scenario_name, idx, sequence):
+        """
+        Returns:
+            dict: Status of the node with the sequence number, received by this worker or written by any worker (None
+            if it is unknown or too old).
+        """
+        with self.__lock:
+            state = self.__states.get((scenario_name, str(idx)))
+            if state is not None and state.sequence is not None and state.sequence == sequence:
+                return state.config
+        status = get_node_status(scenario_name, idx, sequence)
+        return json.loads(status[1]) if status is not None else None
+
+    def written_sequence(self, scenario_name, idx):
+        """
+        Returns:
+            str: Sequence number of the last status of the node written (readable by every worker), None if there is
+            none.
+        """
+        status = get_node_status(scenario_name, idx)
+        return status[0] if status is not None else None
+
+    def get_config(self, scenario_name, idx):
+        """
+        Returns:
+            dict: Last known status of the node (None if it is unknown).
+        """
+        path = self.__path(scenario_name, idx)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        with self.__lock:
+            state = self.__states.get((scenario_name, str(idx)))
+            # The file is newer if another worker wrote it after the last report received here
+            if state is not None and (state.dirty or mtime is None or mtime == state.written_mtime):
+                return state.config
+            cached = self.__files.get(path)
+            if mtime is None:
+                return None
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self.__lock:
+            self.__files[path] = (mtime, config)
+        return config
+
+    def nodes(self, scenario_name):
+        """
+        Returns:
+            list: Rows of the nodes of the scenario (as ``list_nodes_by_scenario_name``), with the reports not
+            written yet.
+        """
+        rows = {row[0]: row for row in list_nodes_by_scenario_name(scenario_name)}
+        with self.__lock:
+            for (scenario, _), state in self.__states.items():
+                if scenario != scenario_name:
+                    continue
+                row = rows.get(state.record[0])
+                if row is None or state.record[8] > row[8]:
+                    rows[state.record[0]] = state.record
+        return sorted(rows.values(), key=lambda row: row[1])
+
+    def forget(self, scenario_name):
+        """
+        Drops the reports of a scenario (before it is removed, so they are not written again).
+        """
+        with self.__lock:
+            for key in [key for key in self.__states if key[0] == scenario_name]:
+                del self.__states[key]
+            for path in [path for path in self.__files if os.path.dirname(path) == os.path.join(self.config_dir, scenario_name)]:
+                del self.__files[path]
+
+    def flush(self):
+        """
+        Writes the reports received since the last flush (database rows in a single transaction, then the files).
+        """
+        with self.__flush_lock:
+            with self.__lock:
+                pending = [(key, state, state.config, state.record, state.sequence) for key, state in self.__states.items() if state.dirty]
+                for _, state, _, _, _ in pending:
+                    state.dirty = False
+            if not pending:
+                return
+            try:
+                written = set(update_node_records(
+                    [record for _, _, _, record, _ in pending], newer_only=True,
+                    statuses=[(sequence, json.dumps(config)) if sequence is not None else None for _, _, config, _, sequence in pending],
+                ))
+            except Exception:
+                with self.__lock:
+                    for _, state, _, record, _ in pending:
+                        state.dirty = state.dirty or state.record is record
+                raise
+
+            for (scenario_name, idx), state, config, record, _ in pending:
+                if record not in written:
+                    continue
+                path = self.__path(scenario_name, idx)
+                tmp = "{}.{}.tmp".format(path, os.getpid())
+                try:
+                    with open(tmp, "w") as f:
+                        json.dump(config, f, sort_keys=False, indent=2)
+                    os.replace(tmp, path)  # Readers never see a partial file
+                    mtime = os.stat(path).st_mtime
+                except OSError as e:
+                    logging.error("[NodeStateStore] Error writing {}: {}".format(path, e))
+                    continue
+                with self.__lock:
+                    state.written_mtime = mtime
@@ -0,0 +1,168 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Cached rendering of the topology of the scenarios.
+
+The monitoring only computes a snapshot of the topology (nodes, roles and links) and its hash. The image is rendered
+by a background thread when the hash changes, at most once every ``debounce`` seconds per scenario, and written with
+the snapshot (``topology.json``) next to the configuration of the participants. Workers that find the snapshot of
+the same hash on disk do not render it again. Topologies too large to draw only have their snapshot written.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+
+def topology_snapshot(nodes_list, nodes_config):
+    """
+    Args:
+        nodes_list: Rows of the nodes of the scenario.
+        nodes_config: Configuration of every node (None if it is unknown).
+
+    Returns:
+        dict: Nodes (ip, port, role, ipdemo), links (pairs of node positions) and hash of the topology.
+    """
+    nodes = []
+    index = {}
+    for node, config in zip(nodes_list, nodes_config):
+        ipdemo = config["network_args"].get("ipdemo") if config else None
+        index[node[2] + ':' + str(node[3])] = len(nodes)
+        nodes.append((node[2], str(node[3]), node[4], ipdemo))
+    links = []
+    for i, node in enumerate(nodes_list):
+        for neighbor in node[5].split(" "):
+            j = index.get(neighbor)
+            if j is not None:  # Neighbors not reported yet are not drawn
+                links.append((i, j))
+    digest = hashlib.sha1(json.dumps([nodes, links]).encode()).hexdigest()
+    return {"hash": digest, "nodes": nodes, "links": links}
+
+
+class TopologyRenderer:
+    """
+    Args:
+        config_dir: Directory with the configuration of the scenarios.
+        debounce: Minimum seconds between two renders of a scenario.
+    """
+
+    def __init__(self, config_dir, debounce=2):
+        self.config_dir = config_dir
+        self.debounce = debounce
+        self.__snapshots = {}  # Last snapshot of every scenario
+        self.__pending = {}  # Scenario: (due time, snapshot)
+        self.__rendered = {}  # Scenario: time of the last render
+        self.__condition = threading.Condition()
+        self.__pid = None
+
+    def __start(self):
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            threading.Thread(target=self.__run, name="topology-renderer", daemon=True).start()
+
+    def update(self, scenario_name, nodes_list, nodes_config):
+        """
+        Updates the topology of a scenario, the image is rendered in the background if it changed.
+
+        Returns:
+            dict: Snapshot of the topology.
+        """
+        snapshot = topology_snapshot(nodes_list, nodes_config)
+        with self.__condition:
+            last = self.__snapshots.get(scenario_name)
+            if last is not None and last["hash"] == snapshot["hash"]:
+                return last
+            self.__snapshots[scenario_name] = snapshot
+            self.__start()
+            pending = self.__pending.get(scenario_name)
+            # Changes within the debounce window are rendered together, with the last snapshot
+            due = pending[0] if pending else max(time.monotonic(), self.__rendered.get(scenario_name, 0) + self.debounce)
+            self.__pending[scenario_name] = (due, snapshot)
+            self.__condition.notify()
+        return snapshot
+
+    def snapshot(self, scenario_name):
+        """
+        Returns:
+            dict: Last snapshot of the topology of the scenario (the one on disk if this worker has none).
+        """
+        with self.__condition:
+            snapshot = self.__snapshots.get(scenario_name)
+        if snapshot is not None:
+            return snapshot
+        try:
+            with open(os.path.join(self.config_dir, scenario_name, 'topology.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def forget(self, scenario_name):
+        with self.__condition:
+            self.__snapshots.pop(scenario_name, None)
+            self.__pending.pop(scenario_name, None)
+            self.__rendered.pop(scenario_name, None)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while True:
+                    now = time.monotonic()
+                    due = [scenario for scenario, (t, _) in self.__pending.items() if t <= now]
+                    if due:
+                        break
+                    self.__condition.wait(min(t for t, _ in self.__pending.values()) - now if self.__pending else None)
+                jobs = [(scenario, self.__pending.pop(scenario)[1]) for scenario in due]
+                for scenario in due:
+                    self.__rendered[scenario] = now
+            for scenario, snapshot in jobs:
+                try:
+                    self.render(scenario, snapshot)
+                except Exception as e:
+                    logging.error("[TopologyRenderer] Error rendering the topology of {}: {}".format(scenario, e))
+
+    def render(self, scenario_name, snapshot):
+        """
+        Draws the topology image and writes its snapshot (skipped if both are already on disk).
+        """
+        directory = os.path.join(self.config_dir, scenario_name)
+        image, snapshot_file = os.path.join(directory, 'topology.png'), os.path.join(directory, 'topology.json')
+        from fedstellar.utils.topologymanager import TopologyManager
+        n = len(snapshot["nodes"])
+        drawn = n <= TopologyManager.MAX_DRAWN_NODES
+        try:
+            with open(snapshot_file) as f:
+                if json.load(f)["hash"] == snapshot["hash"] and (not drawn or os.path.exists(image)):
+                    return
+        except (OSError, ValueError, KeyError):
+            pass
+
+        print("Updating topology (3D and image)... Num. nodes: " + str(n))
+        if drawn:
+            matrix = np.zeros((n, n))
+            if snapshot["links"]:
+                links = np.asarray(snapshot["links"])
+                matrix[links[:, 0], links[:, 1]] = 1
+            tm = TopologyManager(n_nodes=n, topology=matrix, scenario_name=scenario_name)
+            tm.add_nodes(snapshot["nodes"])
+            tmp = os.path.join(directory, 'topology.{}.tmp.png'.format(os.getpid()))
+            drawn = tm.draw_graph(path=tmp)
+            if drawn:
+                os.replace(tmp, image)
+        if not drawn:
+            # The image of a previous (smaller) topology is not shown for this one
+            try:
+                os.remove(image)
+            except FileNotFoundError:
+                pass
+        tmp = os.path.join(directory, 'topology.{}.tmp.json'.format(os.getpid()))
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, snapshot_file)
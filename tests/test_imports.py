@@ -0,0 +1,26 @@
+#
+# This file is part of the fedstellar framework (see https://github.com/enriquetomasmb/fedstellar).
+# Copyright (c) 2022 Enrique Tomás Martínez Beltrán.
+#
+
+
+"""
+Import time budgets of the entry points (see benchmarks.imports), skipped if an entry point can not be imported.
+
+    python -m pytest tests
+    FEDSTELLAR_IMPORT_BUDGET_SCALE=2 python -m pytest tests   # slower hosts
+"""
+import os
+
+import pytest
+
+from benchmarks.imports import ENTRY_POINTS, check_entry_point
+
+
+@pytest.mark.parametrize("module", list(ENTRY_POINTS))
+def test_entry_point_import(module):
+    seconds, budget, imported, error = check_entry_point(module, scale=float(os.environ.get("FEDSTELLAR_IMPORT_BUDGET_SCALE", 1)))
+    if error is not None:
+        pytest.skip("{} can not be imported: {}".format(module, error))
+    assert not imported, "{} imports {}".format(module, ", ".join(imported))
+    assert seconds <= budget, "{} takes {:.2f} s to import (budget {:.2f} s)".format(module, seconds, budget)